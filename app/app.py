@@ -10,9 +10,25 @@ from flask.ext.restful import Api
 from flask import Flask
 from flask_environments import Environments
 
+import metrics, routing, sqlite
 from models import db
-from resource import (PlayerListResource, PlayerResource, GameListResource,
-                      ChallengeListResource)
+from resource import (PlayerListResource, PlayerResource,
+                      PlayerRankResource, PlayerNeighborsResource,
+                      PlayerHistoryResource, GameListResource,
+                      GameExportResource, GameBatchResource,
+                      ChallengeListResource, MetricsResource,
+                      RatingReplayResource)
+
+
+class _Api(Api):
+    """Flask-RESTful's Api, but requests that time out waiting for a SQLite
+    lock get a 503 that the client can retry, rather than a 500."""
+
+    def handle_error(self, e):
+        response = sqlite.get_locked_response(e)
+        if response is None:
+            return super(_Api, self).handle_error(e)
+        return response
 
 
 def create_app():
@@ -21,12 +37,23 @@ def create_app():
     env = Environments(app)
     env.from_yaml(os.path.join(os.getcwd(), 'config.yaml'))
 
-    api = Api(app)
+    api = _Api(app)
+    api.representation('application/json')(metrics.output_json)
     api.add_resource(PlayerListResource, '/players')
     api.add_resource(PlayerResource, '/players/<string:name>')
+    api.add_resource(PlayerRankResource, '/players/<string:name>/rank')
+    api.add_resource(PlayerNeighborsResource,
+                     '/players/<string:name>/neighbors')
+    api.add_resource(PlayerHistoryResource, '/players/<string:name>/history')
     api.add_resource(GameListResource, '/games')
+    api.add_resource(GameExportResource, '/games/export')
+    api.add_resource(GameBatchResource, '/games/batch')
     api.add_resource(ChallengeListResource, '/challenges')
+    api.add_resource(RatingReplayResource, '/admin/replay')
+    api.add_resource(MetricsResource, '/metrics')
 
     db.init_app(app)
+    metrics.init_app(app)
+    routing.init_app(app)
 
     return app
@@ -0,0 +1,251 @@
+"""An in-memory copy of the ladder, already sorted, for serving GET /players.
+
+The ladder is read far more often than it changes, so rather than sorting every
+player for each read, each app keeps a `LadderCache` of the serialized players
+in ladder order. A page of the ladder is then just a slice of a list,
+and a player's rank is a binary search for their sort key.
+
+The cache is tagged with the ladder version (see `models.LadderState`) it was
+built from, and is rebuilt from the database whenever a read finds that the
+version has moved on, e.g. because another process changed the ladder. Writes
+made through `commit` are applied to the cache straight away by re-positioning
+just the players they changed, so that the next read doesn't need a rebuild.
+Any other change to players that this process commits (e.g. a bulk update)
+invalidates the cache instead.
+"""
+
+import bisect
+import itertools
+import threading
+
+from flask import current_app
+from flask.ext.sqlalchemy import SignallingSession
+from sqlalchemy import event
+
+import schemas
+from models import Player, db
+
+
+# Keys into `Session.info` for the players flushed in the current transaction,
+# and for whether the transaction changed players in ways that can't be
+# applied to the cache one player at a time.
+_FLUSHED_PLAYERS = 'ladder_flushed_players'
+_PLAYERS_STALE = 'ladder_players_stale'
+
+
+class LadderCache(object):
+    """The serialized players in ladder order, as of one ladder version.
+
+    This is safe to use from several threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+        # The ladder version the cache holds, or None if it must be rebuilt.
+        self.version = None
+
+        # The players' sort keys, in order, and their serialized forms at the
+        # same positions.
+        self._keys = []
+        self._players = []
+        self._keys_by_id = {}
+        self._ids_by_name = {}
+
+    def get_page(self, version, offset=0, limit=None, min_rating=None):
+        """Return part of the ladder, rebuilding the cache first if it isn't
+        of the given version.
+
+        Args:
+            version - the current ladder version.
+            offset - the number of players to skip.
+            limit - the maximum number of players to return, or None for all.
+            min_rating - if given, only players rated at least this are
+                returned.
+
+        Returns:
+            A list of serialized players, in ladder order.
+        """
+        with self._lock:
+            self._ensure_version(version)
+
+            end = len(self._keys)
+            if min_rating is not None:
+                end = bisect.bisect_left(self._keys, (-min_rating + 1,))
+            if limit is not None:
+                end = min(end, offset + limit)
+
+            return self._players[offset:end]
+
+    def get_rank(self, version, name):
+        """Return a player's rank, rebuilding the cache first if it isn't of
+        the given version.
+
+        Returns:
+            A pair (the player's position in the ladder counting from 1, the
+            number of players), or None if there is no player with the name.
+        """
+        with self._lock:
+            self._ensure_version(version)
+
+            idx = self._find(name)
+            if idx is None:
+                return None
+            return idx + 1, len(self._keys)
+
+    def get_neighbors(self, version, name, radius):
+        """Return the players around a player in the ladder, rebuilding the
+        cache first if it isn't of the given version.
+
+        Args:
+            version - the current ladder version.
+            name - the player's name.
+            radius - how many players above and below the player to return.
+
+        Returns:
+            A list of pairs (rank, serialized player) for the player and up to
+            `radius` players on either side of them in the ladder, or None if
+            there is no player with the name.
+        """
+        with self._lock:
+            self._ensure_version(version)
+
+            idx = self._find(name)
+            if idx is None:
+                return None
+
+            start = max(idx - radius, 0)
+            end = idx + radius + 1
+            return list(enumerate(self._players[start:end], start=start + 1))
+
+    def update(self, players, version):
+        """Apply the committed changes to some players.
+
+        The changes are only applied if they are the next version after the
+        one the cache holds. Otherwise some other change was missed, so the
+        cache is invalidated instead.
+
+        Args:
+            players - pairs (sort key, serialized player), as made by
+                `_snapshot`, for every player added or changed in the version.
+            version - the ladder version that the changes were committed as.
+        """
+        with self._lock:
+            if self.version is None or self.version != version - 1:
+                self.version = None
+                return
+
+            for key, player in players:
+                old_key = self._keys_by_id.get(key[-1])
+                if old_key is not None:
+                    idx = bisect.bisect_left(self._keys, old_key)
+                    del self._keys[idx]
+                    del self._players[idx]
+
+                idx = bisect.bisect_left(self._keys, key)
+                self._keys.insert(idx, key)
+                self._players.insert(idx, player)
+                self._keys_by_id[key[-1]] = key
+                self._ids_by_name[player['name']] = key[-1]
+
+            self.version = version
+
+    def invalidate(self):
+        with self._lock:
+            self.version = None
+
+    def _ensure_version(self, version):
+        if self.version == version:
+            return
+
+        snapshots = sorted(_snapshot(player) for player in Player.query)
+
+        self._keys = [key for key, _ in snapshots]
+        self._players = [player for _, player in snapshots]
+        self._keys_by_id = dict((key[-1], key) for key in self._keys)
+        self._ids_by_name = dict(
+            (player['name'], key[-1]) for key, player in snapshots)
+        self.version = version
+
+    def _find(self, name):
+        """Return the index of the player with the given name, or None."""
+        player_id = self._ids_by_name.get(name)
+        if player_id is None:
+            return None
+        return bisect.bisect_left(self._keys, self._keys_by_id[player_id])
+
+
+def get_cache():
+    """Return the current app's ladder cache."""
+    return current_app.extensions.setdefault('ladder_cache', LadderCache())
+
+
+def commit(version):
+    """Commit the session and apply its changes to players to the cache.
+
+    Args:
+        version - the ladder version that this transaction bumped the ladder
+            to, as returned by `models.bump_ladder_version`.
+    """
+    db.session.flush()
+    players = db.session.info.pop(_FLUSHED_PLAYERS, {})
+    is_stale = db.session.info.pop(_PLAYERS_STALE, False)
+
+    db.session.commit()
+
+    if is_stale:
+        get_cache().invalidate()
+    else:
+        get_cache().update(players.values(), version)
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _snapshot(player):
+    """Return a pair (sort key, serialized player) for a player.
+
+    Sort keys sort in ladder order: rating descending, games played
+    descending, join date ascending, then ID. The ID is always last.
+    """
+    key = (
+        -player.rating,
+        -(player.num_wins + player.num_losses),
+        player.time_created,
+        player.id
+    )
+    return key, schemas.serialize_player(player)
+
+
+@event.listens_for(SignallingSession, 'after_flush')
+def _record_flushed_players(session, flush_context):
+    players = session.info.setdefault(_FLUSHED_PLAYERS, {})
+    for obj in itertools.chain(session.new, session.dirty):
+        if isinstance(obj, Player):
+            players[obj.id] = _snapshot(obj)
+
+    if any(isinstance(obj, Player) for obj in session.deleted):
+        session.info[_PLAYERS_STALE] = True
+
+
+@event.listens_for(SignallingSession, 'after_bulk_update')
+@event.listens_for(SignallingSession, 'after_bulk_delete')
+def _record_bulk_change(context):
+    if context.mapper.class_ is Player:
+        context.session.info[_PLAYERS_STALE] = True
+
+
+@event.listens_for(SignallingSession, 'after_commit')
+def _invalidate_after_other_commits(session):
+    # Only reached with changes to players if they were committed other than
+    # by `commit`.
+    players = session.info.pop(_FLUSHED_PLAYERS, None)
+    is_stale = session.info.pop(_PLAYERS_STALE, False)
+    if players or is_stale:
+        get_cache().invalidate()
+
+
+@event.listens_for(SignallingSession, 'after_soft_rollback')
+def _forget_rolled_back_players(session, previous_transaction):
+    session.info.pop(_FLUSHED_PLAYERS, None)
+    session.info.pop(_PLAYERS_STALE, None)
@@ -0,0 +1,219 @@
+"""Per-endpoint timings of the requests each app has handled.
+
+For every request this records how many SQL statements it ran and how long
+they took, how long encoding the response body took, and the request's total
+time. The totals for each endpoint are kept in memory by each app's `Metrics`,
+and are served by `GET /metrics` in Prometheus's text format. Each process
+keeps its own totals, so a service run as several processes must be scraped
+once per process.
+
+A streamed response, e.g. from `GET /games/export`, runs most of its
+statements while its body is sent, so it's only recorded once it has been
+sent.
+
+If the `SERVER_TIMING` config value is true, each response also carries the
+request's own timings in a `Server-Timing` header, which browsers' developer
+tools show alongside the request. Streamed responses don't, since their
+headers are sent before most of their work is done.
+"""
+
+import threading
+import time
+import types
+
+from flask import current_app, has_request_context, request
+from flask.ext.restful.representations.json import output_json as _output_json
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+
+# The content type of Prometheus's text format.
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# The endpoint label for requests that matched no URL rule.
+UNMATCHED_ENDPOINT = 'unmatched'
+
+# Each metric, as a tuple (name, type, help, `RequestTimings` attribute).
+_METRICS = (
+    ('ladder_requests_total', 'counter',
+     'Requests handled.', 'num_requests'),
+    ('ladder_sql_statements_total', 'counter',
+     'SQL statements executed.', 'num_statements'),
+    ('ladder_sql_seconds_total', 'counter',
+     'Time spent executing SQL statements.', 'sql_seconds'),
+    ('ladder_serialization_seconds_total', 'counter',
+     'Time spent encoding response bodies.', 'serialization_seconds'),
+    ('ladder_request_seconds_total', 'counter',
+     'Time spent handling requests, from start to response.',
+     'request_seconds'),
+)
+
+
+class RequestTimings(object):
+    """The timings of one request, or the totals of many."""
+
+    def __init__(self):
+        self.num_requests = 0
+        self.num_statements = 0
+        self.sql_seconds = 0.0
+        self.serialization_seconds = 0.0
+        self.request_seconds = 0.0
+
+        # When the statement being executed started, if any.
+        self._statement_start = None
+
+    def add(self, other):
+        self.num_requests += other.num_requests
+        self.num_statements += other.num_statements
+        self.sql_seconds += other.sql_seconds
+        self.serialization_seconds += other.serialization_seconds
+        self.request_seconds += other.request_seconds
+
+    def get_server_timing(self):
+        """Return the timings as the value of a `Server-Timing` header."""
+        return ', '.join([
+            'sql;dur=%.3f;desc="%d statements"' % (self.sql_seconds * 1000,
+                                                   self.num_statements),
+            'serialization;dur=%.3f' % (self.serialization_seconds * 1000),
+            'total;dur=%.3f' % (self.request_seconds * 1000),
+        ])
+
+
+class Metrics(object):
+    """The total timings of an app's requests, for each endpoint.
+
+    This is safe to use from several threads at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._totals = {}
+
+    def record(self, endpoint, method, timings):
+        """Add a finished request's timings to its endpoint's totals.
+
+        Args:
+            endpoint - the URL rule the request matched.
+            method - the request's HTTP method.
+            timings - the request's `RequestTimings`.
+        """
+        with self._lock:
+            totals = self._totals.get((endpoint, method))
+            if totals is None:
+                totals = self._totals[endpoint, method] = RequestTimings()
+            totals.add(timings)
+
+    def render(self):
+        """Return the totals in Prometheus's text format."""
+        with self._lock:
+            totals = sorted(
+                (key, [getattr(timings, attribute)
+                       for _, _, _, attribute in _METRICS])
+                for key, timings in self._totals.iteritems()
+            )
+
+        lines = []
+        for idx, (name, type_, help_, _) in enumerate(_METRICS):
+            lines.append('# HELP %s %s' % (name, help_))
+            lines.append('# TYPE %s %s' % (name, type_))
+            for (endpoint, method), values in totals:
+                lines.append('%s{endpoint="%s",method="%s"} %s' % (
+                    name,
+                    _escape_label(endpoint),
+                    _escape_label(method),
+                    values[idx]
+                ))
+        return '\n'.join(lines) + '\n'
+
+
+def init_app(app):
+    """Record the timings of the app's requests."""
+    app.extensions['metrics'] = Metrics()
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+
+
+def get_metrics():
+    """Return the current app's `Metrics`."""
+    return current_app.extensions['metrics']
+
+
+def output_json(data, code, headers=None):
+    """Encode a response body as JSON, timing how long it takes.
+
+    This replaces Flask-RESTful's JSON representation.
+    """
+    start = time.time()
+    response = _output_json(data, code, headers)
+
+    timings = _get_request_timings()
+    if timings is not None:
+        timings.serialization_seconds += time.time() - start
+    return response
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _start_request():
+    request.timings = RequestTimings()
+    request.timings.num_requests = 1
+    request.timings_start = time.time()
+
+
+def _finish_request(response):
+    timings = _get_request_timings()
+    if timings is None:
+        # A before_request function ran before ours and returned a response.
+        return response
+
+    metrics = get_metrics()
+    endpoint = UNMATCHED_ENDPOINT
+    if request.url_rule is not None:
+        endpoint = request.url_rule.rule
+    method = request.method
+    start = request.timings_start
+
+    def record():
+        timings.request_seconds = time.time() - start
+        metrics.record(endpoint, method, timings)
+
+    if isinstance(response.response, types.GeneratorType):
+        # The body is generated, and its statements run in the request's
+        # context, as it's sent.
+        response.call_on_close(record)
+        return response
+
+    record()
+    if current_app.config.get('SERVER_TIMING'):
+        response.headers['Server-Timing'] = timings.get_server_timing()
+    return response
+
+
+def _get_request_timings():
+    if not has_request_context():
+        return None
+    return getattr(request, 'timings', None)
+
+
+def _escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement(conn, cursor, statement, parameters, context,
+                     executemany):
+    timings = _get_request_timings()
+    if timings is not None:
+        timings._statement_start = time.time()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _finish_statement(conn, cursor, statement, parameters, context,
+                      executemany):
+    timings = _get_request_timings()
+    if timings is not None and timings._statement_start is not None:
+        timings.num_statements += 1
+        timings.sql_seconds += time.time() - timings._statement_start
+        timings._statement_start = None
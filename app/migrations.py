@@ -0,0 +1,209 @@
+"""Schema migrations for existing databases.
+
+A new database is created straight from the models, but a database created by
+an older version of the service has to be brought up to date one change at a
+time. Each migration is a function that takes a connection and makes one
+change to the schema; `MIGRATIONS` lists them in the order they are applied.
+The names of the migrations that have been applied are recorded in the
+`schema_migration` table so that each one only runs once.
+
+Migrations describe the schema as it was when they were written rather than
+importing it from `models.py`, so that they keep working as the models change.
+Each one also checks what already exists before changing anything, because
+some databases were partly upgraded by hand before migrations existed.
+"""
+
+from sqlalchemy import (Column, DateTime, ForeignKey, Index, Integer,
+                        MetaData, Table, inspect)
+
+import util
+from models import db
+
+
+schema_migration = db.Table(
+    'schema_migration',
+    db.Column('name', db.String(100), primary_key=True),
+    db.Column('time_applied', db.DateTime)
+)
+
+
+def _add_player_counters(connection):
+    columns = (
+        ('num_wins', 0),
+        ('num_losses', 0),
+        ('num_challenges_submitted', 0),
+        ('num_challenges_received', 0),
+        ('version', 1),
+    )
+    for name, default in columns:
+        _add_column(connection, 'player', name, 'INTEGER NOT NULL DEFAULT %d' %
+                    default)
+
+    connection.execute("""
+        UPDATE player SET
+            num_wins = (
+                SELECT count(*) FROM game
+                WHERE game.winner_id = player.id),
+            num_losses = (
+                SELECT count(*) FROM game
+                WHERE game.loser_id = player.id),
+            num_challenges_submitted = (
+                SELECT count(*) FROM challenge
+                WHERE challenge.challenger_id = player.id),
+            num_challenges_received = (
+                SELECT count(*) FROM challenge
+                WHERE challenge.challenged_id = player.id)
+    """)
+
+
+def _add_time_created_indexes(connection):
+    _create_index(connection, 'ix_game_time_created_id', 'game',
+                  'time_created', 'id')
+    _create_index(connection, 'ix_challenge_time_created_id', 'challenge',
+                  'time_created', 'id')
+
+
+def _add_rating_change(connection):
+    metadata = MetaData()
+    Table('player', metadata, Column('id', Integer, primary_key=True))
+    Table('game', metadata, Column('id', Integer, primary_key=True))
+    rating_change = Table(
+        'rating_change',
+        metadata,
+        Column('id', Integer, primary_key=True),
+        Column('game_id', Integer, ForeignKey('game.id')),
+        Column('player_id', Integer, ForeignKey('player.id')),
+        Column('rating_before', Integer),
+        Column('rating_after', Integer),
+        Column('delta', Integer),
+        Column('k_value', Integer),
+        Column('time_created', DateTime),
+    )
+    rating_change.create(connection, checkfirst=True)
+    _create_index(connection, 'ix_rating_change_player_id_time_created',
+                  'rating_change', 'player_id', 'time_created')
+
+
+def _add_lookup_indexes(connection):
+    _create_index(connection, 'ix_player_rating', 'player', 'rating')
+    _create_index(connection, 'ix_game_winner_id', 'game', 'winner_id')
+    _create_index(connection, 'ix_game_loser_id', 'game', 'loser_id')
+    _create_index(connection, 'ix_challenge_challenger_id', 'challenge',
+                  'challenger_id')
+    _create_index(connection, 'ix_challenge_challenged_id', 'challenge',
+                  'challenged_id')
+    _create_index(connection, 'ix_challenge_game_id', 'challenge', 'game_id')
+    _create_index(connection, 'ix_rating_change_game_id', 'rating_change',
+                  'game_id')
+
+
+def _add_challenge_player_pair(connection):
+    _add_column(connection, 'challenge', 'min_player_id', 'INTEGER')
+    _add_column(connection, 'challenge', 'max_player_id', 'INTEGER')
+
+    connection.execute("""
+        UPDATE challenge SET
+            min_player_id = CASE WHEN challenger_id < challenged_id
+                                 THEN challenger_id ELSE challenged_id END,
+            max_player_id = CASE WHEN challenger_id < challenged_id
+                                 THEN challenged_id ELSE challenger_id END
+    """)
+
+    # This fails if two players already have more than one open challenge
+    # between them, in which case all but one must be removed by hand.
+    indexes = inspect(connection).get_indexes('challenge')
+    if 'uq_challenge_open_pair' not in [index['name'] for index in indexes]:
+        connection.execute("""
+            CREATE UNIQUE INDEX uq_challenge_open_pair
+            ON challenge (min_player_id, max_player_id)
+            WHERE game_id IS NULL
+        """)
+
+
+def _add_ladder_state(connection):
+    ladder_state = Table(
+        'ladder_state',
+        MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('version', Integer, nullable=False),
+        Column('time_modified', DateTime),
+    )
+    ladder_state.create(connection, checkfirst=True)
+
+    row = connection.execute(
+        ladder_state.select().where(ladder_state.c.id == 1)).first()
+    if row is None:
+        # Seeded as never modified, like a newly created database.
+        connection.execute(
+            ladder_state.insert(),
+            id=1,
+            version=0,
+            time_modified=None
+        )
+
+
+# Every migration, oldest first, as pairs (name, function). Never reorder or
+# rename these; only append.
+MIGRATIONS = [
+    ('0001_player_counters', _add_player_counters),
+    ('0002_time_created_indexes', _add_time_created_indexes),
+    ('0003_rating_change', _add_rating_change),
+    ('0004_lookup_indexes', _add_lookup_indexes),
+    ('0005_challenge_player_pair', _add_challenge_player_pair),
+    ('0006_ladder_state', _add_ladder_state),
+]
+
+
+def upgrade():
+    """Create the database, or apply any migrations it is missing.
+
+    A database with no tables is created from the models and marked as having
+    had every migration applied.
+
+    Returns:
+        A list of the names of the migrations that were applied.
+    """
+    if not inspect(db.engine).get_table_names():
+        db.create_all()
+        _record_migrations([name for name, _ in MIGRATIONS])
+        return []
+
+    schema_migration.create(db.engine, checkfirst=True)
+    applied = set(
+        row.name for row in db.engine.execute(schema_migration.select()))
+
+    pending = [(name, migrate) for name, migrate in MIGRATIONS
+               if name not in applied]
+    for name, migrate in pending:
+        with db.engine.begin() as connection:
+            migrate(connection)
+            connection.execute(
+                schema_migration.insert(),
+                name=name,
+                time_applied=util.now()
+            )
+
+    return [name for name, _ in pending]
+
+
+def _record_migrations(names):
+    db.engine.execute(
+        schema_migration.insert(),
+        [{'name': name, 'time_applied': util.now()} for name in names]
+    )
+
+
+def _add_column(connection, table_name, column_name, column_ddl):
+    columns = inspect(connection).get_columns(table_name)
+    if column_name not in [column['name'] for column in columns]:
+        connection.execute('ALTER TABLE %s ADD COLUMN %s %s' %
+                           (table_name, column_name, column_ddl))
+
+
+def _create_index(connection, index_name, table_name, *column_names):
+    indexes = inspect(connection).get_indexes(table_name)
+    if index_name not in [index['name'] for index in indexes]:
+        table = Table(table_name, MetaData(),
+                      *[Column(name) for name in column_names])
+        Index(index_name, *[table.c[name] for name in column_names]) \
+            .create(connection)
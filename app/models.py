@@ -2,39 +2,113 @@
 
 Each person in the ladder is a `Player`. Each `Game` has two `Player`s, the
 winner and the loser. A `Challenge` is issued by one `Player` to another, and
-is open until a game between those two players has been played.
+is open until a game between those two players has been played. Each game
+records a `RatingChange` for both of its players.
+
+A `Player`'s win, loss and challenge counts are stored on the player row and
+are kept up to date by the resource layer as games and challenges are added.
+`reconcile_player_counters` recomputes them from the game and challenge tables.
+
+`LadderState` is a single row whose version is bumped by every change to the
+ladder, so clients can cheaply tell whether anything has changed.
 """
 
 
+import threading
+import weakref
+
+from sqlalchemy import DDL, event
 from sqlalchemy.ext.hybrid import hybrid_property
-from flask.ext.sqlalchemy import SQLAlchemy
+from flask.ext.sqlalchemy import SignallingSession, SQLAlchemy
+
+import routing, sqlite, util
+
+
+class _RoutingSession(SignallingSession):
+    """A session that sends the statements of requests that only read to the
+    read engine, if there is one.
+
+    See `routing.py`.
+    """
+
+    def get_bind(self, mapper=None, clause=None):
+        if not self._flushing and routing.use_read_bind():
+            return db.get_engine(self.app, bind=routing.READ_BIND)
+        return super(_RoutingSession, self).get_bind(mapper, clause)
 
 
-db = SQLAlchemy()
+class _SQLAlchemy(SQLAlchemy):
+    """Flask-SQLAlchemy, with reads routed to a read engine, and SQLite
+    databases tuned, as set in the config.
+
+    See `routing.py` and `sqlite.py`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(_SQLAlchemy, self).__init__(*args, **kwargs)
+        self._tuned_engines_lock = threading.Lock()
+        self._tuned_engines = weakref.WeakSet()
+
+    def create_session(self, options):
+        return _RoutingSession(self, **options)
+
+    def apply_driver_hacks(self, app, info, options):
+        super(_SQLAlchemy, self).apply_driver_hacks(app, info, options)
+        if info.drivername == 'sqlite':
+            sqlite.apply_driver_hacks(app.config, info, options)
+
+    def get_engine(self, app, bind=None):
+        # Flask-SQLAlchemy creates engines lazily, and again whenever the
+        # database URI changes, so each one is tuned the first time it's
+        # returned.
+        with self._tuned_engines_lock:
+            engine = super(_SQLAlchemy, self).get_engine(app, bind)
+            if engine.dialect.name == 'sqlite' and \
+                    engine not in self._tuned_engines:
+                sqlite.init_engine(engine, app.config)
+                self._tuned_engines.add(engine)
+            return engine
+
+
+db = _SQLAlchemy()
 
 
 class Player(db.Model):
     """Represents a ping pong player."""
 
     __tablename__ = 'player'
+    __table_args__ = (
+        db.Index('ix_player_rating', 'rating'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column('name', db.String(30), unique=True)
     rating = db.Column('rating', db.Integer)
     time_created = db.Column('time_created', db.DateTime)
 
+    num_wins = db.Column(
+        'num_wins', db.Integer, nullable=False, default=0, server_default='0')
+    num_losses = db.Column(
+        'num_losses', db.Integer,
+        nullable=False, default=0, server_default='0')
+    num_challenges_submitted = db.Column(
+        'num_challenges_submitted', db.Integer,
+        nullable=False, default=0, server_default='0')
+    num_challenges_received = db.Column(
+        'num_challenges_received', db.Integer,
+        nullable=False, default=0, server_default='0')
+
+    # Incremented by every UPDATE so that concurrent writers can't clobber each
+    # other's changes (e.g. two games read the same rating and both write it).
+    version = db.Column(
+        'version', db.Integer, nullable=False, default=1, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+
     @hybrid_property
     def games(self):
         return self.won_games + self.lost_games
 
-    @hybrid_property
-    def num_wins(self):
-        return Game.query.filter(Game.winner == self).count()
-
-    @hybrid_property
-    def num_losses(self):
-        return Game.query.filter(Game.loser == self).count()
-
     @hybrid_property
     def num_games(self):
         return self.num_wins + self.num_losses
@@ -43,14 +117,6 @@ class Player(db.Model):
     def challenges(self):
         return self.challenges_submitted + self.challenges_received
 
-    @hybrid_property
-    def num_challenges_submitted(self):
-        return Challenge.query.filter(Challenge.challenger == self).count()
-
-    @hybrid_property
-    def num_challenges_received(self):
-        return Challenge.query.filter(Challenge.challenged == self).count()
-
     @hybrid_property
     def num_challenges(self):
         return self.num_challenges_received + self.num_challenges_submitted
@@ -64,16 +130,20 @@ class Game(db.Model):
     """A game played between two ping pong players."""
 
     __tablename__ = 'game'
+    __table_args__ = (
+        db.Index('ix_game_time_created_id', 'time_created', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
 
-    winner_id = db.Column(db.Integer, db.ForeignKey('player.id'))
+    winner_id = db.Column(db.Integer, db.ForeignKey('player.id'), index=True)
     winner = db.relationship(
         Player,
         foreign_keys=[winner_id],
         backref=db.backref('won_games')
     )
 
-    loser_id = db.Column(db.Integer, db.ForeignKey('player.id'))
+    loser_id = db.Column(db.Integer, db.ForeignKey('player.id'), index=True)
     loser = db.relationship(
         Player,
         foreign_keys=[loser_id],
@@ -99,26 +169,37 @@ class Challenge(db.Model):
     """
 
     __tablename__ = 'challenge'
+    __table_args__ = (
+        db.Index('ix_challenge_time_created_id', 'time_created', 'id'),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
 
-    challenger_id = db.Column(db.Integer, db.ForeignKey('player.id'))
+    challenger_id = db.Column(
+        db.Integer, db.ForeignKey('player.id'), index=True)
     challenger = db.relationship(
         Player,
         foreign_keys=[challenger_id],
         backref=db.backref('challenges_submitted')
     )
 
-    challenged_id = db.Column(db.Integer, db.ForeignKey('player.id'))
+    challenged_id = db.Column(
+        db.Integer, db.ForeignKey('player.id'), index=True)
     challenged = db.relationship(
         Player,
         foreign_keys=[challenged_id],
         backref=db.backref('challenges_received')
     )
 
+    # The two players' IDs in ascending order, so that a challenge between two
+    # players can be found by a single index probe no matter who issued it.
+    # These are set from challenger_id and challenged_id when it is inserted.
+    min_player_id = db.Column('min_player_id', db.Integer)
+    max_player_id = db.Column('max_player_id', db.Integer)
+
     time_created = db.Column('time_created', db.DateTime)
 
-    game_id = db.Column(db.Integer, db.ForeignKey('game.id'))
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), index=True)
     game = db.relationship(
         Game,
         backref=db.backref('challenge', uselist=False)
@@ -133,3 +214,154 @@ class Challenge(db.Model):
         """Return True iff a game has been played by these players after the
         challenge."""
         return self.game is not None
+
+
+# There can be at most one open challenge between any two players.
+db.Index(
+    'uq_challenge_open_pair',
+    Challenge.min_player_id,
+    Challenge.max_player_id,
+    unique=True,
+    sqlite_where=Challenge.game_id == None,
+    postgresql_where=Challenge.game_id == None
+)
+
+
+@event.listens_for(Challenge, 'before_insert')
+def _set_challenge_player_pair(mapper, connection, challenge):
+    challenge.min_player_id, challenge.max_player_id = \
+        sorted([challenge.challenger_id, challenge.challenged_id])
+
+
+class RatingChange(db.Model):
+    """The change to one player's rating caused by one game.
+
+    Each game has two of these, one for the winner and one for the loser.
+    `time_created` is copied from the game so that a player's rating history
+    can be read without joining to the game table.
+    """
+
+    __tablename__ = 'rating_change'
+    __table_args__ = (
+        db.Index(
+            'ix_rating_change_player_id_time_created',
+            'player_id',
+            'time_created'
+        ),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+
+    game_id = db.Column(db.Integer, db.ForeignKey('game.id'), index=True)
+    game = db.relationship(Game, backref=db.backref('rating_changes'))
+
+    player_id = db.Column(db.Integer, db.ForeignKey('player.id'))
+    player = db.relationship(Player, backref=db.backref('rating_changes'))
+
+    rating_before = db.Column('rating_before', db.Integer)
+    rating_after = db.Column('rating_after', db.Integer)
+    delta = db.Column('delta', db.Integer)
+    k_value = db.Column('k_value', db.Integer)
+
+    time_created = db.Column('time_created', db.DateTime)
+
+    def __repr__(self):
+        return 'RatingChange(player %s, game %s: %d -> %d)' % \
+            (self.player_id, self.game_id, self.rating_before,
+             self.rating_after)
+
+
+class LadderState(db.Model):
+    """The version of the ladder as a whole.
+
+    There is only ever one row, with ID `LADDER_STATE_ID`, which is inserted
+    when the table is created. Every transaction that changes the ladder calls
+    `bump_ladder_version`.
+    """
+
+    __tablename__ = 'ladder_state'
+
+    id = db.Column(db.Integer, primary_key=True)
+    version = db.Column('version', db.Integer, nullable=False, default=0)
+    time_modified = db.Column('time_modified', db.DateTime)
+
+
+LADDER_STATE_ID = 1
+
+event.listen(
+    LadderState.__table__,
+    'after_create',
+    DDL('INSERT INTO ladder_state (id, version) VALUES (%d, 0)' %
+        LADDER_STATE_ID)
+)
+
+
+def get_ladder_state():
+    """Return the ladder's current version and when it was last modified.
+
+    This reads a single row by primary key, and doesn't touch any of the other
+    tables.
+
+    Returns:
+        A pair (version, time modified). The time is None if the ladder has
+        never been modified.
+    """
+    return db.session.query(LadderState.version, LadderState.time_modified) \
+        .filter(LadderState.id == LADDER_STATE_ID) \
+        .one()
+
+
+def bump_ladder_version():
+    """Add one to the ladder's version in the current transaction.
+
+    Call this last, just before committing, so that the row is locked for as
+    little time as possible.
+
+    Returns:
+        The new version.
+    """
+    LadderState.query \
+        .filter(LadderState.id == LADDER_STATE_ID) \
+        .update(
+            {
+                LadderState.version: LadderState.version + 1,
+                LadderState.time_modified: util.now(),
+            },
+            synchronize_session=False
+        )
+
+    return db.session.query(LadderState.version) \
+        .filter(LadderState.id == LADDER_STATE_ID) \
+        .scalar()
+
+
+def reconcile_player_counters():
+    """Recompute every player's counter columns from the game and challenge
+    tables.
+
+    This is a single UPDATE with correlated subqueries, so it is cheap enough
+    to run as a backfill after upgrading or whenever the counters are suspected
+    to have drifted (e.g. after editing rows by hand).
+
+    Returns:
+        The number of players updated.
+    """
+    def count_rows(model, player_id_column):
+        return db.select([db.func.count(model.id)]) \
+            .where(player_id_column == Player.id) \
+            .as_scalar()
+
+    counts = {
+        Player.num_wins: count_rows(Game, Game.winner_id),
+        Player.num_losses: count_rows(Game, Game.loser_id),
+        Player.num_challenges_submitted:
+            count_rows(Challenge, Challenge.challenger_id),
+        Player.num_challenges_received:
+            count_rows(Challenge, Challenge.challenged_id),
+        Player.version: Player.version + 1,
+    }
+
+    num_updated = Player.query.update(counts, synchronize_session=False)
+    bump_ladder_version()
+    db.session.commit()
+    return num_updated
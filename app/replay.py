@@ -0,0 +1,151 @@
+"""Recompute ratings by replaying the game log.
+
+Ratings are only ever updated incrementally as games are added, so changing
+how they are computed (e.g. `elo.compute_k_value` or the starter rating) has no
+effect on existing players. Replaying every game in order, starting each player
+at the starter rating, recomputes what their ratings would have been.
+
+Games are streamed from the database in chunks, and ratings are kept in a flat
+array indexed by each player's position rather than in ORM objects, so a
+replay runs in roughly constant memory and takes seconds for a million games.
+
+A replay can also rewrite the `rating_change` table to match the replayed
+ratings, which is how history is backfilled for games recorded before that
+table existed.
+"""
+
+from array import array
+
+from sqlalchemy import bindparam, select
+
+import elo
+from models import Game, Player, RatingChange, bump_ladder_version, db
+
+
+# How many games are fetched from the database at a time.
+REPLAY_CHUNK_SIZE = 10000
+
+
+def replay_ratings(starter_rating, rewrite_history=False):
+    """Recompute every player's rating from the game log.
+
+    Args:
+        starter_rating - the rating each player starts with before their first
+            game.
+        rewrite_history - iff True, every `RatingChange` is replaced by those
+            from the replay. This is done in the current transaction, which is
+            committed by `apply_ratings`.
+
+    Returns:
+        A tuple (number of games replayed, list of players, list of skipped
+        game IDs). Each player is a tuple (id, name, current rating, replayed
+        rating), ordered by ID. Games are skipped, rather than failing the
+        whole replay, if either of their players wasn't loaded, e.g. because
+        the player was deleted or was added after the replay started.
+    """
+    players = db.session.execute(
+        select([Player.id, Player.name, Player.rating]).order_by(Player.id)
+    ).fetchall()
+
+    index_by_id = dict((player.id, idx) for idx, player in enumerate(players))
+    ratings = array('l', [starter_rating]) * len(players)
+
+    if rewrite_history:
+        RatingChange.query.delete(synchronize_session=False)
+
+    games = db.session.execute(
+        select([
+            Game.id,
+            Game.winner_id,
+            Game.loser_id,
+            Game.winner_score,
+            Game.time_created
+        ])
+        .order_by(Game.time_created, Game.id)
+        .execution_options(stream_results=True)
+    )
+
+    num_games = 0
+    skipped_game_ids = []
+    elo_update = elo.elo_update
+    k_values = {
+        True: elo.compute_k_value(True),
+        False: elo.compute_k_value(False),
+    }
+    while True:
+        chunk = games.fetchmany(REPLAY_CHUNK_SIZE)
+        if not chunk:
+            break
+
+        history = []
+        for game_id, winner_id, loser_id, winner_score, time_created in chunk:
+            winner_idx = index_by_id.get(winner_id)
+            loser_idx = index_by_id.get(loser_id)
+            if winner_idx is None or loser_idx is None:
+                skipped_game_ids.append(game_id)
+                continue
+
+            winner_before = ratings[winner_idx]
+            loser_before = ratings[loser_idx]
+            is_game_to_11 = winner_score == 11
+
+            ratings[winner_idx], ratings[loser_idx] = elo_update(
+                winner_before, loser_before, is_game_to_11)
+
+            if rewrite_history:
+                k_value = k_values[is_game_to_11]
+                for player_id, before, after in (
+                    (winner_id, winner_before, ratings[winner_idx]),
+                    (loser_id, loser_before, ratings[loser_idx]),
+                ):
+                    history.append({
+                        'game_id': game_id,
+                        'player_id': player_id,
+                        'rating_before': before,
+                        'rating_after': after,
+                        'delta': after - before,
+                        'k_value': k_value,
+                        'time_created': time_created,
+                    })
+
+        if history:
+            db.session.execute(RatingChange.__table__.insert(), history)
+        num_games += len(chunk)
+    num_games -= len(skipped_game_ids)
+
+    replayed = [
+        (player.id, player.name, player.rating, rating)
+        for player, rating in zip(players, ratings)
+    ]
+    return num_games, replayed, skipped_game_ids
+
+
+def apply_ratings(players):
+    """Write replayed ratings to the database and commit them.
+
+    Args:
+        players - the list of players returned by `replay_ratings`.
+
+    Returns:
+        The number of players whose rating changed.
+    """
+    changed = [
+        {'player_id': player_id, 'new_rating': new_rating}
+        for player_id, _, old_rating, new_rating in players
+        if old_rating != new_rating
+    ]
+
+    if changed:
+        db.session.execute(
+            Player.__table__.update()
+            .where(Player.id == bindparam('player_id'))
+            .values(
+                rating=bindparam('new_rating'),
+                version=Player.version + 1
+            ),
+            changed
+        )
+    bump_ladder_version()
+    db.session.commit()
+
+    return len(changed)
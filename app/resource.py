@@ -1,16 +1,53 @@
+import csv
+import functools
+import hmac
+import urllib
+from cStringIO import StringIO
+
+from flask import (current_app, has_request_context, request,
+                   stream_with_context)
 from flask.ext.restful import Resource, abort
+from flask.ext.restful.utils import unpack
 
-from sqlalchemy import and_, or_
+from sqlalchemy import or_, select
+from sqlalchemy.orm import aliased, joinedload
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from webargs import fields, validate, ValidationError
 from webargs.flaskparser import use_kwargs, parser
+from werkzeug.http import http_date, quote_etag
 
-import elo, schemas, util
-from models import Challenge, Game, Player, db
+import elo, ladder, metrics, replay, schemas, util
+from models import (Challenge, Game, Player, RatingChange,
+                    bump_ladder_version, db, get_ladder_state)
 
 
 # TODO: get this from the config
 DEFAULT_INITIAL_RATING = 1200
 
+# How many times a write is attempted when it conflicts with a concurrent one.
+MAX_COMMIT_ATTEMPTS = 3
+
+# The most games that can be added in one POST to /games/batch.
+MAX_GAMES_PER_BATCH = 1000
+
+# How many players either side of a player GET /players/NAME/neighbors returns
+# by default, and at most.
+DEFAULT_NEIGHBOR_RADIUS = 2
+MAX_NEIGHBOR_RADIUS = 100
+
+# How many games GET /games/export fetches from the database at a time.
+EXPORT_CHUNK_SIZE = 1000
+
+# The columns of each game in GET /games/export, in order.
+EXPORT_COLUMNS = ('id', 'winner', 'loser', 'winner_score', 'loser_score',
+                  'time_created')
+
+OPEN_CHALLENGE_MESSAGE = 'There is an open challenge between the two players'
+
+# The header that admin requests carry the ADMIN_TOKEN from the config in.
+ADMIN_TOKEN_HEADER = 'X-Admin-Token'
+
 
 def _validate_player_name_not_used(player_name):
     if _player_exists(player_name):
@@ -22,43 +59,83 @@ def _validate_player_exists(player_name):
         raise ValidationError('Player "%s" does not exist' % player_name)
 
 
+def _validate_game_exists(game_id):
+    if game_id is not None and \
+            db.session.query(Game.id).filter_by(id=game_id).first() is None:
+        raise ValidationError('Game %d does not exist' % game_id)
+
+
+def _validate_cursor(cursor):
+    try:
+        util.decode_cursor(cursor)
+    except ValueError:
+        raise ValidationError('Invalid cursor "%s"' % cursor)
+
+
+def _validate_page(page):
+    if page['before'] is not None and page['after'] is not None:
+        raise ValidationError('Only one of "before" and "after" may be given')
+
+
 def _validate_game(game):
-    # TODO: raise ALL exceptions rather than the first
-    _validate_scores(game['winner_score'], game['loser_score'])
-    _validate_player_uniqueness(game['winner'], game['loser'])
+    errors = _find_game_errors(
+        game['winner'],
+        game['loser'],
+        game['winner_score'],
+        game['loser_score']
+    )
+    if errors:
+        raise ValidationError(errors)
+
+
+def _find_game_errors(winner, loser, winner_score, loser_score):
+    """Return a list of every problem with the game's scores and players."""
+    return _collect_errors([
+        (_validate_scores, winner_score, loser_score),
+        (_validate_player_uniqueness, winner, loser),
+    ])
+
+
+def _collect_errors(checks):
+    """Run every check and return all of their error messages.
+
+    Args:
+        checks - a list of tuples (validator, arg1, arg2), where the validator
+            raises a ValidationError if its two arguments are invalid.
+    """
+    errors = []
+    for check, arg1, arg2 in checks:
+        try:
+            check(arg1, arg2)
+        except ValidationError as e:
+            errors.extend(e.messages)
+    return errors
 
 
 def _query_open_challenges_for_players(player1, player2):
     """Make a query that finds open challenges between the two players."""
-    player_filter = or_(
-        and_(
-            Challenge.challenger == player1,
-            Challenge.challenged == player2,
-        ),
-        and_(
-            Challenge.challenger == player2,
-            Challenge.challenged == player1,
-        )
+    min_player_id, max_player_id = sorted([player1.id, player2.id])
+    return Challenge.query.filter(
+        Challenge.min_player_id == min_player_id,
+        Challenge.max_player_id == max_player_id,
+        Challenge.game_id == None
     )
-    open_filter = Challenge.game == None
-
-    return Challenge.query.filter(and_(open_filter, player_filter))
 
 
 def _validate_challenge(challenge):
-    # TODO: raise ALL exceptions rather than the first
-    _validate_player_uniqueness(
-        challenge['challenger'],
-        challenge['challenged']
-    )
-    _validate_no_open_challenges(
-        challenge['challenger'],
-        challenge['challenged']
-    )
-    _validate_challenger_has_lower_rating(
-        challenge['challenger'],
-        challenge['challenged']
-    )
+    challenger = challenge['challenger']
+    challenged = challenge['challenged']
+
+    if challenger == challenged:
+        # The other checks only make sense for two different players.
+        _validate_player_uniqueness(challenger, challenged)
+
+    errors = _collect_errors([
+        (_validate_no_open_challenges, challenger, challenged),
+        (_validate_challenger_has_lower_rating, challenger, challenged),
+    ])
+    if errors:
+        raise ValidationError(errors)
 
 
 def _validate_no_open_challenges(challenger_name, challenged_name):
@@ -67,8 +144,7 @@ def _validate_no_open_challenges(challenger_name, challenged_name):
 
     query = _query_open_challenges_for_players(challenger, challenged)
     if query.count() > 0:
-        message = 'There is an open challenge between the two players'
-        raise ValidationError(message)
+        raise ValidationError(OPEN_CHALLENGE_MESSAGE)
 
 def _validate_challenger_has_lower_rating(challenger_name, challenged_name):
     challenger = _get_player_by_name(challenger_name)
@@ -102,9 +178,61 @@ def _validate_scores(winner_score, loser_score):
         raise error
 
 
+def _conditional_get(get):
+    """Decorator that answers a GET with 304 Not Modified if the client already
+    has the current version of the ladder.
+
+    Every response is tagged with the ladder's version as its ETag and the
+    time it last changed as its Last-Modified, so a client that polls can send
+    the ETag back in If-None-Match. Only the single `ladder_state` row is read
+    to decide that nothing has changed.
+
+    If-Modified-Since is ignored: HTTP dates only have a resolution of a
+    second, so it can't tell apart two writes within the same second.
+    """
+    @functools.wraps(get)
+    def wrapper(*args, **kwargs):
+        # The version is read before the data, so the data is never older
+        # than the version it's tagged with.
+        version, time_modified = _get_ladder_state()
+
+        headers = {'ETag': quote_etag(str(version))}
+        if time_modified is not None:
+            headers['Last-Modified'] = http_date(time_modified)
+
+        if request.if_none_match.contains(str(version)):
+            return current_app.response_class(status=304, headers=headers)
+
+        response = get(*args, **kwargs)
+        if isinstance(response, current_app.response_class):
+            if response.status_code == 200:
+                response.headers.extend(headers)
+            return response
+
+        data, code, get_headers = unpack(response)
+        if code == 200:
+            headers.update(get_headers)
+            return data, code, headers
+        else:
+            return data, code, get_headers
+
+    return wrapper
+
+
 class PlayerListResource(Resource):
-    def get(self):
-        """Return all of the Players.
+    @use_kwargs({
+        'limit': fields.Int(missing=None, validate=validate.Range(min=0)),
+        'offset': fields.Int(missing=0, validate=validate.Range(min=0)),
+        'min_rating': fields.Int(missing=None),
+    })
+    @_conditional_get
+    def get(self, limit, offset, min_rating):
+        """Return the Players.
+
+        Args:
+            limit - the maximum number of players to return. Defaults to all.
+            offset - the number of players to skip. Defaults to 0.
+            min_rating - if given, only players rated at least this are shown.
 
         Returns:
             A list of player object, ordered by:
@@ -112,22 +240,13 @@ class PlayerListResource(Resource):
               2) Number of games played descending.
               3) Join date ascending.
         """
-        query = Player.query.all()
-        marshalled = schemas.players_schema.dump(query)
-
-        if marshalled.errors:
-            return marshalled.errors, 500
-
-        players = sorted(
-            marshalled.data,
-            key=lambda player: (
-                -player['rating'],
-                -(player['num_wins'] + player['num_losses']),
-                util.parse_datetime(player['time_created'])
-            )
-        )
-
-        return players, 200
+        version, _ = _get_ladder_state()
+        return ladder.get_cache().get_page(
+            version,
+            offset=offset,
+            limit=limit,
+            min_rating=min_rating
+        ), 200
 
     @use_kwargs({
         'name': fields.Str(
@@ -163,9 +282,9 @@ class PlayerListResource(Resource):
         )
 
         db.session.add(player)
-        db.session.commit()
+        _commit()
 
-        return player.name, 201
+        return name, 201
 
 
 class PlayerResource(Resource):
@@ -174,34 +293,128 @@ class PlayerResource(Resource):
     def get(self, name):
         """Return the player with the specified name."""
         player = Player.query.filter_by(name=name).first_or_404()
-        marshalled = schemas.player_schema.dump(player)
+        return schemas.serialize_player(player), 200
+
+
+class PlayerRankResource(Resource):
+    """For GETting a player's position in the ladder."""
+
+    @_conditional_get
+    def get(self, name):
+        """Return a player's rank.
+
+        Args:
+            name - the player's name.
+
+        Returns:
+            An object with the player's name, their rank (counting from 1, in
+            the same order as GET /players) and the number of players.
+        """
+        version, _ = _get_ladder_state()
+        rank = ladder.get_cache().get_rank(version, name)
+        if rank is None:
+            abort(404)
+
+        rank, num_players = rank
+        return {'name': name, 'rank': rank, 'num_players': num_players}, 200
 
-        if marshalled.errors:
-            return marshalled.errors, 500
-        else:
-            return marshalled.data, 200
+
+class PlayerNeighborsResource(Resource):
+    """For GETting the players around a player in the ladder."""
+
+    @use_kwargs({
+        'radius': fields.Int(
+            missing=DEFAULT_NEIGHBOR_RADIUS,
+            validate=validate.Range(min=0, max=MAX_NEIGHBOR_RADIUS)
+        ),
+    })
+    @_conditional_get
+    def get(self, name, radius):
+        """Return the players ranked just above and below a player.
+
+        Args:
+            name - the player's name.
+            radius - how many players either side of the player to return.
+
+        Returns:
+            A list of player objects in ladder order, including the player
+            themselves, each with its rank.
+        """
+        version, _ = _get_ladder_state()
+        neighbors = ladder.get_cache().get_neighbors(version, name, radius)
+        if neighbors is None:
+            abort(404)
+
+        return [dict(player, rank=rank) for rank, player in neighbors], 200
+
+
+class PlayerHistoryResource(Resource):
+    """For GETting a player's rating history."""
+
+    @use_kwargs({
+        'start': fields.DateTime(missing=None),
+        'end': fields.DateTime(missing=None),
+    })
+    @_conditional_get
+    def get(self, name, start, end):
+        """Return the changes to a player's rating, oldest first.
+
+        Args:
+            name - the player's name.
+            start - if given, only changes at or after this time are returned.
+            end - if given, only changes before this time are returned.
+
+        Returns:
+            A list of rating change objects, each with the game that caused it
+            and the player's rating before and after the game.
+        """
+        player = Player.query.filter_by(name=name).first_or_404()
+
+        query = RatingChange.query.filter(RatingChange.player_id == player.id)
+        if start is not None:
+            query = query.filter(RatingChange.time_created >= start)
+        if end is not None:
+            query = query.filter(RatingChange.time_created < end)
+        query = query.order_by(
+            RatingChange.time_created.asc(),
+            RatingChange.id.asc()
+        )
+
+        return [schemas.serialize_rating_change(rating_change)
+                for rating_change in query], 200
 
 
 class GameListResource(Resource):
     """GET for listing all games, POST for adding a game."""
 
-    @use_kwargs({'count': fields.Int(missing=10)})
-    def get(self, count):
-        """Return the most recent `count` games.
+    @use_kwargs({
+        'count': fields.Int(missing=10, validate=validate.Range(min=0)),
+        'before': fields.Str(missing=None, validate=_validate_cursor),
+        'after': fields.Str(missing=None, validate=_validate_cursor),
+    },
+        validate=_validate_page
+    )
+    @_conditional_get
+    def get(self, count, before, after):
+        """Return a page of games, most recent first.
 
         Args:
             count - the maximum number of games to return.
+            before - a cursor; only games older than it are returned.
+            after - a cursor; only games newer than it are returned.
 
         Returns:
-            A list of game objects.
+            A list of game objects. A `Link` header holds the URLs of the
+            neighbouring pages.
         """
-        query = Game.query.order_by(Game.time_created.desc()).limit(count)
-        marshalled = schemas.games_schema.dump(query)
-
-        if marshalled.errors:
-            return marshalled.errors, 500
-        else:
-            return marshalled.data, 200
+        # The players' names are needed for every game, so they're loaded in
+        # the same query rather than lazily one game at a time.
+        query = Game.query.options(
+            joinedload(Game.winner),
+            joinedload(Game.loser)
+        )
+        games, headers = _paginate(query, Game, count, before, after)
+        return [schemas.serialize_game(game) for game in games], 200, headers
 
     @use_kwargs({
         'winner': fields.Str(
@@ -243,65 +456,164 @@ class GameListResource(Resource):
 
         Side effects:
             Adds a new game to the database.
-            Updates each player's rating in the database.
+            Updates each player's rating and win/loss count in the database.
             Associates the new game with an existing challenge if appropriate.
         """
-        winner = _get_player_by_name(winner)
-        loser = _get_player_by_name(loser)
-
-        is_game_to_11 = winner_score == 11
-        new_winner_rating, new_loser_rating = \
-            elo.elo_update(winner.rating, loser.rating, is_game_to_11)
-
-        winner.rating = new_winner_rating
-        loser.rating = new_loser_rating
-        db.session.add_all([winner, loser])
-        db.session.commit()
-
-        game = Game(
-            winner=winner,
-            loser=loser,
-            winner_score=winner_score,
-            loser_score=loser_score,
-            time_created=time_created
+        def record_game():
+            game = _record_game(
+                _get_player_by_name(winner),
+                _get_player_by_name(loser),
+                winner_score,
+                loser_score,
+                time_created
+            )
+            return game.id
+
+        game_id = _commit_with_retry(record_game)
+        return game_id, 201
+
+
+class GameExportResource(Resource):
+    """For GETting every game at once, e.g. for analysis."""
+
+    @use_kwargs({
+        'format': fields.Str(
+            missing='ndjson',
+            validate=validate.OneOf(['ndjson', 'csv'])
+        ),
+    })
+    @_conditional_get
+    def get(self, format):
+        """Stream every game, oldest first.
+
+        Games are read from the database in chunks and written out as they
+        are read, so exporting the whole log takes constant memory however
+        long it is.
+
+        Args:
+            format - 'ndjson' for one JSON object per line, with the same
+                fields as GET /games, or 'csv' for a header row and then a
+                row per game.
+
+        Returns:
+            A streamed response.
+        """
+        if format == 'csv':
+            lines = _export_games_as_csv()
+            mimetype = 'text/csv'
+        else:
+            lines = _export_games_as_ndjson()
+            mimetype = 'application/x-ndjson'
+
+        return current_app.response_class(
+            stream_with_context(lines), mimetype=mimetype)
+
+
+class GameBatchResource(Resource):
+    """POST for adding many games at once, e.g. the results of a tournament."""
+
+    @use_kwargs({
+        'games': fields.Nested(
+            {
+                'winner': fields.Str(required=True),
+                'loser': fields.Str(required=True),
+                'winner_score': fields.Int(required=True),
+                'loser_score': fields.Int(required=True),
+                'time_created': fields.DateTime(
+                    missing=util.now_as_iso_string
+                )
+            },
+            many=True,
+            required=True,
+            validate=validate.Length(min=1, max=MAX_GAMES_PER_BATCH)
         )
+    })
+    def post(self, games):
+        """Add a batch of Games.
 
-        db.session.add(game)
-        db.session.commit()
+        Every game is validated before any are added, and if any are invalid
+        none are added and the errors for all of them are returned, keyed by
+        each game's position in `games`.
 
-        challenges = _query_open_challenges_for_players(winner, loser)
-        for challenge in challenges:
-            challenge.game_id = game.id
-            db.session.add(challenge)
-        db.session.commit()
+        Args:
+            games: a list of games, each with the same fields as a POST to
+                /games. They are applied in order.
 
-        return game.id, 201
+        Returns:
+            A pair (list of game IDs, response code) when successful.
+
+        Side effects:
+            Same as a POST to /games for each of the games.
+        """
+        names = set()
+        for game in games:
+            names.update([game['winner'], game['loser']])
+
+        players = Player.query.filter(Player.name.in_(names))
+        players_by_name = dict((player.name, player) for player in players)
+
+        errors = {}
+        for idx, game in enumerate(games):
+            game_errors = [
+                'Player "%s" does not exist' % name
+                for name in (game['winner'], game['loser'])
+                if name not in players_by_name
+            ]
+            game_errors.extend(_find_game_errors(
+                game['winner'],
+                game['loser'],
+                game['winner_score'],
+                game['loser_score']
+            ))
+            if game_errors:
+                errors[idx] = game_errors
+
+        if errors:
+            abort(422, errors={'games': errors})
+
+        game_ids = _commit_with_retry(
+            lambda: _record_games(games, players_by_name))
+        return game_ids, 201
 
 
 class ChallengeListResource(Resource):
-    @use_kwargs({'include_completed': fields.Bool(missing=False)})
-    def get(self, include_completed):
+    @use_kwargs({
+        'include_completed': fields.Bool(missing=False),
+        'count': fields.Int(missing=None, validate=validate.Range(min=0)),
+        'before': fields.Str(missing=None, validate=_validate_cursor),
+        'after': fields.Str(missing=None, validate=_validate_cursor),
+    },
+        validate=_validate_page
+    )
+    @_conditional_get
+    def get(self, include_completed, count, before, after):
         """Return challenges.
 
         Args:
             include_completed - iff True, challenges that have been completed
                 will be shown. Defaults to False.
+            count - the maximum number of challenges to return. Defaults to
+                all.
+            before - a cursor; only challenges older than it are returned.
+            after - a cursor; only challenges newer than it are returned.
 
         Returns:
-            A list of challenge objects, ordered by recency.
+            A list of challenge objects, ordered by recency. A `Link` header
+            holds the URLs of the neighbouring pages.
         """
 
-        if include_completed:
-            query = Challenge.query
-        else:
-            query = Challenge.query.filter(Challenge.game == None)
+        query = Challenge.query.options(
+            joinedload(Challenge.challenger),
+            joinedload(Challenge.challenged)
+        )
+        if not include_completed:
+            query = query.filter(Challenge.game == None)
 
-        marshalled = schemas.challenges_schema.dump(query)
-        if marshalled.errors:
-            return marshalled.errors, 500
+        challenges, headers = \
+            _paginate(query, Challenge, count, before, after)
 
-        challenges = marshalled.data
-        return challenges, 200
+        return [schemas.serialize_challenge(challenge)
+                for challenge in challenges], 200, headers
 
     @use_kwargs({
         'challenger': fields.Str(
@@ -315,7 +627,11 @@ class ChallengeListResource(Resource):
         'time_created': fields.DateTime(
             missing=util.now_as_iso_string
         ),
-        'game_id': fields.Int(missing=lambda: None, allow_none=True)
+        'game_id': fields.Int(
+            missing=lambda: None,
+            allow_none=True,
+            validate=_validate_game_exists
+        )
 
     },
         validate=_validate_challenge
@@ -334,28 +650,536 @@ class ChallengeListResource(Resource):
 
         Side effects:
             Adds a challenge to the database.
+            Updates each player's challenge count in the database.
         """
-        challenger = _get_player_by_name(challenger)
-        challenged = _get_player_by_name(challenged)
-
-        challenge = Challenge(
-            challenger=challenger,
-            challenged=challenged,
-            time_created=time_created,
-            game_id=game_id
+        def record_challenge():
+            challenger_player = _get_player_by_name(challenger)
+            challenged_player = _get_player_by_name(challenged)
+
+            challenge = Challenge(
+                challenger=challenger_player,
+                challenged=challenged_player,
+                time_created=time_created,
+                game_id=game_id
+            )
+
+            challenger_player.num_challenges_submitted += 1
+            challenged_player.num_challenges_received += 1
+
+            db.session.add_all(
+                [challenge, challenger_player, challenged_player])
+            db.session.flush()
+            return challenge.id
+
+        try:
+            challenge_id = _commit_with_retry(record_challenge)
+        except IntegrityError:
+            db.session.rollback()
+            # A concurrent request may have opened a challenge between the
+            # same players after this one was validated. Anything else, e.g. a
+            # game deleted since, is a real error.
+            open_challenges = _query_open_challenges_for_players(
+                _get_player_by_name(challenger),
+                _get_player_by_name(challenged)
+            )
+            if open_challenges.count() == 0:
+                raise
+            abort(422, errors=[OPEN_CHALLENGE_MESSAGE])
+
+        return challenge_id, 201
+
+
+def _admin_only(method):
+    """Decorator that rejects requests without the admin token.
+
+    Admin endpoints don't exist (404) unless ADMIN_TOKEN is set in the config,
+    and are forbidden (403) to requests whose ADMIN_TOKEN_HEADER doesn't match
+    it.
+    """
+    @functools.wraps(method)
+    def wrapper(*args, **kwargs):
+        token = current_app.config['ADMIN_TOKEN']
+        if not token:
+            abort(404)
+
+        given = request.headers.get(ADMIN_TOKEN_HEADER, '')
+        if not hmac.compare_digest(given.encode('utf-8'),
+                                   str(token).encode('utf-8')):
+            abort(403, message='A valid %s header is required' %
+                  ADMIN_TOKEN_HEADER)
+
+        return method(*args, **kwargs)
+
+    return wrapper
+
+
+class RatingReplayResource(Resource):
+    """POST for recomputing every player's rating from the game log.
+
+    This rewrites every player's rating and history, so it's only available
+    to requests with the admin token; see `_admin_only`.
+    """
+
+    @_admin_only
+    @use_kwargs({
+        'starter_rating': fields.Int(
+            missing=None,
+            validate=validate.Range(min=1)
+        ),
+        'dry_run': fields.Bool(missing=False)
+    })
+    def post(self, starter_rating, dry_run):
+        """Replay every game in order to recompute the players' ratings.
+
+        Args:
+            starter_rating - the rating each player starts with. Defaults to
+                the STARTER_RATING in the app's config.
+            dry_run - iff True, the ratings are computed but not saved.
+
+        Returns:
+            The number of games replayed, the IDs of any games that were
+            skipped because a player was missing, and, for each player whose
+            rating changed, their name and old and new ratings.
+
+        Side effects:
+            Unless `dry_run`, updates the players' ratings in the database and
+            replaces their rating histories.
+        """
+        if starter_rating is None:
+            starter_rating = current_app.config['RATINGS']['STARTER_RATING']
+
+        num_games, players, skipped_game_ids = replay.replay_ratings(
+            starter_rating,
+            rewrite_history=not dry_run
         )
+        if not dry_run:
+            replay.apply_ratings(players)
+
+        changed = [
+            {'name': name, 'old_rating': old_rating, 'new_rating': new_rating}
+            for _, name, old_rating, new_rating in players
+            if old_rating != new_rating
+        ]
+        return {
+            'num_games': num_games,
+            'skipped_game_ids': skipped_game_ids,
+            'players': changed,
+        }, 200
+
+
+class MetricsResource(Resource):
+    """GET for the timings of the requests this process has handled."""
 
-        db.session.add(challenge)
-        db.session.commit()
+    def get(self):
+        """Return the totals for each endpoint, in Prometheus's text format.
 
-        return challenge.id, 201
+        See `metrics.py`.
+        """
+        return current_app.response_class(
+            metrics.get_metrics().render(),
+            content_type=metrics.CONTENT_TYPE
+        )
 
 
 ###############################################################################
 # Helpers
 ###############################################################################
+def _record_game(winner, loser, winner_score, loser_score, time_created):
+    """Add a game to the session without committing it.
+
+    Args:
+        winner - the winning Player.
+        loser - the losing Player.
+        winner_score - winning player's score.
+        loser_score - losing player's score.
+        time_created - when the game was created.
+
+    Returns:
+        The new Game, which has been flushed so that it has an ID.
+
+    Side effects:
+        Updates each player's rating and win/loss count.
+        Records each player's rating change.
+        Associates the new game with any open challenge between the players.
+    """
+    rating_changes = _update_players_for_game(winner, loser, winner_score)
+
+    game = Game(
+        winner=winner,
+        loser=loser,
+        winner_score=winner_score,
+        loser_score=loser_score,
+        time_created=time_created
+    )
+
+    db.session.add_all([game, winner, loser])
+    db.session.flush()
+
+    for rating_change in rating_changes:
+        rating_change.update(game_id=game.id, time_created=time_created)
+    db.session.bulk_insert_mappings(RatingChange, rating_changes)
+
+    _query_open_challenges_for_players(winner, loser).update(
+        {Challenge.game_id: game.id},
+        synchronize_session=False
+    )
+
+    return game
+
+
+def _record_games(games, players_by_name):
+    """Add a batch of games to the session without committing them.
+
+    The games are applied in order, so each game's rating update sees the
+    ratings left by the games before it. Games and rating changes are written
+    with one multi-row insert each, and open challenges are closed with a
+    single bulk update.
+
+    Args:
+        games - a list of dicts, each with the arguments to `_record_game`
+            except that the winner and loser are player names.
+        players_by_name - a dict mapping each player name used in `games` to
+            its Player.
+
+    Returns:
+        A list of the new games' IDs, in the same order as `games`.
+    """
+    rows = []
+    rating_changes_by_game = []
+    for game in games:
+        winner = players_by_name[game['winner']]
+        loser = players_by_name[game['loser']]
+        rating_changes_by_game.append(
+            _update_players_for_game(winner, loser, game['winner_score']))
+
+        rows.append({
+            'winner_id': winner.id,
+            'loser_id': loser.id,
+            'winner_score': game['winner_score'],
+            'loser_score': game['loser_score'],
+            'time_created': game['time_created'],
+        })
+
+    game_ids = _insert_games(rows)
+    for row, game_id in zip(rows, game_ids):
+        row['id'] = game_id
+
+    rating_changes = []
+    for row, game_rating_changes in zip(rows, rating_changes_by_game):
+        for rating_change in game_rating_changes:
+            rating_change.update(
+                game_id=row['id'], time_created=row['time_created'])
+            rating_changes.append(rating_change)
+    db.session.bulk_insert_mappings(RatingChange, rating_changes)
+
+    # Each open challenge is completed by the first game in the batch between
+    # its two players.
+    first_game_ids = {}
+    for row in rows:
+        pair = tuple(sorted([row['winner_id'], row['loser_id']]))
+        first_game_ids.setdefault(pair, row['id'])
+
+    player_ids = [player.id for player in players_by_name.values()]
+    open_challenges = db.session.query(
+        Challenge.id,
+        Challenge.min_player_id,
+        Challenge.max_player_id
+    ).filter(
+        Challenge.min_player_id.in_(player_ids),
+        Challenge.max_player_id.in_(player_ids),
+        Challenge.game_id == None
+    )
+
+    challenge_rows = []
+    for challenge_id, min_player_id, max_player_id in open_challenges:
+        pair = (min_player_id, max_player_id)
+        if pair in first_game_ids:
+            challenge_rows.append(
+                {'id': challenge_id, 'game_id': first_game_ids[pair]})
+
+    db.session.bulk_update_mappings(Challenge, challenge_rows)
+    db.session.flush()
+
+    return game_ids
+
+
+def _insert_games(rows):
+    """Insert games without adding them to the session.
+
+    Args:
+        rows - a list of dicts of the games' columns, except their IDs.
+
+    Returns:
+        A list of the new games' IDs, in the same order as `rows`.
+    """
+    if not _has_single_writer():
+        # Each game is inserted on its own so that its ID can be read back,
+        # e.g. with RETURNING.
+        db.session.bulk_insert_mappings(Game, rows, return_defaults=True)
+        return [row['id'] for row in rows]
+
+    # No other games can be inserted between these ones, which get the next
+    # IDs in order, so they can all be inserted with a single executemany.
+    db.session.execute(Game.__table__.insert(), rows)
+    query = db.session.query(Game.id).order_by(Game.id.desc()).limit(len(rows))
+    return [game_id for game_id, in reversed(query.all())]
+
+
+def _has_single_writer():
+    """Return whether the database lets one transaction write at a time.
+
+    SQLite does, and a transaction holds its write lock from its first write
+    until it commits.
+    """
+    return db.session.get_bind(Game.__mapper__).dialect.name == 'sqlite'
+
+
+def _update_players_for_game(winner, loser, winner_score):
+    """Apply a game's result to its players' ratings and win/loss counts.
+
+    Returns:
+        A list of two dicts, one each for the winner and the loser, holding
+        the `RatingChange` fields other than `game_id` and `time_created`.
+    """
+    is_game_to_11 = winner_score == 11
+    k_value = elo.compute_k_value(is_game_to_11)
+    new_winner_rating, new_loser_rating = \
+        elo.elo_update(winner.rating, loser.rating, is_game_to_11)
+
+    rating_changes = [
+        _make_rating_change(winner, new_winner_rating, k_value),
+        _make_rating_change(loser, new_loser_rating, k_value),
+    ]
+
+    winner.rating = new_winner_rating
+    loser.rating = new_loser_rating
+    winner.num_wins += 1
+    loser.num_losses += 1
+
+    return rating_changes
+
+
+def _make_rating_change(player, new_rating, k_value):
+    return {
+        'player_id': player.id,
+        'rating_before': player.rating,
+        'rating_after': new_rating,
+        'delta': new_rating - player.rating,
+        'k_value': k_value,
+    }
+
+
+def _commit_with_retry(make_changes):
+    """Call `make_changes` and commit everything it adds to the session in a
+    single transaction.
+
+    Players carry a version number that is checked on every update, so if a
+    concurrent request changed one of the players this transaction read (e.g.
+    its rating) the flush fails instead of silently overwriting that change.
+    When that happens the transaction is rolled back and `make_changes` is run
+    again against fresh rows, up to MAX_COMMIT_ATTEMPTS times.
+
+    Args:
+        make_changes - a function taking no arguments that reads what it needs
+            from the database and adds its changes to the session.
+
+    Returns:
+        Whatever `make_changes` returned on the attempt that was committed.
+    """
+    for _ in range(MAX_COMMIT_ATTEMPTS):
+        try:
+            result = make_changes()
+            _commit()
+            return result
+        except StaleDataError:
+            db.session.rollback()
+
+    abort(409, message='Too many concurrent updates; try again')
+
+
+def _export_games():
+    """Yield every game, oldest first, in lists of up to `EXPORT_CHUNK_SIZE`
+    rows. Each row has the values of `EXPORT_COLUMNS`.
+
+    The players' names are joined in the same query, and rows are fetched a
+    chunk at a time rather than loaded as Game objects. The joins are outer,
+    so that games whose winner or loser no longer exists are still exported,
+    with None for the missing player's name, as `GET /games` lists them.
+    """
+    winner = aliased(Player)
+    loser = aliased(Player)
+    games = db.session.execute(
+        select([
+            Game.id,
+            winner.name,
+            loser.name,
+            Game.winner_score,
+            Game.loser_score,
+            Game.time_created
+        ])
+        .select_from(
+            Game.__table__
+            .outerjoin(winner, Game.winner_id == winner.id)
+            .outerjoin(loser, Game.loser_id == loser.id)
+        )
+        .order_by(Game.time_created, Game.id)
+        .execution_options(stream_results=True)
+    )
+
+    while True:
+        chunk = games.fetchmany(EXPORT_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+def _export_games_as_ndjson():
+    """Yield the export as JSON lines, a chunk of games at a time.
+
+    Like `GET /games`, a game whose winner or loser no longer exists has no
+    name for that player.
+    """
+    encode = current_app.json_encoder(sort_keys=True).encode
+    for chunk in _export_games():
+        lines = []
+        for row in chunk:
+            game = dict(zip(EXPORT_COLUMNS, row))
+            game['time_created'] = util.format_datetime(game['time_created'])
+            for name in ('winner', 'loser'):
+                if game[name] is None:
+                    del game[name]
+            lines.append(encode(game))
+            lines.append('\n')
+        yield ''.join(lines)
+
+
+def _export_games_as_csv():
+    """Yield the export as CSV, the header and then a chunk of games at a
+    time. A player who no longer exists has an empty name."""
+    buf = StringIO()
+    writer = csv.writer(buf)
+
+    writer.writerow(EXPORT_COLUMNS)
+    for chunk in _export_games():
+        writer.writerows(
+            (
+                id_,
+                _encode_name(winner),
+                _encode_name(loser),
+                winner_score,
+                loser_score,
+                util.format_datetime(time_created)
+            )
+            for id_, winner, loser, winner_score, loser_score, time_created
+            in chunk
+        )
+        yield buf.getvalue()
+        buf.seek(0)
+        buf.truncate()
+
+    # The header on its own, if there are no games.
+    if buf.tell():
+        yield buf.getvalue()
+
+
+def _encode_name(name):
+    return '' if name is None else name.encode('utf-8')
+
+
+def _commit():
+    """Commit the session as a new version of the ladder."""
+    ladder.commit(bump_ladder_version())
+
+
+def _get_ladder_state():
+    """Return `get_ladder_state()`, reading it at most once per request."""
+    if not has_request_context():
+        return get_ladder_state()
+
+    if not hasattr(request, 'ladder_state'):
+        request.ladder_state = get_ladder_state()
+    return request.ladder_state
+
+
 def _get_player_by_name(player_name):
-    return Player.query.filter_by(name=player_name).first()
+    """Return the Player with the given name, or None if there isn't one.
+
+    During a request each name is only looked up once: the field validators,
+    the request validator and the handler all share the result, which is
+    cached on the request.
+    """
+    if not has_request_context():
+        return Player.query.filter_by(name=player_name).first()
+
+    players_by_name = getattr(request, 'players_by_name', None)
+    if players_by_name is None:
+        players_by_name = request.players_by_name = {}
+
+    if player_name not in players_by_name:
+        players_by_name[player_name] = \
+            Player.query.filter_by(name=player_name).first()
+    return players_by_name[player_name]
+
+
+def _paginate(query, model, count, before, after):
+    """Fetch one page of `query`, newest first, using keyset pagination.
+
+    Rows are ordered by `(time_created, id)`, which is backed by an index on
+    both the game and challenge tables, so each page costs the same no matter
+    how far back it is.
+
+    Args:
+        query - the query to page through.
+        model - the model being queried; either `Game` or `Challenge`.
+        count - the maximum number of rows to return, or None for all.
+        before - a cursor; only rows older than it are returned.
+        after - a cursor; only rows newer than it are returned.
+
+    Returns:
+        A pair (rows, headers) where headers has a `Link` header with the URLs
+        of the next (older) and previous (newer) pages, if there are any.
+    """
+    # The redundant bound on time_created alone lets the database seek
+    # straight to the cursor in the index rather than scanning up to it.
+    if before is not None:
+        time_created, id_ = util.decode_cursor(before)
+        query = query.filter(
+            model.time_created <= time_created,
+            or_(model.time_created < time_created, model.id < id_)
+        )
+    elif after is not None:
+        time_created, id_ = util.decode_cursor(after)
+        query = query.filter(
+            model.time_created >= time_created,
+            or_(model.time_created > time_created, model.id > id_)
+        )
+
+    if after is not None:
+        query = query.order_by(model.time_created.asc(), model.id.asc())
+        rows = list(reversed(query.limit(count).all()))
+    else:
+        query = query.order_by(model.time_created.desc(), model.id.desc())
+        rows = query.limit(count).all()
+
+    is_full_page = count is not None and len(rows) == count
+
+    links = []
+    if rows and (is_full_page or after is not None):
+        links.append(_make_page_link('before', rows[-1], 'next'))
+    if rows and (before is not None or (after is not None and is_full_page)):
+        links.append(_make_page_link('after', rows[0], 'prev'))
+
+    headers = {'Link': ', '.join(links)} if links else {}
+    return rows, headers
+
+
+def _make_page_link(cursor_arg, row, rel):
+    args = request.args.to_dict()
+    args.pop('before', None)
+    args.pop('after', None)
+    args[cursor_arg] = util.encode_cursor(row.time_created, row.id)
+    return '<%s?%s>; rel="%s"' % (
+        request.base_url, urllib.urlencode(args), rel)
 
 
 @parser.error_handler
@@ -367,4 +1191,4 @@ def handle_request_parsing_error(err):
 
 
 def _player_exists(player_name):
-    return Player.query.filter_by(name=player_name).count() > 0
+    return _get_player_by_name(player_name) is not None
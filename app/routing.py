@@ -0,0 +1,79 @@
+"""Routing of reads to a read replica of the database.
+
+If `SQLALCHEMY_BINDS` in the app's config has a `read` engine, every statement
+run by a request that only reads (GET, HEAD or OPTIONS) goes to it, and
+everything else, including writes and anything run outside a request, goes to
+the primary engine. Reads, which far outnumber writes, can then be scaled by
+adding replicas behind the read engine without loading the primary.
+
+A replica may lag behind the primary, so a client that has just written might
+not see its own write. After a request that writes succeeds, the client is
+therefore sent a cookie that keeps its reads on the primary for the next
+`READ_YOUR_WRITES_SECONDS`.
+"""
+
+import time
+
+from flask import current_app, has_request_context, request
+
+
+# The key of the read engine in `SQLALCHEMY_BINDS`.
+READ_BIND = 'read'
+
+# The HTTP methods that never write.
+READ_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS'])
+
+# The cookie holding when the client last wrote, in seconds since the epoch.
+WROTE_AT_COOKIE = 'ladder_wrote_at'
+
+
+def init_app(app):
+    """Keep clients' reads on the primary for a while after they write."""
+    app.after_request(_remember_write)
+
+
+def is_read_request():
+    """Return whether there's a current request, and it only reads."""
+    return has_request_context() and request.method in READ_METHODS
+
+
+def is_write_request():
+    """Return whether there's a current request, and it may write."""
+    return has_request_context() and request.method not in READ_METHODS
+
+
+def has_read_bind(app):
+    return READ_BIND in (app.config['SQLALCHEMY_BINDS'] or {})
+
+
+def use_read_bind():
+    """Return whether the current request's statements should go to the read
+    engine."""
+    if not is_read_request() or not has_read_bind(current_app):
+        return False
+
+    wrote_at = request.cookies.get(WROTE_AT_COOKIE)
+    if wrote_at is None:
+        return True
+    try:
+        seconds_since_write = time.time() - float(wrote_at)
+    except ValueError:
+        return True
+    max_seconds = current_app.config['READ_YOUR_WRITES_SECONDS']
+    return seconds_since_write >= max_seconds
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _remember_write(response):
+    window = current_app.config['READ_YOUR_WRITES_SECONDS']
+    if has_read_bind(current_app) and window > 0 and \
+            is_write_request() and response.status_code < 400:
+        response.set_cookie(
+            WROTE_AT_COOKIE,
+            '%.3f' % time.time(),
+            max_age=window,
+            httponly=True
+        )
+    return response
@@ -1,4 +1,17 @@
 
+"""Marshmallow schemas for the API's objects, and compiled serializers for the
+hot endpoints.
+
+Marshmallow dispatches through several method calls per field per object, which
+dominates the cost of serializing long lists. `compile_serializer` turns a
+schema into a plain function that builds the same dict from a precomputed list
+of getters and converters; the resources use those functions, and the schemas
+remain the definition of the output.
+"""
+
+import operator
+import re
+
 from marshmallow import Schema, fields
 
 import util
@@ -42,3 +55,115 @@ class ChallengeSchema(Schema):
     game_id = fields.Int(dump_only=True)
 
 challenges_schema = ChallengeSchema(many=True)
+
+
+class RatingChangeSchema(Schema):
+    game_id = fields.Int()
+    rating_before = fields.Int()
+    rating_after = fields.Int()
+    delta = fields.Int()
+    k_value = fields.Int()
+    time_created = _MyDateTime()
+
+rating_changes_schema = RatingChangeSchema(many=True)
+
+
+def _int_or_none(value):
+    return None if value is None else int(value)
+
+
+def _text_or_none(value):
+    if value is None:
+        return None
+    elif isinstance(value, str):
+        return value.decode('utf-8')
+    else:
+        return unicode(value)
+
+
+# How each type of field serializes a value, matching marshmallow.
+_FIELD_CONVERTERS = {
+    fields.Int: _int_or_none,
+    fields.Str: _text_or_none,
+    _MyDateTime: util.format_datetime,
+}
+
+_ATTRIBUTE_PATTERN = re.compile(r'^[A-Za-z_]\w*(\.[A-Za-z_]\w*)*$')
+
+# Returned by a field's getter when an object along its dotted attribute is
+# None, so that the field is left out.
+_MISSING = object()
+
+
+def _dotted_getter(attribute):
+    """Return a function that reads a dotted attribute of an object, or
+    `_MISSING` if an object along the path is None."""
+    parts = attribute.split('.')
+    get_last = operator.attrgetter(parts[-1])
+    path = parts[:-1]
+
+    def get(obj):
+        for part in path:
+            obj = getattr(obj, part)
+            if obj is None:
+                return _MISSING
+        return get_last(obj)
+
+    return get
+
+
+def compile_serializer(schema):
+    """Compile a schema into a function that serializes one object.
+
+    The function returns exactly what `schema.dump(obj).data` would for a
+    single object, but looks up each field's getter and converter once, so
+    that serializing an object needs no per-field dispatch. Like marshmallow,
+    a field with a dotted attribute is left out if an object along the path is
+    None, e.g. the winner of a game whose player was deleted.
+
+    Args:
+        schema - a schema whose fields are all of the types in
+            `_FIELD_CONVERTERS`, and whose attributes are plain (possibly
+            dotted) attribute names.
+
+    Returns:
+        A function taking an object and returning a dict.
+
+    Raises:
+        TypeError if the schema can't be compiled.
+    """
+    plain_fields = []
+    dotted_fields = []
+    for name, field in sorted(schema.fields.items()):
+        if type(field) not in _FIELD_CONVERTERS:
+            raise TypeError('Cannot compile field %r of type %s' %
+                            (name, type(field).__name__))
+
+        attribute = field.attribute or name
+        if not _ATTRIBUTE_PATTERN.match(attribute):
+            raise TypeError('Cannot compile attribute %r' % attribute)
+
+        converter = _FIELD_CONVERTERS[type(field)]
+        if '.' in attribute:
+            dotted_fields.append((name, _dotted_getter(attribute), converter))
+        else:
+            plain_fields.append(
+                (name, operator.attrgetter(attribute), converter))
+
+    def serialize(obj):
+        data = {}
+        for name, get, convert in plain_fields:
+            data[name] = convert(get(obj))
+        for name, get, convert in dotted_fields:
+            value = get(obj)
+            if value is not _MISSING:
+                data[name] = convert(value)
+        return data
+
+    return serialize
+
+
+serialize_player = compile_serializer(player_schema)
+serialize_game = compile_serializer(games_schema)
+serialize_challenge = compile_serializer(challenges_schema)
+serialize_rating_change = compile_serializer(rating_changes_schema)
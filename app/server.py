@@ -0,0 +1,109 @@
+"""The entry point for running the ladder service in production.
+
+`python -m app` runs Flask's development server, which handles one request at
+a time. This runs the app under gunicorn instead: a master process that forks
+several worker processes, each handling requests on one or more threads, so
+the service can use every core. The number of workers and threads and the
+other server settings come from the `SERVER` section of `config.yaml`.
+
+The app is created, and the ladder loaded into memory, once in the master
+before it forks, so workers start with warm imports and share the ladder's
+memory until they change it. Each worker then opens its own database
+connections, since connections can't be shared across processes.
+
+Send the master SIGHUP to gracefully replace its workers: new workers are
+started before the old ones are stopped, and the old ones finish the requests
+they're handling first. The new workers are forked from the same preloaded
+app, so changes to the code or to `config.yaml` are only picked up by
+restarting the master.
+
+The app will be configured to run in a particular environment, specified by the
+`FLASK_ENV` environment variable.
+"""
+
+import multiprocessing
+
+from gunicorn.app.base import BaseApplication
+
+import ladder
+from app import create_app
+from models import db, get_ladder_state
+
+
+class LadderApplication(BaseApplication):
+    """Serves a Flask app with gunicorn.
+
+    Args:
+        app - the Flask app, already created.
+        options - a dict of gunicorn settings, e.g. from `get_options`.
+    """
+
+    def __init__(self, app, options):
+        self.app = app
+        self.options = options
+        super(LadderApplication, self).__init__()
+
+    def load_config(self):
+        def post_fork(server, worker):
+            # Any connections opened before forking belong to the master.
+            _dispose_engines(self.app)
+
+        for name, value in self.options.iteritems():
+            self.cfg.set(name, value)
+        self.cfg.set('preload_app', True)
+        self.cfg.set('post_fork', post_fork)
+
+    def load(self):
+        return self.app
+
+
+def get_options(config):
+    """Return the gunicorn settings for an app's config.
+
+    Args:
+        config - the app's config.
+
+    Returns:
+        A dict mapping gunicorn's setting names to values.
+    """
+    server = config['SERVER']
+
+    workers = server['WORKERS']
+    if workers is None:
+        workers = multiprocessing.cpu_count() * 2 + 1
+
+    return {
+        'bind': '%s:%d' % (server['HOST'], config['PORT']),
+        'workers': workers,
+        'threads': server['THREADS'],
+        'timeout': server['TIMEOUT'],
+        'graceful_timeout': server['GRACEFUL_TIMEOUT'],
+    }
+
+
+def warm(app):
+    """Load the ladder into the app's memory, then close the connections used
+    to do so."""
+    with app.app_context():
+        version, _ = get_ladder_state()
+        ladder.get_cache().get_page(version, limit=0)
+
+        db.session.remove()
+    _dispose_engines(app)
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _dispose_engines(app):
+    """Close the pooled connections of the app's primary and other engines."""
+    binds = [None] + list(app.config['SQLALCHEMY_BINDS'] or [])
+    with app.app_context():
+        for bind in binds:
+            db.get_engine(app, bind=bind).dispose()
+
+
+if __name__ == '__main__':
+    app = create_app()
+    warm(app)
+    LadderApplication(app, get_options(app.config)).run()
@@ -0,0 +1,130 @@
+"""Tuning for SQLite databases.
+
+By default SQLite keeps a rollback journal, so a write blocks every reader
+until it commits, and each connection starts with a small page cache. Every
+new connection to a SQLite database therefore runs the PRAGMAs in the `SQLITE`
+section of the app's config first, e.g. to switch to a write-ahead log (which
+lets readers carry on during a write), to relax fsyncs, to enlarge the cache,
+and to wait for locks rather than failing at once. Connections to a database
+file are also kept in a pool, so that their caches outlive each request.
+
+SQLite allows one writer at a time. A transaction that reads and then writes
+only asks for the write lock at its first write, and if another process has
+written in the meantime it fails with "database is locked" without waiting.
+With `IMMEDIATE_WRITES`, requests that may write (anything but GET, HEAD and
+OPTIONS) instead take the write lock when their transaction begins, so
+concurrent writers, e.g. in other workers, queue up for it for as long as the
+busy timeout allows, and reads never wait. A request that still can't get a
+lock within the busy timeout is answered with 503 Service Unavailable and a
+Retry-After header rather than failing with a 500.
+"""
+
+import sqlite3
+
+from flask.ext.restful.representations.json import output_json
+from sqlalchemy import event, exc
+from sqlalchemy.pool import QueuePool
+
+import routing
+
+
+# How many seconds a client whose request couldn't get a lock is told to wait
+# before trying again.
+LOCKED_RETRY_AFTER_SECONDS = 1
+
+LOCKED_MESSAGE = 'The database is busy; try again'
+
+
+def get_locked_response(error):
+    """Return the response to a request that failed with `error`, if it timed
+    out waiting for a lock.
+
+    Returns:
+        A 503 response telling the client when to try again, or None if the
+        error wasn't a lock timeout.
+    """
+    # BEGIN goes straight to the driver, so its errors aren't wrapped by
+    # SQLAlchemy.
+    if not isinstance(error, (sqlite3.OperationalError, exc.OperationalError)):
+        return None
+    if 'database is locked' not in str(error):
+        return None
+
+    return output_json(
+        {'message': LOCKED_MESSAGE},
+        503,
+        {'Retry-After': str(LOCKED_RETRY_AFTER_SECONDS)}
+    )
+
+
+def apply_driver_hacks(config, info, options):
+    """Adjust the options for creating an engine for a SQLite database.
+
+    This is called after Flask-SQLAlchemy's own adjustments.
+
+    Args:
+        config - the app's config.
+        info - the database's URL.
+        options - a dict of keyword arguments for `sqlalchemy.create_engine`,
+            which is updated in place.
+    """
+    pool_size = config['SQLITE']['POOL_SIZE']
+    if info.database in (None, '', ':memory:') or not pool_size:
+        return
+
+    options['poolclass'] = QueuePool
+    options['pool_size'] = pool_size
+    # Pooled connections are used by one thread at a time, but not always the
+    # same one.
+    options.setdefault('connect_args', {})['check_same_thread'] = False
+
+
+def init_engine(engine, config):
+    """Tune every connection that an engine makes to a SQLite database.
+
+    Args:
+        engine - a new engine, which hasn't connected yet.
+        config - the app's config.
+    """
+    settings = config['SQLITE']
+    pragmas = sorted(settings['PRAGMAS'].items())
+    immediate_writes = settings['IMMEDIATE_WRITES']
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        # Transactions are begun by `begin` below rather than by pysqlite,
+        # which would only begin them just before the first write.
+        dbapi_connection.isolation_level = None
+        for name, value in pragmas:
+            dbapi_connection.execute(
+                'PRAGMA %s = %s' % (name, _format_pragma_value(value)))
+
+    @event.listens_for(engine, 'begin')
+    def begin(connection):
+        # This goes straight to the driver, so it isn't seen by
+        # before_cursor_execute listeners or counted as a statement.
+        connection.connection.execute(get_begin_statement(immediate_writes))
+
+
+def get_begin_statement(immediate_writes):
+    """Return the statement that begins the current request's transaction.
+
+    Args:
+        immediate_writes - iff True, requests that may write begin
+            immediately, i.e. by taking the write lock.
+    """
+    if immediate_writes and routing.is_write_request():
+        return 'BEGIN IMMEDIATE'
+    return 'BEGIN'
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _format_pragma_value(value):
+    # YAML reads on and off as booleans.
+    if value is True:
+        return 'ON'
+    if value is False:
+        return 'OFF'
+    return str(value)
@@ -1,3 +1,4 @@
+import base64
 from datetime import datetime
 
 
@@ -19,3 +20,28 @@ def now():
 
 def format_datetime(dt):
     return dt.isoformat()
+
+
+_CURSOR_DATETIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(time_created, id_):
+    """Encode a row's (time_created, id) position as an opaque string."""
+    position = '%s|%d' % (time_created.strftime(_CURSOR_DATETIME_FORMAT), id_)
+    return base64.urlsafe_b64encode(position).rstrip('=')
+
+
+def decode_cursor(cursor):
+    """Decode a string made by `encode_cursor` into a (time_created, id) pair.
+
+    Raises:
+        ValueError if the cursor is malformed.
+    """
+    try:
+        padding = '=' * (-len(cursor) % 4)
+        position = base64.urlsafe_b64decode(str(cursor) + padding)
+        time_created, id_ = position.split('|')
+        return (datetime.strptime(time_created, _CURSOR_DATETIME_FORMAT),
+                int(id_))
+    except (TypeError, ValueError, UnicodeEncodeError):
+        raise ValueError('Invalid cursor: %r' % cursor)
@@ -0,0 +1,303 @@
+"""Fill a database with a synthetic ladder for benchmarking.
+
+Each player is given a hidden skill drawn from a normal distribution, and how
+often they play from a long-tailed one, so a few players play most of the
+games. The winner of each game is drawn from the Elo expectation of the two
+players' skills. Some games are preceded by a challenge between the same
+players, which the game closes, and a number of challenges are left open at the
+end. Ratings, counters and rating histories are then computed the same way the
+service computes them, by replaying the games.
+
+The same arguments and seed always generate the same ladder. Run from the
+repository root against the BENCHMARK environment's database:
+
+    FLASK_ENV=BENCHMARK venv/bin/python -m benchmarks.generate \\
+        --num-players 10000 --num-games 1000000
+"""
+
+import argparse
+import collections
+import bisect
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+from app import elo, migrations, replay
+from app.app import create_app
+from app.models import (Challenge, Game, Player, bump_ladder_version, db,
+                        reconcile_player_counters)
+
+
+# How many rows are inserted at a time.
+INSERT_CHUNK_SIZE = 10000
+
+# When the ladder starts, and how long the games are spread over.
+START_TIME = datetime(2015, 1, 1)
+DURATION = timedelta(days=365)
+
+# The spread of players' hidden skills, in rating points.
+SKILL_STDDEV = 200
+
+# The shape of the distribution of how often players play. Smaller is more
+# uneven.
+ACTIVITY_SHAPE = 1.5
+
+# The fraction of games that close a challenge.
+CHALLENGED_GAME_FRACTION = 0.1
+
+# The fraction of games that go to the last point, e.g. 21-20. The service
+# only accepts winning scores of exactly 11 or 21, so these stand in for deuce
+# games.
+CLOSE_GAME_FRACTION = 0.15
+
+# How many pairs of players are drawn for each open challenge before the rest
+# are drawn from every eligible pair.
+MAX_ATTEMPTS_PER_OPEN_CHALLENGE = 20
+
+
+def generate(num_players, num_games, num_open_challenges, seed, history):
+    """Fill the current app's (empty) database with a synthetic ladder.
+
+    Args:
+        num_players - how many players to add.
+        num_games - how many games to add.
+        num_open_challenges - how many challenges to leave open.
+        seed - the seed for the random number generator.
+        history - iff True, every game's rating changes are recorded too.
+    """
+    if num_open_challenges > num_players * (num_players - 1) // 2:
+        raise ValueError("Can't open %d challenges between %d players" % (
+            num_open_challenges, num_players))
+
+    rng = random.Random(seed)
+
+    skills = [rng.gauss(0, SKILL_STDDEV) for _ in range(num_players)]
+    activity = _cumulative([rng.paretovariate(ACTIVITY_SHAPE)
+                            for _ in range(num_players)])
+
+    # Players join over the first tenth of the period.
+    joined = [
+        START_TIME + timedelta(seconds=i * DURATION.total_seconds() / 10 /
+                               num_players)
+        for i in range(num_players)
+    ]
+    _insert(Player, (
+        {
+            'id': i + 1,
+            'name': 'player%d' % (i + 1),
+            'rating': 0,
+            'time_created': joined[i],
+        }
+        for i in range(num_players)
+    ))
+
+    seconds_per_game = DURATION.total_seconds() / max(num_games, 1)
+
+    def games_and_challenges():
+        for i in range(num_games):
+            time_created = START_TIME + DURATION / 10 + \
+                timedelta(seconds=i * seconds_per_game)
+            player1 = _pick(rng, activity)
+            player2 = _pick(rng, activity)
+            while player2 == player1:
+                player2 = _pick(rng, activity)
+
+            if rng.random() < elo.expectation(skills[player1],
+                                              skills[player2]):
+                winner, loser = player1, player2
+            else:
+                winner, loser = player2, player1
+
+            winner_score = rng.choice([11, 21])
+            if rng.random() < CLOSE_GAME_FRACTION:
+                loser_score = winner_score - 1
+            else:
+                loser_score = rng.randint(0, winner_score - 2)
+            game = {
+                'id': i + 1,
+                'winner_id': winner + 1,
+                'loser_id': loser + 1,
+                'winner_score': winner_score,
+                'loser_score': loser_score,
+                'time_created': time_created,
+            }
+
+            challenge = None
+            if rng.random() < CHALLENGED_GAME_FRACTION:
+                challenge = _challenge(
+                    winner + 1,
+                    loser + 1,
+                    time_created - timedelta(seconds=seconds_per_game / 2),
+                    game_id=i + 1
+                )
+
+            yield game, challenge
+
+    games = []
+    challenges = []
+    for game, challenge in games_and_challenges():
+        games.append(game)
+        if challenge is not None:
+            challenges.append(challenge)
+        if len(games) == INSERT_CHUNK_SIZE:
+            _insert(Game, games)
+            _insert(Challenge, challenges)
+            games = []
+            challenges = []
+    _insert(Game, games)
+    _insert(Challenge, challenges)
+
+    starter_rating = db.get_app().config['RATINGS']['STARTER_RATING']
+    _, players, _ = replay.replay_ratings(starter_rating,
+                                          rewrite_history=history)
+    replay.apply_ratings(players)
+
+    # Open challenges are issued by the lower rated player, as the service
+    # requires, and there's at most one between any two players.
+    ratings = dict((id_, rating) for id_, _, _, rating in players)
+    num_eligible_pairs = _num_unequal_pairs(ratings.values())
+    if num_eligible_pairs < num_open_challenges:
+        raise ValueError(
+            "Can't open %d challenges: only %d pairs of players have "
+            "different ratings" % (num_open_challenges, num_eligible_pairs))
+
+    # Pairs are drawn by activity, like games. Once that has failed too often,
+    # e.g. because most eligible pairs are taken, the rest are drawn from all
+    # the remaining eligible pairs.
+    pairs = set()
+    max_attempts = MAX_ATTEMPTS_PER_OPEN_CHALLENGE * num_open_challenges
+    for _ in range(max_attempts):
+        if len(pairs) == num_open_challenges:
+            break
+
+        player1 = _pick(rng, activity) + 1
+        player2 = _pick(rng, activity) + 1
+        if ratings[player1] != ratings[player2]:
+            pairs.add((min(player1, player2), max(player1, player2)))
+    if len(pairs) < num_open_challenges:
+        remaining = [
+            (player1, player2)
+            for player1 in range(1, num_players + 1)
+            for player2 in range(player1 + 1, num_players + 1)
+            if ratings[player1] != ratings[player2] and
+            (player1, player2) not in pairs
+        ]
+        pairs.update(rng.sample(remaining, num_open_challenges - len(pairs)))
+
+    end = START_TIME + DURATION + DURATION / 10
+    open_challenges = []
+    for i, pair in enumerate(sorted(pairs)):
+        challenger, challenged = sorted(pair, key=ratings.get)
+        open_challenges.append(_challenge(
+            challenger,
+            challenged,
+            end + timedelta(seconds=i)
+        ))
+    _insert(Challenge, open_challenges)
+
+    reconcile_player_counters()
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _cumulative(weights):
+    total = 0
+    cumulative = []
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+    return cumulative
+
+
+def _num_unequal_pairs(values):
+    """Return how many pairs of `values` are unequal."""
+    counts = collections.Counter(values)
+    num_values = sum(counts.values())
+    return (num_values ** 2 -
+            sum(count ** 2 for count in counts.values())) // 2
+
+
+def _pick(rng, cumulative_weights):
+    """Return a random index, weighted by `cumulative_weights`."""
+    return bisect.bisect(cumulative_weights,
+                         rng.random() * cumulative_weights[-1])
+
+
+def _challenge(challenger_id, challenged_id, time_created, game_id=None):
+    return {
+        'challenger_id': challenger_id,
+        'challenged_id': challenged_id,
+        'min_player_id': min(challenger_id, challenged_id),
+        'max_player_id': max(challenger_id, challenged_id),
+        'time_created': time_created,
+        'game_id': game_id,
+    }
+
+
+def _insert(model, rows):
+    """Insert rows in chunks, committing each one."""
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == INSERT_CHUNK_SIZE:
+            db.session.execute(model.__table__.insert(), chunk)
+            chunk = []
+    if chunk:
+        db.session.execute(model.__table__.insert(), chunk)
+
+    bump_ladder_version()
+    db.session.commit()
+
+
+def main(args):
+    app = create_app()
+    context = app.app_context()
+    context.push()
+
+    migrations.upgrade()
+    if Player.query.first() is not None:
+        sys.exit('The database at %s already has players' %
+                 app.config['SQLALCHEMY_DATABASE_URI'])
+
+    start = time.time()
+    try:
+        generate(
+            args.num_players,
+            args.num_games,
+            args.num_open_challenges,
+            args.seed,
+            args.history
+        )
+    except ValueError as e:
+        sys.exit(str(e))
+    finally:
+        # Closing the last connection to a database moves everything in its
+        # write-ahead log, if it has one, into the database file. Other
+        # engines, e.g. for reads, may have connections to the same file.
+        db.session.remove()
+        for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or []):
+            db.get_engine(app, bind=bind).dispose()
+        context.pop()
+    print 'Generated %d players and %d games in %.1f s' % (
+        args.num_players, args.num_games, time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument('--num-players', type=int, default=10000)
+    parser.add_argument('--num-games', type=int, default=1000000)
+    parser.add_argument('--num-open-challenges', type=int, default=500)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--no-history',
+        dest='history',
+        action='store_false',
+        default=True,
+        help="Don't record each game's rating changes."
+    )
+    main(parser.parse_args(sys.argv[1:]))
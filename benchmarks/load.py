@@ -0,0 +1,461 @@
+"""Drive the service's endpoints concurrently and report how they perform.
+
+Each scenario sends a fixed number of requests of one kind from several
+threads at once, and reports its throughput, its 50th, 95th and 99th
+percentile latencies, and how many SQL statements each request ran on
+average. Scenarios run one after another, reads first, so that the writes
+don't change what the reads see.
+
+By default the service is served from this process, against a temporary copy
+of the database of the `FLASK_ENV` environment, which should first be filled
+by `benchmarks.generate`. Every run then starts from the same data, however
+many times it's repeated. Statements can only be counted this way; pass
+`--url` to load a service running elsewhere instead.
+
+The results can be saved as a baseline, and later runs compared with it. A
+run fails if any scenario's 95th percentile latency or statements per request
+are more than `--tolerance` higher than the baseline's, or its throughput is
+that much lower. Run from the repository root:
+
+    FLASK_ENV=BENCHMARK venv/bin/python -m benchmarks.load \\
+        --baseline benchmarks/baseline.json --save-baseline
+    FLASK_ENV=BENCHMARK venv/bin/python -m benchmarks.load \\
+        --baseline benchmarks/baseline.json
+"""
+
+import Queue
+import argparse
+import atexit
+import logging
+import math
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+import simplejson as json
+from sqlalchemy import event
+from sqlalchemy.engine.url import make_url
+from werkzeug.serving import make_server
+
+
+# The fraction by which a result may be worse than the baseline's before it is
+# reported as a regression.
+DEFAULT_TOLERANCE = 0.25
+
+# The names of the statistics compared with the baseline, and whether higher
+# is better for each.
+COMPARED_STATS = (
+    ('p95_ms', False),
+    ('requests_per_second', True),
+    ('statements_per_request', False),
+)
+
+
+class Scenario(object):
+    """One kind of request to send repeatedly.
+
+    Args:
+        name - the scenario's name in reports and baselines.
+        make_requests - a function taking (base URL, session, a seeded
+            random.Random, number of requests) that returns a list of that many
+            argument dicts for `requests.Session.request`. It is called once,
+            before the scenario's requests are timed.
+    """
+
+    def __init__(self, name, make_requests):
+        self.name = name
+        self.make_requests = make_requests
+
+
+def _get(path, **params):
+    def make_requests(url, session, rng, num_requests):
+        return [{'method': 'GET', 'url': url + path, 'params': params}] * \
+            num_requests
+    return make_requests
+
+
+def _get_player_rank(url, session, rng, num_requests):
+    names = [player['name'] for player in _get_ladder(url, session)]
+    return [
+        {'method': 'GET', 'url': '%s/players/%s/rank' % (url,
+                                                         rng.choice(names))}
+        for _ in range(num_requests)
+    ]
+
+
+def _post_games(url, session, rng, num_requests):
+    names = [player['name'] for player in _get_ladder(url, session)]
+    posts = []
+    for _ in range(num_requests):
+        winner, loser = rng.sample(names, 2)
+        winner_score = rng.choice([11, 21])
+        posts.append({
+            'method': 'POST',
+            'url': url + '/games',
+            'data': {
+                'winner': winner,
+                'loser': loser,
+                'winner_score': winner_score,
+                'loser_score': rng.randint(0, winner_score - 2),
+            },
+        })
+    return posts
+
+
+def _post_challenges(url, session, rng, num_requests):
+    # Players challenge whoever is just above them in the ladder, skipping
+    # pairs that already have an open challenge, so that every challenge is
+    # valid when the scenario starts.
+    ladder = _get_ladder(url, session)
+    open_pairs = set(
+        frozenset([challenge['challenger'], challenge['challenged']])
+        for challenge in session.get(url + '/challenges').json()
+    )
+    pairs = [
+        (lower['name'], higher['name'])
+        for higher, lower in zip(ladder, ladder[1:])
+        if lower['rating'] < higher['rating'] and
+        frozenset([lower['name'], higher['name']]) not in open_pairs
+    ]
+    rng.shuffle(pairs)
+
+    return [
+        {
+            'method': 'POST',
+            'url': url + '/challenges',
+            'data': {'challenger': challenger, 'challenged': challenged},
+        }
+        for challenger, challenged in pairs[:num_requests]
+    ]
+
+
+SCENARIOS = [
+    Scenario('GET /players?limit=50', _get('/players', limit=50)),
+    Scenario('GET /players', _get('/players')),
+    Scenario('GET /players/NAME/rank', _get_player_rank),
+    Scenario('GET /games', _get('/games')),
+    Scenario('GET /challenges', _get('/challenges')),
+    Scenario('POST /challenges', _post_challenges),
+    Scenario('POST /games', _post_games),
+]
+
+
+def run_scenario(scenario, url, concurrency, num_requests, seed,
+                 statement_counter=None):
+    """Send a scenario's requests and measure them.
+
+    Args:
+        scenario - the `Scenario` to run.
+        url - the service's base URL.
+        concurrency - how many requests to send at once.
+        num_requests - how many requests to send in total.
+        seed - the seed for choosing the requests.
+        statement_counter - a `StatementCounter` for the service, or None if
+            statements can't be counted.
+
+    Returns:
+        A dict of the scenario's statistics.
+    """
+    with requests.Session() as session:
+        kwargs_list = scenario.make_requests(
+            url, session, random.Random(seed), num_requests)
+
+    pending = Queue.Queue()
+    for kwargs in kwargs_list:
+        pending.put(kwargs)
+    results = []
+
+    def send_pending():
+        # Each thread keeps its own connection open, as a client would.
+        with requests.Session() as session:
+            while True:
+                try:
+                    kwargs = pending.get_nowait()
+                except Queue.Empty:
+                    return
+
+                start = time.time()
+                try:
+                    status_code = session.request(**kwargs).status_code
+                except requests.RequestException:
+                    status_code = None
+                results.append((time.time() - start, status_code))
+
+    threads = [threading.Thread(target=send_pending)
+               for _ in range(concurrency)]
+
+    if statement_counter is not None:
+        statement_counter.reset()
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    latencies = sorted(latency for latency, _ in results)
+    stats = {
+        'requests': len(results),
+        'server_errors': sum(1 for _, status_code in results
+                             if status_code is None or status_code >= 500),
+        'rejected': sum(1 for _, status_code in results
+                        if status_code is not None and
+                        400 <= status_code < 500),
+        'requests_per_second': len(results) / elapsed if elapsed else 0.0,
+        'p50_ms': _percentile(latencies, 50) * 1000,
+        'p95_ms': _percentile(latencies, 95) * 1000,
+        'p99_ms': _percentile(latencies, 99) * 1000,
+    }
+    if statement_counter is not None and results:
+        stats['statements_per_request'] = \
+            float(statement_counter.count) / len(results)
+    return stats
+
+
+def find_regressions(results, baseline, tolerance):
+    """Compare results with a baseline.
+
+    Returns:
+        A list of strings describing each statistic that is more than
+        `tolerance` worse than the baseline's.
+    """
+    regressions = []
+    for name, stats in sorted(results.items()):
+        baseline_stats = baseline.get(name)
+        if baseline_stats is None:
+            continue
+
+        for stat, higher_is_better in COMPARED_STATS:
+            value = stats.get(stat)
+            baseline_value = baseline_stats.get(stat)
+            if value is None or baseline_value is None:
+                continue
+
+            if higher_is_better:
+                is_regression = value < baseline_value * (1 - tolerance)
+            else:
+                is_regression = value > baseline_value * (1 + tolerance)
+            if is_regression:
+                regressions.append('%s: %s is %.2f, baseline is %.2f' % (
+                    name, stat, value, baseline_value))
+    return regressions
+
+
+class StatementCounter(object):
+    """Counts the statements some engines execute, from any thread."""
+
+    def __init__(self, engines):
+        self._lock = threading.Lock()
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+
+    def _count(self, *args):
+        with self._lock:
+            self.count += 1
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _get_ladder(url, session):
+    response = session.get(url + '/players')
+    response.raise_for_status()
+    return response.json()
+
+
+def _percentile(sorted_values, percent):
+    """Return the nearest-rank percentile of a sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = int(math.ceil(percent * len(sorted_values) / 100.0))
+    return sorted_values[min(max(rank, 1), len(sorted_values)) - 1]
+
+
+def _serve(app):
+    """Serve an app from a background thread.
+
+    Returns:
+        A pair (the app's base URL, a `StatementCounter` for its engine).
+    """
+    from app.models import db
+
+    app.config['DEBUG'] = False
+    uri = app.config['SQLALCHEMY_DATABASE_URI']
+    copy_uri = _copy_database(app, uri)
+    app.config['SQLALCHEMY_DATABASE_URI'] = copy_uri
+    # Other engines reading the same database, e.g. for reads, read the copy.
+    binds = app.config['SQLALCHEMY_BINDS'] or {}
+    for key, bind_uri in binds.items():
+        if bind_uri == uri:
+            binds[key] = copy_uri
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    with app.app_context():
+        counter = StatementCounter([
+            db.get_engine(app, bind=bind)
+            for bind in [None] + list(app.config['SQLALCHEMY_BINDS'] or [])
+        ])
+
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return 'http://127.0.0.1:%d' % server.server_port, counter
+
+
+def _copy_database(app, uri):
+    """Copy a SQLite database, including any writes still in its write-ahead
+    log, to a temporary file, which is deleted on exit.
+
+    Returns:
+        The URI of the copy, or `uri` unchanged if it isn't a SQLite file.
+    """
+    url = make_url(uri)
+    if url.drivername != 'sqlite' or url.database in (None, '', ':memory:'):
+        return uri
+
+    # Flask-SQLAlchemy resolves relative paths against the app's root.
+    path = os.path.join(app.root_path, url.database)
+    if not os.path.exists(path):
+        sys.exit('No database at %s; run benchmarks.generate first' % path)
+
+    # With a write-ahead log, recent writes may only be in the log, so they are
+    # moved into the database file, and the log emptied, before it's copied.
+    connection = sqlite3.connect(path)
+    try:
+        busy, _, _ = connection.execute(
+            'PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    finally:
+        connection.close()
+    if busy:
+        sys.exit("Couldn't checkpoint %s; is it in use?" % path)
+
+    directory = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, directory, True)
+    copy = os.path.join(directory, os.path.basename(path))
+    shutil.copyfile(path, copy)
+
+    url.database = copy
+    return str(url)
+
+
+def _print_results(results):
+    print '%-24s %8s %8s %9s %9s %9s %9s %11s' % (
+        '', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms',
+        'stmts/req')
+    for scenario in SCENARIOS:
+        stats = results.get(scenario.name)
+        if stats is None:
+            continue
+
+        statements = stats.get('statements_per_request')
+        print '%-24s %8d %8d %9.1f %9.1f %9.1f %9.1f %11s' % (
+            scenario.name,
+            stats['requests'],
+            stats['server_errors'],
+            stats['requests_per_second'],
+            stats['p50_ms'],
+            stats['p95_ms'],
+            stats['p99_ms'],
+            '-' if statements is None else '%.1f' % statements
+        )
+
+
+def main(args):
+    # Fail before the scenarios run if there's no baseline to compare with.
+    baseline = None
+    if args.baseline is not None and not args.save_baseline:
+        try:
+            with open(args.baseline) as f:
+                baseline = json.load(f)['results']
+        except IOError:
+            sys.exit('No baseline at %s; save one with --save-baseline' %
+                     args.baseline)
+
+    if args.url is None:
+        from app.app import create_app
+        url, statement_counter = _serve(create_app())
+    else:
+        url, statement_counter = args.url.rstrip('/'), None
+
+    results = {}
+    for scenario in SCENARIOS:
+        if args.scenario and scenario.name not in args.scenario:
+            continue
+        results[scenario.name] = run_scenario(
+            scenario,
+            url,
+            args.concurrency,
+            args.num_requests,
+            args.seed,
+            statement_counter
+        )
+    _print_results(results)
+
+    if args.save_baseline:
+        if args.baseline is None:
+            sys.exit('--save-baseline needs --baseline')
+        with open(args.baseline, 'w') as f:
+            json.dump({
+                'concurrency': args.concurrency,
+                'num_requests': args.num_requests,
+                'seed': args.seed,
+                'results': results,
+            }, f, indent=2, sort_keys=True)
+        print 'Saved baseline to %s' % args.baseline
+
+    if any(stats['server_errors'] for stats in results.values()):
+        sys.exit('Some requests failed')
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        for regression in regressions:
+            print 'REGRESSION %s' % regression
+        if regressions:
+            sys.exit(1)
+        print 'No regressions against %s' % args.baseline
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description=__doc__,
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument(
+        '--url',
+        help='The base URL of a running service to load, instead of serving '
+             'one from this process.'
+    )
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument(
+        '--num-requests',
+        type=int,
+        default=500,
+        help='How many requests to send in each scenario.'
+    )
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument(
+        '--scenario',
+        action='append',
+        help='Only run the scenario with this name. May be repeated.'
+    )
+    parser.add_argument('--baseline', help='A baseline file to compare with.')
+    parser.add_argument(
+        '--save-baseline',
+        action='store_true',
+        help='Save the results to the --baseline file instead of comparing '
+             'with it.'
+    )
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    main(parser.parse_args(sys.argv[1:]))
@@ -0,0 +1,89 @@
+"""Compare the compiled serializers with the marshmallow schemas they replace.
+
+Each serializer is timed on a list of unsaved model objects, so the numbers
+include SQLAlchemy's attribute access but not the database. Run from the
+repository root:
+
+    venv/bin/python -m benchmarks.serialization --num-rows 1000
+"""
+
+import argparse
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+from app import schemas
+from app.models import Challenge, Game, Player
+
+
+def make_rows(num_rows):
+    """Return lists (players, games, challenges) of `num_rows` objects each."""
+    start = datetime(2015, 12, 1)
+    players = [
+        Player(
+            name=u'player%d' % i,
+            rating=1200 + i,
+            num_wins=i,
+            num_losses=i,
+            time_created=start + timedelta(seconds=i)
+        )
+        for i in range(num_rows)
+    ]
+    games = [
+        Game(
+            id=i,
+            winner=players[i],
+            loser=players[(i + 1) % num_rows],
+            winner_score=21,
+            loser_score=i % 20,
+            time_created=start + timedelta(seconds=i)
+        )
+        for i in range(num_rows)
+    ]
+    challenges = [
+        Challenge(
+            id=i,
+            challenger=players[i],
+            challenged=players[(i + 1) % num_rows],
+            time_created=start + timedelta(seconds=i)
+        )
+        for i in range(num_rows)
+    ]
+    return players, games, challenges
+
+
+def time_ms(func, repeat):
+    return min(timeit.repeat(func, number=1, repeat=repeat)) * 1000
+
+
+def main(args):
+    players, games, challenges = make_rows(args.num_rows)
+    cases = [
+        ('player', players, schemas.players_schema,
+         schemas.serialize_player),
+        ('game', games, schemas.games_schema, schemas.serialize_game),
+        ('challenge', challenges, schemas.challenges_schema,
+         schemas.serialize_challenge),
+    ]
+
+    print '%d rows, best of %d runs' % (args.num_rows, args.repeat)
+    print '%-10s %14s %14s %8s' % ('', 'marshmallow', 'compiled', 'speedup')
+    for name, rows, schema, serialize in cases:
+        assert [serialize(row) for row in rows] == schema.dump(rows).data
+
+        marshmallow_ms = time_ms(lambda: schema.dump(rows), args.repeat)
+        compiled_ms = time_ms(
+            lambda: [serialize(row) for row in rows], args.repeat)
+        print '%-10s %11.1f ms %11.1f ms %7.1fx' % (
+            name,
+            marshmallow_ms,
+            compiled_ms,
+            marshmallow_ms / compiled_ms
+        )
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--num-rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    main(parser.parse_args(sys.argv[1:]))
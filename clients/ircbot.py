@@ -16,40 +16,83 @@ import sys
 import simplejson as json
 
 import requests
+from requests.adapters import HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
 from twisted.words.protocols import irc
-from twisted.internet import protocol, reactor, ssl
+from twisted.internet import defer, protocol, reactor, ssl, threads
+from twisted.python import threadpool
+
+
+# How many requests to the ladder service can be in flight at once, and so how
+# many keep-alive connections to it are pooled. Commands beyond this wait for a
+# free thread rather than blocking the reactor.
+DEFAULT_SERVICE_THREADS = 4
+
+# How long, in seconds, to wait for the ladder service to accept a connection
+# and then to send a response.
+DEFAULT_SERVICE_CONNECT_TIMEOUT = 2.0
+DEFAULT_SERVICE_READ_TIMEOUT = 5.0
+
+# How many times a failed request is retried, and the backoff factor for the
+# delay between attempts, which doubles each time (see urllib3's `Retry`).
+DEFAULT_SERVICE_RETRIES = 3
+SERVICE_RETRY_BACKOFF_FACTOR = 0.25
+
+# How long, in seconds, a listing from the service is reused before it's
+# requested again.
+DEFAULT_CACHE_TTL = 30.0
+
+# Responses to a GET that mean the service is briefly unavailable and the
+# request is worth retrying.
+SERVICE_RETRY_STATUSES = frozenset([502, 503, 504])
 
 
 def handles_service_errors(func):
     """Decorator that will return a error message when the service errors.
 
     This is meant to annotate any method that (a) has a call to the service and
-    (b) returns strings that are sent to channel.
+    (b) returns (a Deferred that fires with) strings that are sent to channel.
+    Errors talking to the service, including timeouts and requests that still
+    fail once their retries are used up, are turned into a message for the
+    channel.
 
     This decorator will only work for methods within `LadderBot`.
     """
     @functools.wraps(func)
     def wrapper(self, *args, **kwargs):
-        try:
-            return func(self, *args, **kwargs)
-        except requests.exceptions.RequestException:
+        def _handle_error(failure):
+            failure.trap(requests.exceptions.RequestException)
+            _log_error('service request failed: %s' % failure.value)
             return self._make_service_error_message()
 
-    return wrapper
+        deferred = defer.maybeDeferred(func, self, *args, **kwargs)
+        return deferred.addErrback(_handle_error)
 
+    return wrapper
 
-class LadderBot(irc.IRCClient):
-    """A bot that connects to an IRC channel to manage a ping pong ladder."""
 
-    def process_command(self, command):
-        """Identify the command, talk to ladder service, and return a list of
-        messages to be sent back to the channel.
-        """
-        _log_info('COMMAND: %s' % command)
-        help_pat = re.compile(r'help|commands', re.IGNORECASE)
-        player_pat = re.compile(r'add\s+player\s+(?P<name>\w+)')
-        ladder_pat = re.compile(r'ladder|ratings|rankings')
-        game_pat = re.compile(r"""
+# The commands the bot understands, as tuples (verbose pattern, name of the
+# `LadderBot` method that handles it, help text). A command is handled by the
+# first pattern that matches it, and the pattern's named groups are passed to
+# the handler as keyword arguments.
+COMMANDS = [
+    (
+        r'(?i)help|commands',
+        'get_help',
+        'Show this help: help'
+    ),
+    (
+        r'ladder|ratings|rankings',
+        'get_ladder',
+        'Show all players ordered by rating: ladder'
+    ),
+    (
+        r'add\s+player\s+(?P<name>\w+)',
+        'add_player',
+        'Add a player: add player PLAYER_NAME'
+    ),
+    (
+        r"""
             (?P<winner>\w+)
             \s+
             beat
@@ -61,54 +104,61 @@ class LadderBot(irc.IRCClient):
             (to|-)
             \s*
             (?P<loser_score>\d+)
-        """, re.VERBOSE)
-        add_challenge_pat = re.compile(r"""
+        """,
+        'add_game',
+        'Add a game: WINNER_NAME beat LOSER_NAME WINNER_SCORE-LOSER_SCORE'
+    ),
+    (
+        r"""
             (?P<challenger>\w+)
             \s+
             challenges
             \s+
             (?P<challenged>\w+)
-        """, re.VERBOSE)
-        show_challenge_pat = re.compile(r'challenges|show challenges')
-
-        if help_pat.match(command):
-            return self.get_help()
+        """,
+        'add_challenge',
+        'Add a challenge: CHALLENGER_NAME challenges CHALLENGED_NAME'
+    ),
+    (
+        r'challenges|show\s+challenges',
+        'get_challenges',
+        'Show open challenges: challenges'
+    ),
+]
 
-        if ladder_pat.match(command):
-            return self.get_ladder()
 
-        match_ = player_pat.match(command)
-        if match_:
-            return self.add_player(match_.groupdict()['name'])
-
-        match_ = game_pat.match(command)
-        if match_:
-            data = match_.groupdict()
-            return self.add_game(data['winner'], data['loser'],
-                                 data['winner_score'],
-                                 data['loser_score'])
+class LadderBot(irc.IRCClient):
+    """A bot that connects to an IRC channel to manage a ping pong ladder."""
 
-        match_ = add_challenge_pat.match(command)
-        if match_:
-            data = match_.groupdict()
-            return self.add_challenge(data['challenger'], data['challenged'])
+    def process_command(self, command):
+        """Identify the command and talk to ladder service.
 
-        match_ = show_challenge_pat.match(command)
-        if match_:
-            return self.get_challenges()
+        Returns:
+            A Deferred that fires with a list of messages to be sent back to
+            the channel.
+        """
+        _log_info('COMMAND: %s' % command)
+        for pattern, handler_name, _ in self.factory.commands:
+            match_ = pattern.match(command)
+            if match_:
+                handler = getattr(self, handler_name)
+                return defer.maybeDeferred(handler, **match_.groupdict())
 
-        return ['Command not recognized! Type "pongbot help" for more info.']
+        return defer.succeed(
+            ['Command not recognized! Type "pongbot help" for more info.'])
 
     @handles_service_errors
-    def add_player(self, player_name):
+    @defer.inlineCallbacks
+    def add_player(self, name):
         """Add a new player"""
-        response = self._post('/players', {'name': player_name})
-        return self._make_message(
+        response = yield self._post('/players', {'name': name})
+        defer.returnValue(self._make_message(
             response,
-            lambda: ['Added player {0}'.format(player_name)]
-        )
+            lambda: ['Added player {0}'.format(name)]
+        ))
 
     @handles_service_errors
+    @defer.inlineCallbacks
     def add_game(self, winner, loser, winner_score, loser_score):
         """Add a new game."""
 
@@ -119,25 +169,27 @@ class LadderBot(irc.IRCClient):
             'loser_score': loser_score,
         }
 
-        response = self._post('/games', data)
-        return self._make_message(response, lambda: ['Added game'])
+        response = yield self._post('/games', data)
+        defer.returnValue(
+            self._make_message(response, lambda: ['Added game']))
 
     @handles_service_errors
+    @defer.inlineCallbacks
     def add_challenge(self, challenger, challenged):
         data = {
             'challenger': challenger,
             'challenged': challenged
         }
 
-        response = self._post('/challenges', data)
-        return self._make_message(response, lambda: ['Added challenge'])
+        response = yield self._post('/challenges', data)
+        defer.returnValue(
+            self._make_message(response, lambda: ['Added challenge']))
 
     @handles_service_errors
+    @defer.inlineCallbacks
     def get_challenges(self):
         """Return the open challenges."""
-        response = self._get('/challenges')
-        if not response.ok:
-            return [self._error_message()]
+        response = yield self._get('/challenges')
 
         def _make_line((idx, challenge)):
             return '[%d] %s challenged %s' % (
@@ -146,18 +198,16 @@ class LadderBot(irc.IRCClient):
                 challenge['challenged'].encode('utf-8')
             )
 
-        return self._make_message(
+        defer.returnValue(self._make_message(
             response,
             lambda: map(_make_line, enumerate(response.json(), start=1))
-        )
+        ))
 
     @handles_service_errors
+    @defer.inlineCallbacks
     def get_ladder(self):
         """Return the players ordered by rating."""
-        response = self._get('/players')
-
-        if not response.ok:
-            return [self._error_message()]
+        response = yield self._get('/players')
 
         def _make_line((rank, player)):
             return '[%d] %s %d-%d (%d)' % (
@@ -168,19 +218,16 @@ class LadderBot(irc.IRCClient):
                 player['rating']
             )
 
-        return self._make_message(
+        defer.returnValue(self._make_message(
             response,
             lambda: map(_make_line, enumerate(response.json(), start=1))
-        )
+        ))
 
     def get_help(self):
         """Display help information about using the bot and available commands.
         """
-        return [
-            'Type "%s: COMMAND". Commands are:' % self.nickname,
-            'Add a player: add player PLAYER_NAME',
-            'Add a game: WINNER_NAME beat LOSER_NAME WINNER_SCORE-LOSER_SCORE',
-            'Show all players ordered by rating: ladder'
+        return ['Type "%s: COMMAND". Commands are:' % self.nickname] + [
+            help_ for _, _, help_ in self.factory.commands
         ]
 
     ###########################################################################
@@ -215,41 +262,107 @@ class LadderBot(irc.IRCClient):
 
     def privmsg(self, user, channel, message):
         """Respond to a message in the channel if the bot is mentioned."""
+        # Most messages in a channel aren't for the bot, so rule them out
+        # before doing any regex work or logging.
+        stripped = message.lstrip()
+        if not (stripped.startswith(self.nickname) or
+                stripped.startswith(self.nickname.lower())):
+            return
+
         _log_info('privMsg from %s in channel %s: "%s"' %
                   (user, channel, message))
-        pat = re.compile(r"""
-            \s*
-            (?P<nick>%s|%s)
-            (\s+|:)
-            \s*
-            (?P<command>.*)
-        """ % (self.nickname, self.nickname.lower()), re.VERBOSE)
-        match = pat.match(message)
+        match = self.factory.mention_pattern.match(message)
         if match is None:
             _log_info('No action for "%s"' % message)
             return
 
         data = match.groupdict()
-        response = self.process_command(data['command'])
+        deferred = self.process_command(data['command'])
+        deferred.addCallback(self._send_lines, channel)
+        deferred.addErrback(self._log_command_failure, data['command'])
 
-        for line in response:
+    def _send_lines(self, lines, channel):
+        for line in lines:
             self.msg(channel, line)
 
+    def _log_command_failure(self, failure, command):
+        _log_error('command "%s" failed: %s' %
+                   (command, failure.getTraceback()))
+
     def _post(self, endpoint, data):
         """Post JSON data to the service.
 
-        Note that this is just a pass-through and that no exceptions are
+        The request is made on the factory's thread pool so that the reactor
+        is never blocked waiting for the service. Note that no exceptions are
         handled here.
+
+        Any change to the ladder can change every listing, so the cache of
+        GET responses is cleared both when the request is made and when it
+        completes.
+
+        Returns:
+            A Deferred that fires with the `requests` response.
         """
-        return requests.post(
+        def _invalidate_cache(result):
+            self.factory.invalidate_cache()
+            return result
+
+        self.factory.invalidate_cache()
+        deferred = self._call_service(
+            self.factory.session.post,
             self._api_url + endpoint,
             data=json.dumps(data),
             headers={'Content-Type': 'application/json'}
         )
+        return deferred.addBoth(_invalidate_cache)
 
+    @defer.inlineCallbacks
     def _get(self, endpoint):
-        """Make a GET request to the specified endpoint and return response."""
-        return requests.get(self._api_url + endpoint)
+        """Make a GET request to the specified endpoint.
+
+        A successful response is reused for `cache_ttl` seconds. After that
+        the request is made again with the response's ETag, if it had one, so
+        that an unchanged listing costs the service a 304 rather than the
+        whole body.
+
+        Returns:
+            A Deferred that fires with the `requests` response.
+        """
+        cache = self.factory.response_cache
+        cached = cache.get(endpoint)
+        now = reactor.seconds()
+        if cached is not None and now - cached[0] < self.factory.cache_ttl:
+            defer.returnValue(cached[1])
+
+        headers = {}
+        if cached is not None and 'ETag' in cached[1].headers:
+            headers['If-None-Match'] = cached[1].headers['ETag']
+
+        generation = self.factory.cache_generation
+        response = yield self._call_service(
+            self.factory.session.get,
+            self._api_url + endpoint,
+            headers=headers
+        )
+        if response.status_code == 304 and cached is not None:
+            response = cached[1]
+
+        # Don't cache a response that may predate a change the bot made while
+        # the request was in flight.
+        if response.ok and generation == self.factory.cache_generation:
+            cache[endpoint] = (reactor.seconds(), response)
+
+        defer.returnValue(response)
+
+    def _call_service(self, request, url, **kwargs):
+        return threads.deferToThreadPool(
+            reactor,
+            self.factory.service_pool,
+            request,
+            url,
+            timeout=self.factory.service_timeouts,
+            **kwargs
+        )
 
     def _make_service_error_message(self):
         return [
@@ -292,14 +405,56 @@ class LadderBotFactory(protocol.ClientFactory):
         service_host,
         service_port,
         server_password,
-        maintainer_name
+        maintainer_name,
+        service_threads=DEFAULT_SERVICE_THREADS,
+        service_connect_timeout=DEFAULT_SERVICE_CONNECT_TIMEOUT,
+        service_read_timeout=DEFAULT_SERVICE_READ_TIMEOUT,
+        service_retries=DEFAULT_SERVICE_RETRIES,
+        cache_ttl=DEFAULT_CACHE_TTL
     ):
         self.channel = channel
         self.nickname = nickname
         self.server_password = server_password
         self.maintainer_name = maintainer_name
 
+        # Compiled once here rather than for every message.
+        self.commands = [
+            (re.compile(pattern, re.VERBOSE), name, help_)
+            for pattern, name, help_ in COMMANDS
+        ]
+        self.mention_pattern = re.compile(r"""
+            \s*
+            (?P<nick>%s|%s)
+            (\s+|:)
+            \s*
+            (?P<command>.*)
+        """ % (re.escape(nickname), re.escape(nickname.lower())), re.VERBOSE)
+
         self.api_url = 'http://%s:%d' % (service_host, service_port)
+        self.service_timeouts = (service_connect_timeout, service_read_timeout)
+        self.session = _make_session(service_threads, service_retries)
+
+        # Requests to the service are blocking, so they're made on their own
+        # bounded pool rather than the reactor's shared one.
+        self.service_pool = threadpool.ThreadPool(
+            minthreads=0,
+            maxthreads=service_threads,
+            name='ladder-service'
+        )
+        reactor.callWhenRunning(self.service_pool.start)
+        reactor.addSystemEventTrigger(
+            'during', 'shutdown', self.service_pool.stop)
+
+        # Successful GET responses by endpoint, as pairs (time fetched,
+        # response). This is only used from the reactor thread, so it needs no
+        # locking. The generation is bumped whenever the cache is cleared.
+        self.cache_ttl = cache_ttl
+        self.response_cache = {}
+        self.cache_generation = 0
+
+    def invalidate_cache(self):
+        self.response_cache.clear()
+        self.cache_generation += 1
 
     def clientConnectionLost(self, connector, reason):
         _log_error('lost connection (%s), reconnecting' % reason)
@@ -308,6 +463,32 @@ class LadderBotFactory(protocol.ClientFactory):
         _log_error('could not connect: %s' % reason)
 
 
+def _make_session(pool_size, retries):
+    """Make a session that keeps connections to the service alive between
+    commands.
+
+    Only GETs are retried once the service has been reached, since retrying a
+    POST that timed out could record a game twice. A request that never
+    connected is safe to retry whatever its method.
+    """
+    retry = Retry(
+        total=retries,
+        method_whitelist=frozenset(['GET']),
+        status_forcelist=SERVICE_RETRY_STATUSES,
+        backoff_factor=SERVICE_RETRY_BACKOFF_FACTOR
+    )
+    adapter = HTTPAdapter(
+        pool_connections=1,
+        pool_maxsize=pool_size,
+        max_retries=retry
+    )
+
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
 def _log_info(message):
     print >> sys.stderr, 'INFO:', message
 
@@ -323,7 +504,12 @@ def main(args):
         args.service_host,
         args.service_port,
         args.server_password,
-        args.maintainer_name
+        args.maintainer_name,
+        args.service_threads,
+        args.service_connect_timeout,
+        args.service_read_timeout,
+        args.service_retries,
+        args.cache_ttl
     )
 
     if args.use_ssl:
@@ -360,6 +546,36 @@ if __name__ == '__main__':
     parser.add_argument('--bot-name', required=True)
     parser.add_argument('--service-host', required=True)
     parser.add_argument('--service-port', type=int, required=True)
+    parser.add_argument(
+        '--service-threads',
+        type=int,
+        default=DEFAULT_SERVICE_THREADS,
+        help='Most requests to the service that can be made at once.'
+    )
+    parser.add_argument(
+        '--service-connect-timeout',
+        type=float,
+        default=DEFAULT_SERVICE_CONNECT_TIMEOUT,
+        help='Seconds to wait to connect to the service.'
+    )
+    parser.add_argument(
+        '--service-read-timeout',
+        type=float,
+        default=DEFAULT_SERVICE_READ_TIMEOUT,
+        help='Seconds to wait for the service to respond.'
+    )
+    parser.add_argument(
+        '--service-retries',
+        type=int,
+        default=DEFAULT_SERVICE_RETRIES,
+        help='Times to retry a request that fails.'
+    )
+    parser.add_argument(
+        '--cache-ttl',
+        type=float,
+        default=DEFAULT_CACHE_TTL,
+        help='Seconds to reuse the ladder and challenges before refreshing.'
+    )
 
     parser.add_argument('--maintainer-name', default='<UNKNOWN>')
 
@@ -1,8 +1,15 @@
-from app.models import db
+"""Create the database, or upgrade an existing one to the current schema.
+
+See `app/migrations.py`.
+"""
+
+from app import migrations
 from app.app import create_app
 
 app = create_app()
 
 context = app.app_context()
 context.push()
-db.create_all()
+
+for name in migrations.upgrade():
+    print 'Applied migration %s' % name
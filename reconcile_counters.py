@@ -0,0 +1,15 @@
+"""Repair the denormalized counter columns on the player table.
+
+Recomputes every player's win, loss and challenge counts from the game and
+challenge tables.
+"""
+
+from app.models import reconcile_player_counters
+from app.app import create_app
+
+app = create_app()
+
+context = app.app_context()
+context.push()
+
+print 'Reconciled counters for %d players' % reconcile_player_counters()
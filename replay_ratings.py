@@ -0,0 +1,50 @@
+"""Recompute every player's rating by replaying all games in order.
+
+Run this after changing how ratings are computed (e.g. the k values in
+`app/elo.py` or the starter rating), or to backfill players' rating histories.
+Pass --dry-run to see what would change without saving anything.
+"""
+
+import argparse
+import sys
+import time
+
+from app import replay
+from app.app import create_app
+
+parser = argparse.ArgumentParser(description=__doc__)
+parser.add_argument(
+    '--starter-rating',
+    type=int,
+    help='Defaults to RATINGS.STARTER_RATING in config.yaml.'
+)
+parser.add_argument('--dry-run', action='store_true', default=False)
+args = parser.parse_args(sys.argv[1:])
+
+app = create_app()
+
+context = app.app_context()
+context.push()
+
+starter_rating = args.starter_rating
+if starter_rating is None:
+    starter_rating = app.config['RATINGS']['STARTER_RATING']
+
+start = time.time()
+num_games, players, skipped_game_ids = replay.replay_ratings(
+    starter_rating,
+    rewrite_history=not args.dry_run
+)
+print 'Replayed %d games for %d players in %.2fs' % (
+    num_games, len(players), time.time() - start)
+
+if skipped_game_ids:
+    print 'Skipped %d games with missing players: %s' % (
+        len(skipped_game_ids), ', '.join(map(str, skipped_game_ids)))
+
+for _, name, old_rating, new_rating in players:
+    if old_rating != new_rating:
+        print '%s: %d -> %d' % (name, old_rating, new_rating)
+
+if not args.dry_run:
+    print 'Updated %d players' % replay.apply_ratings(players)
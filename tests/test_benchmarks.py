@@ -0,0 +1,248 @@
+"""Tests for the synthetic ladder generator and the load benchmark."""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import pytest
+from sqlalchemy.engine.url import make_url
+
+from app.app import create_app
+from app.models import db, Challenge, Game, Player, RatingChange
+from benchmarks import generate, load
+
+from .test_common import BaseFlaskTest
+
+
+class TestGenerate(BaseFlaskTest):
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+        db.session.commit()
+
+    def generate(self, num_players=20, num_games=200, num_open_challenges=5,
+                 seed=0):
+        generate.generate(num_players, num_games, num_open_challenges, seed,
+                          history=True)
+        return _dump()
+
+    def test_generate(self):
+        players, games, challenges = self.generate()
+        assert len(players) == 20
+        assert len(games) == 200
+        assert RatingChange.query.count() == 400
+
+        for game in games:
+            _, winner_id, loser_id, winner_score, loser_score, _ = game
+            assert winner_id != loser_id
+            assert winner_score in (11, 21)
+            assert 0 <= loser_score < winner_score
+
+        # Counters agree with the games.
+        for id_, _, _, num_wins, num_losses in players:
+            assert num_wins == sum(1 for game in games if game[1] == id_)
+            assert num_losses == sum(1 for game in games if game[2] == id_)
+
+        # Open challenges are issued by the lower rated player, at most one per
+        # pair.
+        ratings = dict((player[0], player[2]) for player in players)
+        open_challenges = [challenge for challenge in challenges
+                           if challenge[3] is None]
+        assert len(open_challenges) == 5
+        assert len(set((min(challenger_id, challenged_id),
+                        max(challenger_id, challenged_id))
+                       for _, challenger_id, challenged_id, _
+                       in open_challenges)) == 5
+        for _, challenger_id, challenged_id, _ in open_challenges:
+            assert ratings[challenger_id] < ratings[challenged_id]
+
+    def test_same_seed_same_ladder(self):
+        first = self.generate(seed=1)
+        self.teardown()
+        assert self.generate(seed=1) == first
+
+    def test_open_challenges_without_sampling(self, monkeypatch):
+        # Every open challenge is drawn from the eligible pairs.
+        monkeypatch.setattr(generate, 'MAX_ATTEMPTS_PER_OPEN_CHALLENGE', 0)
+        _, _, challenges = self.generate()
+        assert len([challenge for challenge in challenges
+                    if challenge[3] is None]) == 5
+
+    def test_no_games_no_open_challenges(self):
+        # Every player has the starter rating, so no one can challenge anyone.
+        with pytest.raises(ValueError):
+            self.generate(num_games=0)
+
+        self.teardown()
+        _, games, challenges = self.generate(num_games=0,
+                                             num_open_challenges=0)
+        assert games == []
+        assert challenges == []
+
+    def test_too_few_players(self):
+        with pytest.raises(ValueError):
+            self.generate(num_players=3, num_open_challenges=4)
+        assert Player.query.count() == 0
+
+
+class TestGenerateThenLoad(object):
+    """Generates a ladder into a database file in WAL mode, as `make
+    benchmark-data` does, and loads a copy of it, as `make benchmark` does."""
+
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'benchmark.db')
+
+    def teardown(self):
+        shutil.rmtree(self.directory, True)
+
+    def create_app(self):
+        # Configured like BENCHMARK, with reads on their own engine.
+        app = create_app()
+        app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.path
+        app.config['SQLALCHEMY_BINDS'] = {'read': 'sqlite:///' + self.path}
+        app.config['SQLITE']['PRAGMAS']['journal_mode'] = 'wal'
+        return app
+
+    def test_generate_then_load(self, monkeypatch):
+        monkeypatch.setattr(generate, 'create_app', self.create_app)
+        generate.main(argparse.Namespace(
+            num_players=20,
+            num_games=200,
+            num_open_challenges=5,
+            seed=0,
+            history=True
+        ))
+        # Everything was moved from the write-ahead log to the database file.
+        assert os.listdir(self.directory) == ['benchmark.db']
+
+        url, statement_counter = load._serve(self.create_app())
+        for scenario in load.SCENARIOS:
+            stats = load.run_scenario(scenario, url, 2, 5, 0,
+                                      statement_counter)
+            assert stats['requests'] == 5, scenario.name
+            assert stats['server_errors'] == 0, scenario.name
+
+    def test_copy_includes_write_ahead_log(self):
+        # The connection stays open, so its writes stay in the log.
+        connection = sqlite3.connect(self.path)
+        connection.execute('PRAGMA journal_mode = wal')
+        connection.execute('CREATE TABLE t (x INTEGER)')
+        connection.executemany('INSERT INTO t VALUES (?)',
+                               [(i,) for i in range(100)])
+        connection.commit()
+        try:
+            copy_uri = load._copy_database(self.create_app(),
+                                           'sqlite:///' + self.path)
+        finally:
+            connection.close()
+
+        copy = sqlite3.connect(make_url(copy_uri).database)
+        try:
+            assert copy.execute('SELECT COUNT(*) FROM t').fetchone() == (100,)
+        finally:
+            copy.close()
+
+
+def test_num_unequal_pairs():
+    assert generate._num_unequal_pairs([]) == 0
+    assert generate._num_unequal_pairs([1200, 1200, 1200]) == 0
+    assert generate._num_unequal_pairs([1, 2, 3]) == 3
+    assert generate._num_unequal_pairs([1, 1, 2, 2, 3]) == 8
+
+
+class TestPercentile(object):
+    def test_empty(self):
+        assert load._percentile([], 95) == 0.0
+
+    def test_one_value(self):
+        assert load._percentile([3.0], 50) == 3.0
+        assert load._percentile([3.0], 99) == 3.0
+
+    def test_nearest_rank(self):
+        values = range(1, 101)
+        assert load._percentile(values, 50) == 50
+        assert load._percentile(values, 95) == 95
+        assert load._percentile(values, 99) == 99
+        assert load._percentile(values, 100) == 100
+        assert load._percentile(values, 0) == 1
+
+        assert load._percentile([1, 2, 3, 4], 50) == 2
+        assert load._percentile([1, 2, 3, 4], 95) == 4
+
+
+class TestFindRegressions(object):
+    baseline = {
+        'GET /players': {
+            'p95_ms': 10.0,
+            'requests_per_second': 100.0,
+            'statements_per_request': 2.0,
+        },
+    }
+
+    def find_regressions(self, **stats):
+        return load.find_regressions({'GET /players': stats}, self.baseline,
+                                     0.25)
+
+    def test_within_tolerance(self):
+        assert self.find_regressions(
+            p95_ms=12.5,
+            requests_per_second=75.0,
+            statements_per_request=2.5
+        ) == []
+
+    def test_slower(self):
+        regressions = self.find_regressions(p95_ms=12.6)
+        assert len(regressions) == 1
+        assert regressions[0].startswith('GET /players: p95_ms')
+
+    def test_lower_throughput(self):
+        regressions = self.find_regressions(requests_per_second=74.0)
+        assert len(regressions) == 1
+        assert 'requests_per_second' in regressions[0]
+
+    def test_more_statements(self):
+        regressions = self.find_regressions(statements_per_request=3.0)
+        assert len(regressions) == 1
+        assert 'statements_per_request' in regressions[0]
+
+    def test_faster_is_not_a_regression(self):
+        assert self.find_regressions(
+            p95_ms=1.0,
+            requests_per_second=1000.0,
+            statements_per_request=1.0
+        ) == []
+
+    def test_missing_from_baseline(self):
+        assert load.find_regressions(
+            {'GET /games': {'p95_ms': 1000.0}}, self.baseline, 0.25) == []
+
+    def test_missing_statistic(self):
+        # e.g. statements can't be counted when loading a remote service.
+        assert self.find_regressions(p95_ms=10.0) == []
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _dump():
+    """Return every player, game and challenge as tuples, ordered by ID."""
+    players = db.session.query(
+        Player.id, Player.name, Player.rating, Player.num_wins,
+        Player.num_losses
+    ).order_by(Player.id).all()
+    games = db.session.query(
+        Game.id, Game.winner_id, Game.loser_id, Game.winner_score,
+        Game.loser_score, Game.time_created
+    ).order_by(Game.id).all()
+    challenges = db.session.query(
+        Challenge.id, Challenge.challenger_id, Challenge.challenged_id,
+        Challenge.game_id
+    ).order_by(Challenge.id).all()
+    return ([tuple(row) for row in players],
+            [tuple(row) for row in games],
+            [tuple(row) for row in challenges])
@@ -1,3 +1,6 @@
+import contextlib
+
+from sqlalchemy import event
 
 from app.app import create_app
 from app.models import db
@@ -14,3 +17,38 @@ class BaseFlaskTest(object):
     @classmethod
     def teardown_class(cls):
         cls.app_context.pop()
+
+
+@contextlib.contextmanager
+def capture_statements():
+    """Record every SQL statement executed within the block.
+
+    Yields:
+        A list that is filled with a pair (statement, parameters) for each
+        statement as it is executed.
+    """
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', record)
+    try:
+        yield statements
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', record)
+
+
+@contextlib.contextmanager
+def assert_num_statements(expected):
+    """Fail unless exactly `expected` SQL statements are executed within the
+    block."""
+    with capture_statements() as statements:
+        yield statements
+
+    assert len(statements) == expected, \
+        'Expected %d statements, got %d:\n%s' % (
+            expected,
+            len(statements),
+            '\n'.join(statement for statement, _ in statements)
+        )
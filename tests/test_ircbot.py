@@ -0,0 +1,373 @@
+"""Tests for the IRC bot client."""
+
+import BaseHTTPServer
+import threading
+
+import simplejson as json
+
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+from twisted.internet import defer, task
+from twisted.python import failure
+from twisted.trial import unittest
+
+from clients import ircbot
+
+
+class BaseBotTest(object):
+    def setup(self):
+        self.factory = ircbot.LadderBotFactory(
+            channel='#pong',
+            nickname='pongbot',
+            service_host='localhost',
+            service_port=6789,
+            server_password=None,
+            maintainer_name='colin'
+        )
+        self.bot = self.factory.buildProtocol(None)
+        self.service = FakeService()
+        self.bot._call_service = self.service.call
+
+    def process_command(self, command):
+        return _result(self.bot.process_command(command))
+
+
+class TestProcessCommand(BaseBotTest):
+    def test_help(self):
+        for command in ('help', 'HELP', 'commands'):
+            lines = self.process_command(command)
+            assert lines[0] == 'Type "pongbot: COMMAND". Commands are:'
+            assert lines[1:] == [help_ for _, _, help_ in ircbot.COMMANDS]
+        assert self.service.requests == []
+
+    def test_ladder(self):
+        self.service.responses.append(_response(200, [
+            {'name': 'kumanan', 'num_wins': 2, 'num_losses': 1,
+             'rating': 1202},
+            {'name': 'colin', 'num_wins': 1, 'num_losses': 2,
+             'rating': 1198},
+        ]))
+
+        lines = self.process_command('ladder')
+        assert lines == ['[1] kumanan 2-1 (1202)', '[2] colin 1-2 (1198)']
+        assert self.service.requests == [('GET', '/players', None)]
+
+    def test_add_player(self):
+        self.service.responses.append(_response(201, {}))
+
+        lines = self.process_command('add player colin')
+        assert lines == ['Added player colin']
+        assert self.service.requests == [
+            ('POST', '/players', {'name': 'colin'})]
+
+    def test_add_game(self):
+        for command in ('kumanan beat colin 21 to 15',
+                        'kumanan beat colin 21-15'):
+            self.service.responses.append(_response(201, {}))
+
+            lines = self.process_command(command)
+            assert lines == ['Added game']
+            assert self.service.requests.pop() == ('POST', '/games', {
+                'winner': 'kumanan',
+                'loser': 'colin',
+                'winner_score': '21',
+                'loser_score': '15',
+            })
+
+    def test_add_challenge(self):
+        self.service.responses.append(_response(201, {}))
+
+        lines = self.process_command('colin challenges kumanan')
+        assert lines == ['Added challenge']
+        assert self.service.requests == [('POST', '/challenges', {
+            'challenger': 'colin',
+            'challenged': 'kumanan',
+        })]
+
+    def test_challenges(self):
+        self.service.responses.append(_response(200, [
+            {'challenger': 'colin', 'challenged': 'kumanan'},
+        ]))
+
+        lines = self.process_command('challenges')
+        assert lines == ['[1] colin challenged kumanan']
+        assert self.service.requests == [('GET', '/challenges', None)]
+
+    def test_service_rejects_command(self):
+        self.service.responses.append(
+            _response(400, {'message': 'Player colin already exists'}))
+
+        lines = self.process_command('add player colin')
+        assert len(lines) == 1
+        assert lines[0].startswith('Error: ')
+        assert 'already exists' in lines[0]
+
+    def test_unknown_command(self):
+        lines = self.process_command('colin lost to kumanan')
+        assert lines == [
+            'Command not recognized! Type "pongbot help" for more info.']
+        assert self.service.requests == []
+
+
+class TestResponseCache(BaseBotTest):
+    def setup(self):
+        super(TestResponseCache, self).setup()
+        self.clock = task.Clock()
+
+    def test_listing_is_reused_until_it_expires(self, monkeypatch):
+        monkeypatch.setattr(ircbot, 'reactor', self.clock)
+        self.service.responses.append(_challenges_response('"1"'))
+
+        lines = self.process_command('challenges')
+        self.clock.advance(self.factory.cache_ttl - 1)
+        assert self.process_command('challenges') == lines
+        assert len(self.service.requests) == 1
+
+        self.clock.advance(1)
+        self.service.responses.append(_challenges_response('"2"'))
+        assert self.process_command('challenges') == lines
+        assert len(self.service.requests) == 2
+
+    def test_not_modified_serves_cached_body(self, monkeypatch):
+        monkeypatch.setattr(ircbot, 'reactor', self.clock)
+        self.service.responses.append(_challenges_response('"1"'))
+        lines = self.process_command('challenges')
+
+        self.clock.advance(self.factory.cache_ttl)
+        self.service.responses.append(_response(304, None))
+        assert self.process_command('challenges') == lines
+        assert self.service.headers == [{}, {'If-None-Match': '"1"'}]
+
+        # The 304 renewed the cached listing.
+        self.clock.advance(self.factory.cache_ttl - 1)
+        assert self.process_command('challenges') == lines
+        assert len(self.service.requests) == 2
+
+    def test_write_refetches_listing(self, monkeypatch):
+        monkeypatch.setattr(ircbot, 'reactor', self.clock)
+        self.service.responses.append(_challenges_response('"1"'))
+        self.process_command('challenges')
+        generation = self.factory.cache_generation
+
+        self.service.responses.append(_response(201, {}))
+        self.process_command('kumanan challenges colin')
+        assert self.factory.cache_generation > generation
+        assert self.factory.response_cache == {}
+
+        self.service.responses.append(_response(200, [
+            {'challenger': 'colin', 'challenged': 'kumanan'},
+            {'challenger': 'kumanan', 'challenged': 'colin'},
+        ]))
+        lines = self.process_command('challenges')
+        assert lines == ['[1] colin challenged kumanan',
+                         '[2] kumanan challenged colin']
+        assert self.service.requests[-1] == ('GET', '/challenges', None)
+        assert self.service.headers[-1] == {}
+
+    def test_write_during_read_is_not_cached(self, monkeypatch):
+        monkeypatch.setattr(ircbot, 'reactor', self.clock)
+        in_flight = defer.Deferred()
+        self.service.responses.append(in_flight)
+        read = self.bot.process_command('challenges')
+
+        self.service.responses.append(_response(201, {}))
+        self.process_command('kumanan challenges colin')
+        in_flight.callback(_challenges_response('"1"'))
+        assert _result(read) == ['[1] colin challenged kumanan']
+        assert self.factory.response_cache == {}
+
+
+class TestPrivmsg(BaseBotTest):
+    def setup(self):
+        super(TestPrivmsg, self).setup()
+        self.sent = []
+        self.bot.msg = lambda channel, line: self.sent.append((channel, line))
+
+    def test_mentions_are_answered(self):
+        for message in ('pongbot: help', 'pongbot help', '  pongbot:help'):
+            self.bot.privmsg('kumanan!k@host', '#pong', message)
+            assert self.sent[0] == (
+                '#pong', 'Type "pongbot: COMMAND". Commands are:')
+            del self.sent[:]
+
+    def test_other_messages_are_ignored(self):
+        for message in ('help', 'hey pongbot: help', 'pongbot'):
+            self.bot.privmsg('kumanan!k@host', '#pong', message)
+        assert self.sent == []
+        assert self.service.requests == []
+
+
+class TestCallService(unittest.TestCase):
+    """Requests really go through the factory's thread pool, so these tests
+    run under trial, which runs the reactor until each Deferred fires."""
+
+    def setUp(self):
+        self.factory = ircbot.LadderBotFactory(
+            channel='#pong',
+            nickname='pongbot',
+            service_host='localhost',
+            service_port=6789,
+            server_password=None,
+            maintainer_name='colin'
+        )
+        self.factory.service_pool.start()
+        self.bot = self.factory.buildProtocol(None)
+        self.session = FakeSession()
+        self.factory.session = self.session
+
+    def tearDown(self):
+        self.factory.service_pool.stop()
+
+    @defer.inlineCallbacks
+    def test_reply_arrives_through_deferred(self):
+        self.session.response = _response(200, [
+            {'challenger': 'colin', 'challenged': 'kumanan'},
+        ])
+
+        deferred = self.bot.process_command('challenges')
+        self.assertIsInstance(deferred, defer.Deferred)
+        lines = yield deferred
+        self.assertEqual(lines, ['[1] colin challenged kumanan'])
+
+        # The request was made off the reactor thread, with the timeouts.
+        self.assertEqual(len(self.session.calls), 1)
+        thread, url, kwargs = self.session.calls[0]
+        self.assertNotEqual(thread, threading.current_thread())
+        self.assertEqual(url, 'http://localhost:6789/challenges')
+        self.assertEqual(kwargs['timeout'], self.factory.service_timeouts)
+
+    @defer.inlineCallbacks
+    def test_failure_ends_in_maintainer_message(self):
+        self.session.error = requests.exceptions.ConnectionError('refused')
+
+        lines = yield self.bot.process_command('add player colin')
+        self.assertEqual(lines, ['Error: contact the maintainer colin'])
+        self.assertEqual(len(self.session.calls), 1)
+
+
+class TestSessionRetries(object):
+    def setup(self):
+        self.server = BaseHTTPServer.HTTPServer(
+            ('127.0.0.1', 0), UnavailableHandler)
+        self.server.requests = []
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+        self.url = 'http://127.0.0.1:%d/players' % self.server.server_port
+
+    def teardown(self):
+        self.server.shutdown()
+        self.thread.join()
+        self.server.server_close()
+
+    def test_gets_are_retried(self, monkeypatch):
+        monkeypatch.setattr(ircbot, 'SERVICE_RETRY_BACKOFF_FACTOR', 0)
+        session = ircbot._make_session(pool_size=1, retries=2)
+
+        with pytest.raises(requests.exceptions.RetryError):
+            session.get(self.url)
+        assert self.server.requests == ['GET'] * 3
+
+    def test_posts_are_not_retried(self, monkeypatch):
+        monkeypatch.setattr(ircbot, 'SERVICE_RETRY_BACKOFF_FACTOR', 0)
+        session = ircbot._make_session(pool_size=1, retries=2)
+
+        response = session.post(self.url, data='{}')
+        assert response.status_code == 503
+        assert self.server.requests == ['POST']
+
+
+###############################################################################
+# Helpers
+###############################################################################
+class FakeService(object):
+    """Stands in for `LadderBot._call_service`, answering each request at once
+    with the next of `responses` (or with a Deferred of it) and recording it
+    in `requests` as a tuple (method, endpoint, JSON data) and its headers in
+    `headers`."""
+
+    def __init__(self):
+        self.responses = []
+        self.requests = []
+        self.headers = []
+
+    def call(self, request, url, **kwargs):
+        method = request.__name__.upper()
+        endpoint = url[len('http://localhost:6789'):]
+        data = json.loads(kwargs['data']) if 'data' in kwargs else None
+        self.requests.append((method, endpoint, data))
+        self.headers.append(kwargs.get('headers', {}))
+        response = self.responses.pop(0)
+        if isinstance(response, defer.Deferred):
+            return response
+        return defer.succeed(response)
+
+
+class FakeSession(object):
+    """Stands in for the factory's `requests.Session`, recording each call as a
+    tuple (thread, URL, keyword arguments) and then raising `error` if it's
+    set or returning `response`."""
+
+    def __init__(self):
+        self.response = None
+        self.error = None
+        self.calls = []
+
+    def get(self, url, **kwargs):
+        return self._call(url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self._call(url, **kwargs)
+
+    def _call(self, url, **kwargs):
+        self.calls.append((threading.current_thread(), url, kwargs))
+        if self.error is not None:
+            raise self.error
+        return self.response
+
+
+class UnavailableHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    """Answers every request with a 503, recording its method in the server's
+    `requests`."""
+
+    def do_GET(self):
+        self._unavailable()
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.getheader('Content-Length', 0)))
+        self._unavailable()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _unavailable(self):
+        self.server.requests.append(self.command)
+        self.send_response(503)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+def _response(status_code, body, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response._content = json.dumps(body)
+    response.headers = CaseInsensitiveDict(headers or {})
+    return response
+
+
+def _challenges_response(etag):
+    return _response(
+        200,
+        [{'challenger': 'colin', 'challenged': 'kumanan'}],
+        headers={'ETag': etag}
+    )
+
+
+def _result(deferred):
+    """Return the result of a Deferred that has already fired."""
+    results = []
+    deferred.addBoth(results.append)
+    assert results, 'Deferred has not fired'
+    if isinstance(results[0], failure.Failure):
+        results[0].raiseException()
+    return results[0]
@@ -0,0 +1,210 @@
+"""Tests for the in-memory ladder that serves GET /players."""
+
+import simplejson as json
+
+from app import ladder, schemas
+from app.models import (Challenge, Game, LadderState, Player, RatingChange, db,
+                        reconcile_player_counters)
+
+from .test_common import capture_statements
+from .test_resources import BaseResourceTest
+
+
+class TestLadderCache(BaseResourceTest):
+    def setup(self):
+        self.post_valid_player('colin', 1100, '2015-12-01T10:00:00')
+        self.post_valid_player('kumanan', 1300, '2015-12-02T10:00:00')
+        self.post_valid_player('robert', 1200, '2015-12-03T10:00:00')
+        self.post_valid_player('ayush', 1200, '2015-12-04T10:00:00')
+        self.post_valid_game('robert', 'ayush', 11, 9)
+
+        # Warm the cache.
+        self.get_players()
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+        db.session.commit()
+
+    def get_players_with_statements(self, **params):
+        with capture_statements() as statements:
+            response = self.client.get('/players', query_string=params)
+        assert response.status_code == 200
+        return json.loads(response.data), statements
+
+    def assert_matches_database(self, **params):
+        players, statements = self.get_players_with_statements(**params)
+        assert players == _query_ladder(**params)
+        return statements
+
+    def test_warm_reads_only_read_the_version(self):
+        statements = self.assert_matches_database()
+        assert len(statements) == 1
+        assert 'FROM ladder_state' in statements[0][0]
+
+    def test_pages(self):
+        for params in (
+            {'limit': 2},
+            {'limit': 2, 'offset': 1},
+            {'offset': 3},
+            {'offset': 10},
+            {'limit': 0},
+            {'min_rating': 1200},
+            {'min_rating': 1201},
+            {'min_rating': 2000},
+            {'min_rating': 1100, 'limit': 2, 'offset': 2},
+        ):
+            statements = self.assert_matches_database(**params)
+            assert len(statements) == 1
+
+    def test_game_repositions_players_without_rebuild(self):
+        self.post_valid_game('colin', 'kumanan', 21, 3)
+        statements = self.assert_matches_database()
+        assert len(statements) == 1
+
+    def test_new_player_is_added_without_rebuild(self):
+        self.post_valid_player('robin', 1250)
+        statements = self.assert_matches_database()
+        assert len(statements) == 1
+
+    def test_batch_repositions_players_without_rebuild(self):
+        response = self.client.post(
+            '/games/batch',
+            data=json.dumps({'games': [
+                {'winner': 'colin', 'loser': 'kumanan',
+                 'winner_score': 21, 'loser_score': 3},
+                {'winner': 'colin', 'loser': 'robert',
+                 'winner_score': 21, 'loser_score': 3},
+            ]}),
+            content_type='application/json'
+        )
+        assert response.status_code == 201
+
+        statements = self.assert_matches_database()
+        assert len(statements) == 1
+
+    def test_bulk_update_invalidates(self):
+        Player.query.filter_by(name='colin').update(
+            {Player.rating: 1500}, synchronize_session=False)
+        db.session.commit()
+        assert ladder.get_cache().version is None
+
+        self.assert_matches_database()
+
+    def test_change_by_another_process_is_picked_up(self):
+        # Write as another process would: straight to the database, bumping
+        # the version without touching this process's cache.
+        db.engine.execute("UPDATE player SET rating = 1500 "
+                          "WHERE name = 'colin'")
+        db.engine.execute(LadderState.__table__.update().values(
+            version=LadderState.version + 1))
+
+        statements = self.assert_matches_database()
+        assert len(statements) == 2
+
+    def test_reconcile_invalidates(self):
+        reconcile_player_counters()
+        assert ladder.get_cache().version is None
+
+        self.assert_matches_database()
+
+
+class TestPlayerRankAndNeighbors(BaseResourceTest):
+    def setup(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_player('robert', 1200)
+        self.post_valid_player('ayush', 1250)
+        self.post_valid_player('robin', 1195)
+        self.post_valid_game('colin', 'kumanan', 21, 3)
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+        db.session.commit()
+
+    def get(self, url, **params):
+        response = self.client.get(url, query_string=params)
+        return response.status_code, json.loads(response.data)
+
+    def test_rank(self):
+        names = [player['name'] for player in _query_ladder()]
+        for rank, name in enumerate(names, start=1):
+            status_code, data = self.get('/players/%s/rank' % name)
+            assert status_code == 200
+            assert data == {'name': name, 'rank': rank, 'num_players': 5}
+
+    def test_rank_of_missing_player(self):
+        status_code, _ = self.get('/players/nobody/rank')
+        assert status_code == 404
+
+    def test_rank_reads_only_the_version(self):
+        self.get('/players/colin/rank')
+        with capture_statements() as statements:
+            self.get('/players/colin/rank')
+        assert len(statements) == 1
+
+    def test_rank_follows_games(self):
+        _, before = self.get('/players/robin/rank')
+        self.post_valid_game('robin', 'kumanan', 21, 3)
+        _, after = self.get('/players/robin/rank')
+        assert after['rank'] < before['rank']
+        assert after['rank'] == [
+            player['name'] for player in _query_ladder()].index('robin') + 1
+
+    def test_neighbors(self):
+        players = _query_ladder()
+        for rank, player in enumerate(players, start=1):
+            player['rank'] = rank
+
+        status_code, data = self.get('/players/%s/neighbors' %
+                                     players[2]['name'], radius=1)
+        assert status_code == 200
+        assert data == players[1:4]
+
+    def test_neighbors_at_the_ends(self):
+        players = _query_ladder()
+        for rank, player in enumerate(players, start=1):
+            player['rank'] = rank
+
+        _, data = self.get('/players/%s/neighbors' % players[0]['name'])
+        assert data == players[:3]
+
+        _, data = self.get('/players/%s/neighbors' % players[-1]['name'])
+        assert data == players[-3:]
+
+        _, data = self.get('/players/%s/neighbors' % players[0]['name'],
+                           radius=0)
+        assert data == players[:1]
+
+    def test_neighbors_of_missing_player(self):
+        status_code, _ = self.get('/players/nobody/neighbors')
+        assert status_code == 404
+
+    def test_validate_radius(self):
+        status_code, _ = self.get('/players/colin/neighbors', radius=-1)
+        assert status_code == 422
+        status_code, _ = self.get('/players/colin/neighbors', radius=1000)
+        assert status_code == 422
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _query_ladder(limit=None, offset=0, min_rating=None):
+    """Query the ladder from the database, as GET /players did before the
+    cache."""
+    query = Player.query.order_by(
+        Player.rating.desc(),
+        Player.num_games.desc(),
+        Player.time_created.asc(),
+        Player.id.asc()
+    )
+    if min_rating is not None:
+        query = query.filter(Player.rating >= min_rating)
+    query = query.offset(offset).limit(limit)
+    return schemas.players_schema.dump(query).data
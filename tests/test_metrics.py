@@ -0,0 +1,134 @@
+"""Tests for the per-request timings and GET /metrics."""
+
+import re
+
+from app import metrics
+from app.models import Game, Player, RatingChange, db
+
+from .test_common import capture_statements
+from .test_resources import BaseResourceTest
+
+
+class TestMetrics(BaseResourceTest):
+    def setup(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+
+        # Forget the requests above.
+        self.app.extensions['metrics'] = metrics.Metrics()
+
+    def teardown(self):
+        self.app.config['SERVER_TIMING'] = False
+        Player.query.delete()
+        Game.query.delete()
+        RatingChange.query.delete()
+        db.session.commit()
+
+    def get_metrics(self):
+        response = self.client.get('/metrics')
+        assert response.status_code == 200
+        assert response.headers['Content-Type'] == metrics.CONTENT_TYPE
+        return _parse_metrics(response.data)
+
+    def test_requests_are_recorded_per_endpoint(self):
+        for _ in range(3):
+            self.client.get('/players')
+        self.client.get('/players/colin')
+        self.post_valid_game('colin', 'kumanan', 21, 3)
+
+        samples = self.get_metrics()
+        assert samples['ladder_requests_total', '/players', 'GET'] == 3
+        assert samples['ladder_requests_total',
+                       '/players/<string:name>', 'GET'] == 1
+        assert samples['ladder_requests_total', '/games', 'POST'] == 1
+        assert ('ladder_requests_total', '/games', 'GET') not in samples
+
+    def test_statements_are_counted(self):
+        with capture_statements() as statements:
+            self.post_valid_game('colin', 'kumanan', 21, 3)
+
+        samples = self.get_metrics()
+        assert samples['ladder_sql_statements_total', '/games', 'POST'] == \
+            len(statements)
+
+    def test_times_are_recorded(self):
+        self.client.get('/players')
+
+        samples = self.get_metrics()
+        request_seconds = samples['ladder_request_seconds_total', '/players',
+                                  'GET']
+        sql_seconds = samples['ladder_sql_seconds_total', '/players', 'GET']
+        serialization_seconds = samples[
+            'ladder_serialization_seconds_total', '/players', 'GET']
+        assert request_seconds > 0
+        assert sql_seconds > 0
+        assert serialization_seconds > 0
+        assert sql_seconds + serialization_seconds <= request_seconds
+
+    def test_streamed_responses_are_recorded_once_sent(self):
+        self.post_valid_game('colin', 'kumanan', 21, 3)
+        self.app.config['SERVER_TIMING'] = True
+
+        with capture_statements() as statements:
+            response = self.client.get('/games/export', buffered=True)
+        assert response.status_code == 200
+        assert len(response.data.splitlines()) == 1
+        assert 'Server-Timing' not in response.headers
+
+        samples = self.get_metrics()
+        key = '/games/export', 'GET'
+        assert samples[('ladder_requests_total',) + key] == 1
+        # Including the statements that read the games as they were sent.
+        assert samples[('ladder_sql_statements_total',) + key] == \
+            len(statements)
+        assert len(statements) > 1
+        assert samples[('ladder_request_seconds_total',) + key] >= \
+            samples[('ladder_sql_seconds_total',) + key]
+
+    def test_unmatched_requests(self):
+        response = self.client.get('/nothing/here')
+        assert response.status_code == 404
+
+        samples = self.get_metrics()
+        assert samples['ladder_requests_total', metrics.UNMATCHED_ENDPOINT,
+                       'GET'] == 1
+
+    def test_server_timing_is_off_by_default(self):
+        response = self.client.get('/players')
+        assert 'Server-Timing' not in response.headers
+
+    def test_server_timing(self):
+        self.app.config['SERVER_TIMING'] = True
+
+        with capture_statements() as statements:
+            response = self.client.get('/players/colin')
+
+        timings = dict(
+            (entry.split(';')[0], entry)
+            for entry in response.headers['Server-Timing'].split(', ')
+        )
+        assert sorted(timings) == ['serialization', 'sql', 'total']
+        assert 'desc="%d statements"' % len(statements) in timings['sql']
+
+
+###############################################################################
+# Helpers
+###############################################################################
+_SAMPLE_PATTERN = re.compile(
+    r'^(\w+)\{endpoint="([^"]*)",method="([^"]*)"\} (\S+)$')
+
+
+def _parse_metrics(text):
+    """Parse Prometheus's text format into a dict mapping tuples (name,
+    endpoint, method) to values."""
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            assert re.match(r'^# (HELP|TYPE) \w+ .+$', line)
+            continue
+
+        match = _SAMPLE_PATTERN.match(line)
+        assert match is not None, line
+        name, endpoint, method, value = match.groups()
+        samples[name, endpoint, method] = float(value)
+    return samples
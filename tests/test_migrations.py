@@ -0,0 +1,160 @@
+"""Tests for upgrading existing databases to the current schema."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+from sqlalchemy import inspect
+
+from app import migrations
+from app.app import create_app
+from app.models import db
+
+
+# The schema the service created before there were migrations.
+BASELINE_SCHEMA = """
+    CREATE TABLE player (
+        id INTEGER NOT NULL,
+        name VARCHAR(30),
+        rating INTEGER,
+        time_created DATETIME,
+        PRIMARY KEY (id),
+        UNIQUE (name)
+    );
+    CREATE TABLE game (
+        id INTEGER NOT NULL,
+        winner_id INTEGER,
+        loser_id INTEGER,
+        winner_score INTEGER,
+        loser_score INTEGER,
+        time_created DATETIME,
+        PRIMARY KEY (id),
+        FOREIGN KEY(winner_id) REFERENCES player (id),
+        FOREIGN KEY(loser_id) REFERENCES player (id)
+    );
+    CREATE TABLE challenge (
+        id INTEGER NOT NULL,
+        challenger_id INTEGER,
+        challenged_id INTEGER,
+        time_created DATETIME,
+        game_id INTEGER,
+        PRIMARY KEY (id),
+        FOREIGN KEY(challenger_id) REFERENCES player (id),
+        FOREIGN KEY(challenged_id) REFERENCES player (id),
+        FOREIGN KEY(game_id) REFERENCES game (id)
+    );
+"""
+
+BASELINE_DATA = """
+    INSERT INTO player VALUES (1, 'colin', 1100, '2015-12-01 10:00:00');
+    INSERT INTO player VALUES (2, 'kumanan', 1300, '2015-12-01 10:00:00');
+    INSERT INTO player VALUES (3, 'robert', 1200, '2015-12-01 10:00:00');
+    INSERT INTO game VALUES (1, 2, 1, 21, 15, '2015-12-02 10:00:00');
+    INSERT INTO game VALUES (2, 1, 2, 11, 9, '2015-12-03 10:00:00');
+    INSERT INTO game VALUES (3, 3, 1, 11, 4, '2015-12-04 10:00:00');
+    INSERT INTO challenge VALUES (1, 2, 1, '2015-12-02 09:00:00', 1);
+    INSERT INTO challenge VALUES (2, 3, 2, '2015-12-04 09:00:00', NULL);
+"""
+
+
+class TestUpgrade(object):
+    def setup(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'ladder.db')
+
+        self.app = create_app()
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + self.path
+        self.app_context = self.app.app_context()
+        self.app_context.push()
+
+    def teardown(self):
+        db.session.remove()
+        db.engine.dispose()
+        self.app_context.pop()
+        shutil.rmtree(self.directory)
+
+    def create_baseline(self, *statements):
+        """Create the baseline schema and data, then run `statements`."""
+        connection = sqlite3.connect(self.path)
+        connection.executescript(BASELINE_SCHEMA + BASELINE_DATA)
+        for statement in statements:
+            connection.execute(statement)
+        connection.commit()
+        connection.close()
+
+    def assert_schema_matches_models(self):
+        inspector = inspect(db.engine)
+        assert set(inspector.get_table_names()) == \
+            set(db.metadata.tables) | set(['schema_migration'])
+
+        for name, table in db.metadata.tables.items():
+            columns = inspector.get_columns(name)
+            assert sorted(column['name'] for column in columns) == \
+                sorted(table.columns.keys())
+
+            indexes = [index['name'] for index in inspector.get_indexes(name)]
+            for index in table.indexes:
+                assert index.name in indexes
+
+    def test_baseline_is_upgraded(self):
+        self.create_baseline()
+
+        applied = migrations.upgrade()
+        assert applied == [name for name, _ in migrations.MIGRATIONS]
+        self.assert_schema_matches_models()
+
+        # Counters are backfilled from the games and challenges.
+        players = db.engine.execute("""
+            SELECT name, num_wins, num_losses, num_challenges_submitted,
+                num_challenges_received, version
+            FROM player ORDER BY id
+        """).fetchall()
+        assert [tuple(player) for player in players] == [
+            ('colin', 1, 2, 0, 1, 1),
+            ('kumanan', 1, 1, 1, 1, 1),
+            ('robert', 1, 0, 1, 0, 1),
+        ]
+
+        challenges = db.engine.execute("""
+            SELECT id, min_player_id, max_player_id
+            FROM challenge ORDER BY id
+        """).fetchall()
+        assert [tuple(challenge) for challenge in challenges] == [
+            (1, 1, 2),
+            (2, 2, 3),
+        ]
+
+        ladder_state = db.engine.execute(
+            'SELECT id, version, time_modified FROM ladder_state').fetchall()
+        assert [tuple(row) for row in ladder_state] == [(1, 0, None)]
+
+        # Every migration is recorded, so none runs again.
+        assert migrations.upgrade() == []
+
+    def test_partly_upgraded_baseline(self):
+        # Some databases were changed by hand before there were migrations.
+        self.create_baseline(
+            'ALTER TABLE player ADD COLUMN num_wins INTEGER NOT NULL '
+            'DEFAULT 0',
+            'CREATE INDEX ix_player_rating ON player (rating)',
+        )
+
+        applied = migrations.upgrade()
+        assert applied == [name for name, _ in migrations.MIGRATIONS]
+        self.assert_schema_matches_models()
+
+        num_wins = db.engine.execute(
+            'SELECT num_wins FROM player ORDER BY id').fetchall()
+        assert [row[0] for row in num_wins] == [1, 1, 1]
+        assert migrations.upgrade() == []
+
+    def test_new_database_is_created(self):
+        assert migrations.upgrade() == []
+        self.assert_schema_matches_models()
+
+        recorded = db.engine.execute(
+            'SELECT name FROM schema_migration ORDER BY name').fetchall()
+        assert [row[0] for row in recorded] == \
+            [name for name, _ in migrations.MIGRATIONS]
+        assert migrations.upgrade() == []
@@ -2,10 +2,13 @@
 
 from datetime import datetime
 
-from app.models import db, Player, Game, Challenge
+import pytest
+from sqlalchemy.exc import IntegrityError
+
+from app.models import db, Player, Game, Challenge, reconcile_player_counters
 from app.app import create_app
 
-from test_common import BaseFlaskTest
+from .test_common import BaseFlaskTest
 
 
 class BaseTestWithData(BaseFlaskTest):
@@ -101,6 +104,10 @@ class BaseTestWithData(BaseFlaskTest):
         db.session.add_all([self.challenge1, self.challenge2, self.challenge3])
         db.session.commit()
 
+        # The rows above bypass the resource layer, so the players' counter
+        # columns have to be backfilled.
+        reconcile_player_counters()
+
     def teardown(self):
         Player.query.delete()
         Game.query.delete()
@@ -168,6 +175,19 @@ class TestPlayer(BaseTestWithData):
     def test_num_challenges(self):
         assert self.ayush.num_challenges == 2
 
+    def test_reconcile_repairs_drifted_counters(self):
+        self.colin.num_wins = 17
+        self.colin.num_challenges_received = 0
+        db.session.commit()
+
+        assert reconcile_player_counters() == 4
+        assert self.colin.num_wins == 2
+        assert self.colin.num_challenges_received == 1
+
+    def test_ordering_by_num_games_in_sql(self):
+        players = Player.query.order_by(Player.num_games.desc()).all()
+        assert players[0] == self.colin
+
 
 class TestGame(BaseTestWithData):
     def test_game_count(self):
@@ -186,6 +206,33 @@ class TestChallenge(BaseTestWithData):
         assert self.challenge1.is_completed is True
         assert self.challenge2.is_completed is False
 
+    def test_player_pair_is_ordered(self):
+        assert self.challenge2.min_player_id == \
+            min(self.colin.id, self.kumanan.id)
+        assert self.challenge2.max_player_id == \
+            max(self.colin.id, self.kumanan.id)
+
+    def test_second_open_challenge_between_players_is_rejected(self):
+        # The players are the other way round from challenge2.
+        db.session.add(Challenge(
+            challenger_id=self.kumanan.id,
+            challenged_id=self.colin.id,
+            time_created=now()
+        ))
+        with pytest.raises(IntegrityError):
+            db.session.commit()
+        db.session.rollback()
+
+    def test_completed_challenges_between_players_are_allowed(self):
+        db.session.add(Challenge(
+            challenger_id=self.colin.id,
+            challenged_id=self.ayush.id,
+            time_created=now(),
+            game_id=self.game2.id
+        ))
+        db.session.commit()
+        assert Challenge.query.count() == 4
+
 
 ###############################################################################
 # Helpers
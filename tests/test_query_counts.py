@@ -0,0 +1,122 @@
+"""Tests that pin the number of SQL statements each endpoint runs.
+
+Each endpoint is requested against a small ladder and a larger one, and must
+run the same fixed number of statements for both. An extra query per row, e.g.
+from lazily loading each game's players, fails the test.
+"""
+
+import simplejson as json
+
+from app.models import Challenge, Game, Player, RatingChange
+
+from .test_common import assert_num_statements
+from .test_resources import BaseResourceTest
+
+
+class BaseQueryCountTest(BaseResourceTest):
+    # How many players, games and open challenges the ladder has.
+    size = None
+
+    def setup(self):
+        for i in range(self.size):
+            self.post_valid_player('p%d' % i, 1000 + i)
+
+        games = [
+            {
+                'winner': 'p%d' % i,
+                'loser': 'p%d' % ((i + 1) % self.size),
+                'winner_score': 11,
+                'loser_score': 3,
+            }
+            for i in range(self.size)
+        ]
+        response = self.client.post(
+            '/games/batch',
+            data=json.dumps({'games': games}),
+            content_type='application/json'
+        )
+        assert response.status_code == 201
+
+        # Each player challenges the next one up the ladder.
+        players = Player.query.order_by(Player.rating).all()
+        for challenger, challenged in zip(players[::2], players[1::2]):
+            if challenger.rating < challenged.rating:
+                self.post_valid_challenge(challenger.name, challenged.name)
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
+    def assert_num_statements(self, expected, method, url, **kwargs):
+        with assert_num_statements(expected):
+            response = getattr(self.client, method)(url, **kwargs)
+        assert response.status_code in (200, 201)
+
+    def test_get_players(self):
+        # The first read loads the ladder cache, and later ones only read the
+        # ladder version.
+        self.assert_num_statements(2, 'get', '/players')
+        self.assert_num_statements(1, 'get', '/players')
+        self.assert_num_statements(1, 'get', '/players/p1/rank')
+        self.assert_num_statements(1, 'get', '/players/p1/neighbors')
+
+    def test_get_player(self):
+        self.assert_num_statements(1, 'get', '/players/p1')
+
+    def test_get_player_history(self):
+        self.assert_num_statements(3, 'get', '/players/p1/history')
+
+    def test_get_games(self):
+        self.assert_num_statements(2, 'get', '/games?count=100')
+
+    def test_get_challenges(self):
+        self.assert_num_statements(2, 'get', '/challenges')
+        self.assert_num_statements(
+            2, 'get', '/challenges?include_completed=true')
+
+    def test_export_games(self):
+        self.assert_num_statements(2, 'get', '/games/export')
+
+    def test_post_player(self):
+        self.assert_num_statements(4, 'post', '/players', data={'name': 'new'})
+
+    def test_post_game(self):
+        self.assert_num_statements(9, 'post', '/games', data={
+            'winner': 'p1',
+            'loser': 'p2',
+            'winner_score': 11,
+            'loser_score': 3,
+        })
+
+    def test_post_games_batch(self):
+        # The games are inserted with a single statement however many there
+        # are, so only the number of players in the batch adds statements.
+        games = [
+            {'winner': 'p1', 'loser': 'p2', 'winner_score': 11,
+             'loser_score': 3}
+            for _ in range(self.size)
+        ]
+        self.assert_num_statements(
+            9,
+            'post',
+            '/games/batch',
+            data=json.dumps({'games': games}),
+            content_type='application/json'
+        )
+
+    def test_post_challenge(self):
+        self.post_valid_player('new', 2000)
+        self.assert_num_statements(8, 'post', '/challenges', data={
+            'challenger': 'p1',
+            'challenged': 'new',
+        })
+
+
+class TestQueryCountsSmallLadder(BaseQueryCountTest):
+    size = 3
+
+
+class TestQueryCountsLargeLadder(BaseQueryCountTest):
+    size = 30
@@ -0,0 +1,115 @@
+"""Tests that the hot queries are served by indexes.
+
+Each test makes a request, captures the SQL it runs and asks SQLite for the
+query plan of each statement. A plan that scans a whole table, rather than
+searching an index, fails the test.
+"""
+
+from app import resource
+from app.models import db, Challenge, Game, Player, RatingChange
+
+from .test_common import capture_statements
+from .test_resources import BaseResourceTest, _get_link
+
+
+class TestQueryPlans(BaseResourceTest):
+    def setup(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_player('robert', 1200)
+        self.post_valid_challenge('colin', 'kumanan')
+        self.post_valid_game('kumanan', 'robert', 11, 3)
+        self.post_valid_game('robert', 'colin', 11, 3)
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+        db.session.commit()
+
+    def assert_uses_indexes(self, method, url, data=None, allowed_scans=()):
+        """Make a request and check the plan of every query it runs.
+
+        Args:
+            method - the HTTP method, e.g. 'get'.
+            url - the URL to request.
+            data - the request's form data, if any.
+            allowed_scans - plan steps that are allowed to scan, e.g. walking
+                an index in order for the first page of a listing.
+
+        Returns:
+            The response.
+        """
+        with capture_statements() as statements:
+            response = getattr(self.client, method)(url, data=data)
+        assert response.status_code in (200, 201)
+
+        for statement, parameters in statements:
+            if statement.split()[0] not in ('SELECT', 'UPDATE', 'DELETE'):
+                continue
+
+            plan = db.engine.execute(
+                'EXPLAIN QUERY PLAN ' + statement, parameters)
+
+            for row in plan:
+                detail = tuple(row)[-1]
+                assert not detail.startswith('SCAN') or \
+                    detail in allowed_scans, \
+                    '%s scans: %s' % (detail, statement)
+
+        return response
+
+    def test_post_game(self):
+        self.assert_uses_indexes('post', '/games', data={
+            'winner': 'colin',
+            'loser': 'kumanan',
+            'winner_score': 11,
+            'loser_score': 9
+        })
+
+    def test_post_challenge(self):
+        self.assert_uses_indexes('post', '/challenges', data={
+            'challenger': 'robert',
+            'challenged': 'kumanan',
+        })
+
+    def test_open_challenge_lookup_uses_pair_index(self):
+        colin = Player.query.filter_by(name='colin').one()
+        kumanan = Player.query.filter_by(name='kumanan').one()
+        query = resource._query_open_challenges_for_players(kumanan, colin)
+
+        with capture_statements() as statements:
+            assert query.count() == 1
+
+        statement, parameters = statements[0]
+        plan = db.engine.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+        details = [tuple(row)[-1] for row in plan]
+        assert any('uq_challenge_open_pair' in detail for detail in details), \
+            details
+
+    def test_get_games(self):
+        response = self.assert_uses_indexes(
+            'get',
+            '/games?count=1',
+            allowed_scans=['SCAN game USING INDEX ix_game_time_created_id']
+        )
+
+        # Later pages seek straight to the cursor.
+        self.assert_uses_indexes('get', _get_link(response, 'next'))
+
+    def test_get_open_challenges(self):
+        self.assert_uses_indexes('get', '/challenges')
+
+    def test_get_players_by_rating(self):
+        # The ladder cache is rebuilt from every player once per version, and
+        # after that served from memory.
+        self.assert_uses_indexes(
+            'get',
+            '/players?limit=10&min_rating=1150',
+            allowed_scans=['SCAN player']
+        )
+        self.assert_uses_indexes('get', '/players?limit=10&min_rating=1150')
+
+    def test_get_player_history(self):
+        self.assert_uses_indexes('get', '/players/colin/history')
@@ -0,0 +1,115 @@
+"""Tests for replaying the game log to recompute ratings."""
+
+from datetime import datetime
+
+from app import elo
+from app.models import db, Player, Game, RatingChange
+from app.replay import replay_ratings, apply_ratings
+
+from .test_common import BaseFlaskTest
+
+
+class TestReplay(BaseFlaskTest):
+    def setup(self):
+        self.colin = _player('colin')
+        self.kumanan = _player('kumanan')
+        self.robert = _player('robert')
+        db.session.add_all([self.colin, self.kumanan, self.robert])
+        db.session.commit()
+
+        # Added out of order to check that games are replayed by time.
+        db.session.add_all([
+            Game(winner=self.robert, loser=self.colin, winner_score=21,
+                 loser_score=5, time_created=_time(3)),
+            Game(winner=self.colin, loser=self.kumanan, winner_score=11,
+                 loser_score=9, time_created=_time(1)),
+            Game(winner=self.kumanan, loser=self.colin, winner_score=11,
+                 loser_score=3, time_created=_time(2)),
+        ])
+        db.session.commit()
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        RatingChange.query.delete()
+        db.session.commit()
+
+    def expected_ratings(self, starter_rating):
+        colin = kumanan = robert = starter_rating
+        colin, kumanan = elo.elo_update(colin, kumanan, True)
+        kumanan, colin = elo.elo_update(kumanan, colin, True)
+        robert, colin = elo.elo_update(robert, colin, False)
+        return {'colin': colin, 'kumanan': kumanan, 'robert': robert}
+
+    def test_replay(self):
+        num_games, players, skipped_game_ids = replay_ratings(1200)
+        assert num_games == 3
+        assert skipped_game_ids == []
+
+        ratings = dict((name, rating) for _, name, _, rating in players)
+        assert ratings == self.expected_ratings(1200)
+
+        # Nothing is written until the ratings are applied.
+        assert set(player.rating for player in Player.query.all()) == {1000}
+
+    def test_apply(self):
+        _, players, _ = replay_ratings(1200)
+        assert apply_ratings(players) == 3
+
+        ratings = dict(
+            (player.name, player.rating) for player in Player.query.all())
+        assert ratings == self.expected_ratings(1200)
+        assert self.colin.version == 2
+
+    def test_rewrite_history(self):
+        db.session.add(RatingChange(player=self.colin, rating_before=1))
+        db.session.commit()
+
+        _, players, _ = replay_ratings(1200, rewrite_history=True)
+        apply_ratings(players)
+
+        history = RatingChange.query \
+            .filter_by(player_id=self.colin.id) \
+            .order_by(RatingChange.time_created) \
+            .all()
+        assert [change.time_created for change in history] == \
+            [_time(1), _time(2), _time(3)]
+        assert history[0].rating_before == 1200
+        assert history[-1].rating_after == self.expected_ratings(1200)['colin']
+        assert RatingChange.query.count() == 6
+
+    def test_player_without_games_gets_starter_rating(self):
+        db.session.add(_player('michelle'))
+        db.session.commit()
+
+        _, players, _ = replay_ratings(1500)
+        ratings = dict((name, rating) for _, name, _, rating in players)
+        assert ratings['michelle'] == 1500
+
+    def test_games_with_missing_players_are_skipped(self):
+        # E.g. a player deleted by hand while foreign keys weren't enforced.
+        game = Game(winner_id=self.robert.id + 100, loser=self.colin,
+                    winner_score=21, loser_score=5, time_created=_time(4))
+        db.session.add(game)
+        db.session.commit()
+
+        num_games, players, skipped_game_ids = replay_ratings(
+            1200, rewrite_history=True)
+        apply_ratings(players)
+
+        assert num_games == 3
+        assert skipped_game_ids == [game.id]
+        ratings = dict((name, rating) for _, name, _, rating in players)
+        assert ratings == self.expected_ratings(1200)
+        assert RatingChange.query.filter_by(game_id=game.id).count() == 0
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _time(minute):
+    return datetime(2015, 12, 7, 2, minute)
+
+
+def _player(name):
+    return Player(name=name, rating=1000, time_created=_time(0))
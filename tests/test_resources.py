@@ -2,11 +2,13 @@
 
 import datetime
 import simplejson as json
+import urlparse
 
-from app.models import Challenge, Game, Player
+from app.models import Challenge, Game, Player, RatingChange, db
 from app import util
 from app import elo
-from .test_common import BaseFlaskTest
+from app import resource
+from .test_common import BaseFlaskTest, capture_statements
 
 
 class BaseResourceTest(BaseFlaskTest):
@@ -44,8 +46,8 @@ class BaseResourceTest(BaseFlaskTest):
         assert status_code == 201
         return response_data
 
-    def get_players(self):
-        response = self.client.get('/players')
+    def get_players(self, **params):
+        response = self.client.get('/players', query_string=params)
         assert response.status_code == 200
         return json.loads(response.data)
 
@@ -178,6 +180,7 @@ class TestPlayerListResourcePost(BaseResourceTest):
         Player.query.delete()
         Game.query.delete()
         Challenge.query.delete()
+        RatingChange.query.delete()
 
     def test_player_creation(self):
         datetime_str = '2015-12-06T00:27:30'
@@ -254,6 +257,7 @@ class TestPlayerListResourceGetOrdering(BaseResourceTest):
         Player.query.delete()
         Game.query.delete()
         Challenge.query.delete()
+        RatingChange.query.delete()
 
     def test_ordered_by_rating(self):
         now = util.now_as_iso_string()
@@ -293,11 +297,52 @@ class TestPlayerListResourceGetOrdering(BaseResourceTest):
         assert names == ['colin', 'kumanan', 'robert']
 
 
+class TestPlayerListResourceGetPaging(BaseResourceTest):
+    """Tests the `limit`, `offset` and `min_rating` arguments to GETs on the
+    player list resource.
+    """
+    def setup(self):
+        time = '2015-12-07T02:36:34'
+        self.post_valid_player('colin', 1100, time)
+        self.post_valid_player('kumanan', 1300, time)
+        self.post_valid_player('robert', 1200, time)
+        self.post_valid_player('michelle', 1250, time)
+        assert Player.query.count() == 4
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
+    def test_limit(self):
+        names = [player['name'] for player in self.get_players(limit=2)]
+        assert names == ['kumanan', 'michelle']
+
+    def test_limit_and_offset(self):
+        players = self.get_players(limit=2, offset=1)
+        names = [player['name'] for player in players]
+        assert names == ['michelle', 'robert']
+
+    def test_offset_past_end(self):
+        assert self.get_players(offset=10) == []
+
+    def test_min_rating(self):
+        players = self.get_players(min_rating=1200)
+        names = [player['name'] for player in players]
+        assert names == ['kumanan', 'michelle', 'robert']
+
+    def test_validate_limit(self):
+        response = self.client.get('/players?limit=-1')
+        assert response.status_code == 422
+
+
 class TestPlayerResourceGet(BaseResourceTest):
     def teardown(self):
         Player.query.delete()
         Game.query.delete()
         Challenge.query.delete()
+        RatingChange.query.delete()
 
     def test_response_format(self):
         """Verify the returned Player has all the expected fields."""
@@ -319,6 +364,18 @@ class TestPlayerResourceGet(BaseResourceTest):
             'num_losses': 0,
         }
 
+    def test_win_and_loss_counts(self):
+        colin = self.post_valid_player('colin', 1100)
+        kumanan = self.post_valid_player('kumanan', 1300)
+        self.post_valid_game(colin, kumanan, 21, 15)
+        self.post_valid_game(colin, kumanan, 11, 3)
+        self.post_valid_game(kumanan, colin, 11, 9)
+
+        response = self.client.get('/players/colin')
+        player = json.loads(response.data)
+        assert player['num_wins'] == 2
+        assert player['num_losses'] == 1
+
     def test_get_missing_player_by_name(self):
         assert Player.query.count() == 0
 
@@ -326,6 +383,78 @@ class TestPlayerResourceGet(BaseResourceTest):
         assert response.status_code == 404
 
 
+class TestPlayerHistoryResourceGet(BaseResourceTest):
+    def setup(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_player('robert', 1200)
+
+        date = '2015-12-0'
+        self.post_valid_game('colin', 'kumanan', 11, 9, date + '1T10:00:00')
+        self.post_valid_game('robert', 'kumanan', 21, 9, date + '2T10:00:00')
+        self.post_valid_game('kumanan', 'colin', 21, 9, date + '3T10:00:00')
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
+    def get_history(self, name, **params):
+        response = self.client.get(
+            '/players/%s/history' % name, query_string=params)
+        assert response.status_code == 200
+        return json.loads(response.data)
+
+    def test_history(self):
+        colin1, kumanan1 = elo.elo_update(1100, 1300, True)
+        robert, kumanan2 = elo.elo_update(1200, kumanan1, False)
+        kumanan3, colin2 = elo.elo_update(kumanan2, colin1, False)
+
+        assert self.get_history('kumanan') == [
+            {
+                'game_id': 1,
+                'rating_before': 1300,
+                'rating_after': kumanan1,
+                'delta': kumanan1 - 1300,
+                'k_value': elo.compute_k_value(True),
+                'time_created': '2015-12-01T10:00:00',
+            },
+            {
+                'game_id': 2,
+                'rating_before': kumanan1,
+                'rating_after': kumanan2,
+                'delta': kumanan2 - kumanan1,
+                'k_value': elo.compute_k_value(False),
+                'time_created': '2015-12-02T10:00:00',
+            },
+            {
+                'game_id': 3,
+                'rating_before': kumanan2,
+                'rating_after': kumanan3,
+                'delta': kumanan3 - kumanan2,
+                'k_value': elo.compute_k_value(False),
+                'time_created': '2015-12-03T10:00:00',
+            },
+        ]
+
+        history = self.get_history('colin')
+        assert [change['rating_after'] for change in history] == \
+            [colin1, colin2]
+
+    def test_time_range(self):
+        history = self.get_history(
+            'kumanan',
+            start='2015-12-02T00:00:00',
+            end='2015-12-03T10:00:00'
+        )
+        assert [change['game_id'] for change in history] == [2]
+
+    def test_missing_player(self):
+        response = self.client.get('/players/michelle/history')
+        assert response.status_code == 404
+
+
 class TestGameListResourcePost(BaseResourceTest):
     """Tests POSTs to the game list resource.
 
@@ -338,6 +467,7 @@ class TestGameListResourcePost(BaseResourceTest):
         Player.query.delete()
         Game.query.delete()
         Challenge.query.delete()
+        RatingChange.query.delete()
 
     def test_db_is_updated(self):
         datetime_str = '2012-11-02T14:22:07'
@@ -385,6 +515,15 @@ class TestGameListResourcePost(BaseResourceTest):
             assert response.status_code == 422
             assert errors['errors'][0].startswith('Invalid score')
 
+    def test_validate_reports_all_errors(self):
+        kumanan = self.post_valid_player('kumanan')
+        response, errors = self.post_game(kumanan, kumanan, 11, 11)
+        assert response.status_code == 422
+        assert len(errors['errors']) == 2
+        assert errors['errors'][0].startswith('Invalid score')
+        assert errors['errors'][1] == \
+            'Two players must be unique, but both are "kumanan"'
+
     def test_validate_good_scores(self):
 
         good_scores = (
@@ -433,6 +572,41 @@ class TestGameListResourcePost(BaseResourceTest):
         assert colin.rating == new_winner_rating
         assert kumanan.rating == new_loser_rating
 
+    def test_players_versions_are_updated(self):
+        self.post_player('colin', 1100)
+        self.post_player('kumanan', 1300)
+        self.post_valid_game('colin', 'kumanan', 11, 9)
+
+        for player in Player.query.all():
+            assert player.version == 2
+
+    def test_retries_after_concurrent_rating_update(self, monkeypatch):
+        self.post_player('colin', 1100)
+        self.post_player('kumanan', 1300)
+
+        calls = []
+        elo_update = elo.elo_update
+
+        def elo_update_with_concurrent_write(*args):
+            # The first time through, another writer updates colin after his
+            # rating has been read, so the version check fails and the game is
+            # recorded again from scratch.
+            if not calls:
+                Player.query.filter_by(name='colin').update(
+                    {Player.version: Player.version + 1},
+                    synchronize_session=False
+                )
+            calls.append(args)
+            return elo_update(*args)
+
+        monkeypatch.setattr(
+            resource.elo, 'elo_update', elo_update_with_concurrent_write)
+        self.post_valid_game('colin', 'kumanan', 11, 9)
+
+        assert len(calls) == 2
+        assert Game.query.count() == 1
+        assert Player.query.filter_by(name='colin').first().num_wins == 1
+
     def test_new_game_updates_existing_challenge(self):
         kumanan = self.post_valid_player('kumanan', rating=1350)
         michelle = self.post_valid_player('michelle', rating=1250)
@@ -457,6 +631,138 @@ class TestGameListResourcePost(BaseResourceTest):
         assert challenge.is_completed is True
 
 
+class TestGameBatchResourcePost(BaseResourceTest):
+    """Tests POSTs to the game batch resource."""
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
+    def post_games(self, games):
+        response = self.client.post(
+            '/games/batch',
+            data=json.dumps({'games': games}),
+            content_type='application/json'
+        )
+        return response.status_code, json.loads(response.data)
+
+    def test_games_are_applied_in_order(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_player('robert', 1200)
+
+        status_code, game_ids = self.post_games([
+            _game('colin', 'kumanan', 11, 9, '2015-12-07T02:36:34'),
+            _game('robert', 'colin', 21, 19, '2015-12-07T02:46:34'),
+            _game('kumanan', 'robert', 11, 2),
+        ])
+        assert status_code == 201
+        assert game_ids == [1, 2, 3]
+        assert Game.query.count() == 3
+        assert Game.query.get(2).time_created == \
+            util.parse_datetime('2015-12-07T02:46:34')
+
+        colin, kumanan = elo.elo_update(1100, 1300, True)
+        robert, colin = elo.elo_update(1200, colin, False)
+        kumanan, robert = elo.elo_update(kumanan, robert, True)
+
+        ratings = dict(
+            (player.name, player.rating) for player in Player.query.all())
+        assert ratings == {
+            'colin': colin,
+            'kumanan': kumanan,
+            'robert': robert,
+        }
+
+        colin = Player.query.filter_by(name='colin').first()
+        assert (colin.num_wins, colin.num_losses) == (1, 1)
+
+        history = RatingChange.query \
+            .filter_by(player_id=colin.id) \
+            .order_by(RatingChange.time_created) \
+            .all()
+        assert [change.game_id for change in history] == [1, 2]
+        assert history[1].rating_after == colin.rating
+
+    def assert_ids_follow_existing_games(self, num_game_inserts):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_game('colin', 'kumanan', 11, 9)
+
+        with capture_statements() as statements:
+            status_code, game_ids = self.post_games([
+                _game('kumanan', 'colin', 11, 9),
+                _game('colin', 'kumanan', 21, 19),
+            ])
+        assert status_code == 201
+        assert game_ids == [2, 3]
+        assert Game.query.get(3).winner_score == 21
+
+        changes = RatingChange.query.filter(RatingChange.game_id.in_(game_ids))
+        assert sorted(change.game_id for change in changes) == [2, 2, 3, 3]
+
+        game_inserts = [statement for statement, _ in statements
+                        if statement.startswith('INSERT INTO game ')]
+        assert len(game_inserts) == num_game_inserts
+
+    def test_ids_follow_existing_games(self):
+        self.assert_ids_follow_existing_games(num_game_inserts=1)
+
+    def test_ids_without_single_writer(self, monkeypatch):
+        # Other databases insert and read back each game's ID on its own.
+        monkeypatch.setattr(resource, '_has_single_writer', lambda: False)
+        self.assert_ids_follow_existing_games(num_game_inserts=2)
+
+    def test_games_close_open_challenges(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_player('robert', 1200)
+        self.post_valid_challenge('colin', 'kumanan')
+        self.post_valid_challenge('robert', 'kumanan')
+
+        status_code, game_ids = self.post_games([
+            _game('kumanan', 'colin', 11, 9),
+            _game('colin', 'kumanan', 11, 9),
+        ])
+        assert status_code == 201
+
+        challenges = Challenge.query.order_by(Challenge.id).all()
+        assert challenges[0].game_id == game_ids[0]
+        assert challenges[1].game_id is None
+
+    def test_all_errors_are_reported(self):
+        self.post_valid_player('colin')
+        self.post_valid_player('kumanan')
+
+        status_code, response_data = self.post_games([
+            _game('colin', 'kumanan', 11, 9),
+            _game('colin', 'robert', 11, 9),
+            _game('colin', 'colin', 11, 11),
+        ])
+        assert status_code == 422
+        assert response_data['errors']['games'] == {
+            '1': ['Player "robert" does not exist'],
+            '2': [
+                'Invalid score: winner score must be 21 or 11 and loser score '
+                'must be at least one lower.',
+                'Two players must be unique, but both are "colin"',
+            ],
+        }
+        assert Game.query.count() == 0
+
+    def test_validate_fields(self):
+        status_code, response_data = self.post_games([{'winner': 'colin'}])
+        assert status_code == 422
+        assert sorted(response_data['errors']['games']['0'].keys()) == \
+            ['loser', 'loser_score', 'winner_score']
+
+    def test_validate_empty_batch(self):
+        status_code, response_data = self.post_games([])
+        assert status_code == 422
+
+
 class TestGetGames(BaseResourceTest):
     def setup(self):
         colin = self.post_valid_player('colin')
@@ -478,6 +784,7 @@ class TestGetGames(BaseResourceTest):
         Player.query.delete()
         Game.query.delete()
         Challenge.query.delete()
+        RatingChange.query.delete()
 
     def test_get_games(self):
         """
@@ -516,12 +823,196 @@ class TestGetGames(BaseResourceTest):
         games = self.get_games(count=1)
         assert len(games) == 1 and games[0]['id'] == 3
 
+    def test_page_through_with_cursors(self):
+        response = self.client.get('/games?count=2')
+        assert [game['id'] for game in json.loads(response.data)] == [3, 1]
+        next_url = _get_link(response, 'next')
+        assert _get_link(response, 'prev') is None
+
+        response = self.client.get(next_url)
+        assert [game['id'] for game in json.loads(response.data)] == [2]
+        assert _get_link(response, 'next') is None
+        prev_url = _get_link(response, 'prev')
+
+        response = self.client.get(prev_url)
+        assert [game['id'] for game in json.loads(response.data)] == [3, 1]
+
+    def test_validate_cursors(self):
+        response = self.client.get('/games?before=garbage')
+        assert response.status_code == 422
+
+        cursor = util.encode_cursor(util.parse_datetime(self.g1_time), 1)
+        response = self.client.get(
+            '/games?before=%s&after=%s' % (cursor, cursor))
+        assert response.status_code == 422
+
+
+class TestGameExportResourceGet(BaseResourceTest):
+    def setup(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_game('kumanan', 'colin', 21, 3, '2015-12-01T10:00:00')
+        self.post_valid_game('colin', 'kumanan', 11, 9, '2015-12-02T10:00:00')
+        self.post_valid_game('colin', 'kumanan', 21, 19, '2015-12-03T10:00:00')
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
+    def test_ndjson(self, monkeypatch):
+        # Make sure games are streamed across several chunks.
+        monkeypatch.setattr(resource, 'EXPORT_CHUNK_SIZE', 2)
+
+        response = self.client.get('/games/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/x-ndjson'
+
+        games = [json.loads(line) for line in response.data.splitlines()]
+        assert games == list(reversed(self.get_games()))
+
+    def test_csv(self, monkeypatch):
+        monkeypatch.setattr(resource, 'EXPORT_CHUNK_SIZE', 2)
+
+        response = self.client.get('/games/export?format=csv')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert response.data.splitlines() == [
+            'id,winner,loser,winner_score,loser_score,time_created',
+            '1,kumanan,colin,21,3,2015-12-01T10:00:00',
+            '2,colin,kumanan,11,9,2015-12-02T10:00:00',
+            '3,colin,kumanan,21,19,2015-12-03T10:00:00',
+        ]
+
+    def test_games_without_players(self):
+        # E.g. after the winner was deleted, with foreign keys off.
+        Player.query.filter_by(name='kumanan').delete()
+        db.session.commit()
+
+        response = self.client.get('/games/export')
+        games = [json.loads(line) for line in response.data.splitlines()]
+        assert games == list(reversed(self.get_games()))
+        assert 'winner' not in games[0]
+        assert games[0]['loser'] == 'colin'
+
+        response = self.client.get('/games/export?format=csv')
+        assert response.data.splitlines() == [
+            'id,winner,loser,winner_score,loser_score,time_created',
+            '1,,colin,21,3,2015-12-01T10:00:00',
+            '2,colin,,11,9,2015-12-02T10:00:00',
+            '3,colin,,21,19,2015-12-03T10:00:00',
+        ]
+
+    def test_empty(self):
+        Game.query.delete()
+
+        response = self.client.get('/games/export')
+        assert response.data == ''
+
+        response = self.client.get('/games/export?format=csv')
+        assert response.data.splitlines() == [
+            'id,winner,loser,winner_score,loser_score,time_created']
+
+    def test_validate_format(self):
+        response = self.client.get('/games/export?format=xml')
+        assert response.status_code == 422
+
+
+class TestRatingReplayResourcePost(BaseResourceTest):
+    def setup(self):
+        self.app.config['ADMIN_TOKEN'] = 'secret'
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+        self.post_valid_game('colin', 'kumanan', 11, 9)
+
+    def teardown(self):
+        self.app.config['ADMIN_TOKEN'] = None
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
+    def post_replay(self, **data):
+        response = self.client.post(
+            '/admin/replay',
+            data=data,
+            headers={resource.ADMIN_TOKEN_HEADER: 'secret'}
+        )
+        assert response.status_code == 200
+        return json.loads(response.data)
+
+    def assert_not_replayed(self):
+        colin, _ = elo.elo_update(1100, 1300, True)
+        assert Player.query.filter_by(name='colin').first().rating == colin
+
+    def test_plain_request_is_rejected(self):
+        response = self.client.post('/admin/replay',
+                                    data={'starter_rating': 1000})
+        assert response.status_code == 403
+        self.assert_not_replayed()
+
+    def test_wrong_token_is_rejected(self):
+        response = self.client.post(
+            '/admin/replay',
+            data={'starter_rating': 1000},
+            headers={resource.ADMIN_TOKEN_HEADER: 'guess'}
+        )
+        assert response.status_code == 403
+        self.assert_not_replayed()
+
+    def test_disabled_without_token(self):
+        self.app.config['ADMIN_TOKEN'] = None
+        response = self.client.post(
+            '/admin/replay',
+            data={'starter_rating': 1000},
+            headers={resource.ADMIN_TOKEN_HEADER: ''}
+        )
+        assert response.status_code == 404
+        self.assert_not_replayed()
+
+    def test_dry_run(self):
+        old_colin, old_kumanan = elo.elo_update(1100, 1300, True)
+        new_colin, new_kumanan = elo.elo_update(1200, 1200, True)
+
+        response_data = self.post_replay(dry_run='true')
+
+        assert response_data['num_games'] == 1
+        assert response_data['skipped_game_ids'] == []
+        assert sorted(response_data['players']) == [
+            {
+                'name': 'colin',
+                'old_rating': old_colin,
+                'new_rating': new_colin
+            },
+            {
+                'name': 'kumanan',
+                'old_rating': old_kumanan,
+                'new_rating': new_kumanan
+            },
+        ]
+        assert Player.query.filter_by(name='colin').first().rating == old_colin
+
+    def test_replay_with_starter_rating(self):
+        self.post_replay(starter_rating=1000)
+
+        colin, kumanan = elo.elo_update(1000, 1000, True)
+        assert Player.query.filter_by(name='colin').first().rating == colin
+        assert Player.query.filter_by(name='kumanan').first().rating == kumanan
+
+        colin_history = Player.query.filter_by(name='colin').first() \
+            .rating_changes
+        assert len(colin_history) == 1
+        assert colin_history[0].rating_before == 1000
+        assert colin_history[0].rating_after == colin
+
 
 class TestChallengeListResourcePost(BaseResourceTest):
     def teardown(self):
         Player.query.delete()
         Game.query.delete()
         Challenge.query.delete()
+        RatingChange.query.delete()
 
     def test_db_is_updated(self):
         time1 = '2014-12-07T02:36:34'
@@ -540,6 +1031,10 @@ class TestChallengeListResourcePost(BaseResourceTest):
         assert challenge.challenged.name == 'colin'
         assert challenge.time_created == util.parse_datetime(time2)
 
+        assert challenge.challenger.num_challenges_submitted == 1
+        assert challenge.challenger.num_challenges_received == 0
+        assert challenge.challenged.num_challenges_received == 1
+
     def test_validate_both_players_exist(self):
         self.post_valid_player('robert')
         assert Player.query.count() == 1
@@ -572,6 +1067,18 @@ class TestChallengeListResourcePost(BaseResourceTest):
         assert errors['errors'][0] == \
             'The challenger must have a lower rating than the challenged'
 
+    def test_validate_reports_all_errors(self):
+        colin = self.post_valid_player('colin', rating=1100)
+        kumanan = self.post_valid_player('kumanan', rating=1200)
+        self.post_valid_challenge(colin, kumanan)
+
+        status_code, errors = self.post_challenge(kumanan, colin)
+        assert status_code == 422
+        assert errors['errors'] == [
+            'There is an open challenge between the two players',
+            'The challenger must have a lower rating than the challenged',
+        ]
+
     def test_time_defaults_to_now(self):
         colin = self.post_valid_player('colin', rating=1100)
         kumanan = self.post_valid_player('kumanan', rating=1300)
@@ -605,6 +1112,34 @@ class TestChallengeListResourcePost(BaseResourceTest):
         assert errors['errors'][0] == \
             'There is an open challenge between the two players'
 
+    def test_concurrent_open_challenge(self, monkeypatch):
+        # Another request opens the same challenge between this one's
+        # validation and its insert, so only the unique index catches it.
+        colin = self.post_valid_player('colin', rating=1100)
+        kumanan = self.post_valid_player('kumanan', rating=1200)
+        self.post_valid_challenge(colin, kumanan)
+
+        monkeypatch.setattr(resource, '_validate_no_open_challenges',
+                            lambda challenger, challenged: None)
+        status_code, errors = self.post_challenge(colin, kumanan)
+        assert status_code == 422
+        assert errors['errors'] == [
+            'There is an open challenge between the two players'
+        ]
+        assert Challenge.query.count() == 1
+
+    def test_validate_game_exists(self):
+        colin = self.post_valid_player('colin', rating=1100)
+        kumanan = self.post_valid_player('kumanan', rating=1200)
+
+        status_code, errors = self.post_challenge(colin, kumanan, game_id=99)
+        assert status_code == 422
+        assert errors['errors'] == {'game_id': ['Game 99 does not exist']}
+        assert Challenge.query.count() == 0
+
+        game_id = self.post_valid_game(kumanan, colin, 11, 3)
+        assert self.post_valid_challenge(colin, kumanan, game_id=game_id) == 1
+
 
 class TestChallengeListResourceGet(BaseResourceTest):
     def setup(self):
@@ -637,23 +1172,148 @@ class TestChallengeListResourceGet(BaseResourceTest):
         )
         assert Game.query.count() == 1
 
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
     def test_response(self):
+        # Both challenges were created at the same time, so the most recent
+        # one is the one with the higher ID.
         expected = [
             {
-                'id': 1,
+                'id': 2,
                 'challenger': 'colin',
-                'challenged': 'kumanan',
+                'challenged': 'robert',
                 'time_created': self.time_str,
-                'game_id': None
+                'game_id': self.game_id
             },
             {
-                'id': 2,
+                'id': 1,
                 'challenger': 'colin',
-                'challenged': 'robert',
+                'challenged': 'kumanan',
                 'time_created': self.time_str,
-                'game_id': self.game_id
+                'game_id': None
             }
         ]
 
         assert self.get_challenges(include_completed=True) == expected
-        assert self.get_challenges() == [expected[0]]
+        assert self.get_challenges() == [expected[1]]
+
+    def test_page_through_with_cursors(self):
+        response = self.client.get(
+            '/challenges?count=1&include_completed=true')
+        assert [c['id'] for c in json.loads(response.data)] == [2]
+
+        response = self.client.get(_get_link(response, 'next'))
+        assert [c['id'] for c in json.loads(response.data)] == [1]
+
+
+class TestConditionalGet(BaseResourceTest):
+    def setup(self):
+        self.post_valid_player('colin', 1100)
+        self.post_valid_player('kumanan', 1300)
+
+    def teardown(self):
+        Player.query.delete()
+        Game.query.delete()
+        Challenge.query.delete()
+        RatingChange.query.delete()
+
+    def test_list_endpoints_are_tagged(self):
+        for url in ('/players', '/games', '/challenges',
+                    '/players/colin/history'):
+            response = self.client.get(url)
+            assert response.status_code == 200
+            assert response.headers['ETag']
+            assert response.headers['Last-Modified']
+
+    def test_if_none_match(self):
+        etag = self.client.get('/players').headers['ETag']
+
+        with capture_statements() as statements:
+            response = self.client.get(
+                '/players', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == ''
+        assert response.headers['ETag'] == etag
+
+        # Only the version was read.
+        assert len(statements) == 1
+        assert 'ladder_state' in statements[0][0]
+        assert 'player' not in statements[0][0]
+
+    def test_write_changes_etag(self):
+        etag = self.client.get('/players').headers['ETag']
+        self.post_valid_game('kumanan', 'colin', 11, 3)
+
+        response = self.client.get(
+            '/players', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert response.headers['ETag'] != etag
+
+    def test_if_modified_since_is_ignored(self):
+        response = self.client.get('/games')
+        last_modified = response.headers['Last-Modified']
+
+        response = self.client.get(
+            '/games', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 200
+
+    def test_writes_in_the_same_second(self, monkeypatch):
+        # Every write lands in the same second, so Last-Modified can't change.
+        now = datetime.datetime(2015, 12, 8, 6, 22, 59)
+        monkeypatch.setattr(util, 'now', lambda: now)
+
+        self.post_valid_game('kumanan', 'colin', 11, 3)
+        response = self.client.get('/games')
+        etag = response.headers['ETag']
+        last_modified = response.headers['Last-Modified']
+
+        self.post_valid_game('kumanan', 'colin', 11, 5)
+        response = self.client.get('/games', headers={
+            'If-None-Match': etag,
+            'If-Modified-Since': last_modified,
+        })
+        assert response.status_code == 200
+        assert response.headers['Last-Modified'] == last_modified
+        assert response.headers['ETag'] != etag
+        assert len(json.loads(response.data)) == 2
+
+        response = self.client.get(
+            '/games', headers={'If-Modified-Since': last_modified})
+        assert response.status_code == 200
+        assert len(json.loads(response.data)) == 2
+
+    def test_errors_are_not_tagged(self):
+        response = self.client.get('/players/nobody/history')
+        assert response.status_code == 404
+        assert 'ETag' not in response.headers
+
+
+###############################################################################
+# Helpers
+###############################################################################
+def _game(winner, loser, winner_score, loser_score, time_created=None):
+    """Make a game to be included in a POST to /games/batch."""
+    game = {
+        'winner': winner,
+        'loser': loser,
+        'winner_score': winner_score,
+        'loser_score': loser_score,
+    }
+    if time_created is not None:
+        game['time_created'] = time_created
+    return game
+
+
+def _get_link(response, rel):
+    """Return the path and query string of the URL for `rel` in a response's
+    `Link` header, or None.
+    """
+    for link in response.headers.get('Link', '').split(', '):
+        if link.endswith('rel="%s"' % rel):
+            url = urlparse.urlparse(link[link.index('<') + 1:link.index('>')])
+            return '%s?%s' % (url.path, url.query)
+    return None
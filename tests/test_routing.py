@@ -0,0 +1,144 @@
+"""Tests for routing reads to the read engine."""
+
+import contextlib
+import os
+import shutil
+import tempfile
+import time
+
+import simplejson as json
+from sqlalchemy import event
+
+from app import routing
+from app.app import create_app
+from app.models import Challenge, Game, Player, RatingChange, db
+
+from .test_resources import BaseResourceTest
+
+
+class TestRouting(object):
+    @classmethod
+    def setup_class(cls):
+        cls.directory = tempfile.mkdtemp()
+        uri = 'sqlite:///' + os.path.join(cls.directory, 'ladder.db')
+
+        cls.app = create_app()
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = uri
+        cls.app.config['SQLALCHEMY_BINDS'] = {routing.READ_BIND: uri}
+        with cls.app.app_context():
+            db.create_all()
+
+    @classmethod
+    def teardown_class(cls):
+        with cls.app.app_context():
+            for bind in (None, routing.READ_BIND):
+                db.get_engine(cls.app, bind=bind).dispose()
+        shutil.rmtree(cls.directory)
+
+    def setup(self):
+        # Requests push their own app context, so their sessions are removed
+        # when they end, as when serving.
+        self.client = self.app.test_client()
+
+    def teardown(self):
+        with self.app.app_context():
+            Player.query.delete()
+            Game.query.delete()
+            Challenge.query.delete()
+            RatingChange.query.delete()
+            db.session.commit()
+
+    @contextlib.contextmanager
+    def capture_engines(self):
+        """Record which engines the statements within the block run on.
+
+        Yields:
+            A list that is filled with the bind key of each statement's
+            engine, None for the primary, as it is executed.
+        """
+        binds = []
+        listeners = []
+        with self.app.app_context():
+            for bind in (None, routing.READ_BIND):
+                def record(conn, cursor, statement, parameters, context,
+                           executemany, bind=bind):
+                    binds.append(bind)
+                engine = db.get_engine(self.app, bind=bind)
+                event.listen(engine, 'before_cursor_execute', record)
+                listeners.append((engine, record))
+        try:
+            yield binds
+        finally:
+            for engine, record in listeners:
+                event.remove(engine, 'before_cursor_execute', record)
+
+    def post_player(self, name):
+        return self.client.post('/players', data={'name': name})
+
+    def test_reads_use_the_read_engine(self):
+        self.post_player('colin')
+        self.client.cookie_jar.clear()
+
+        for url in ('/players', '/players/colin', '/games', '/challenges'):
+            with self.capture_engines() as binds:
+                response = self.client.get(url)
+            assert response.status_code == 200
+            assert binds
+            assert set(binds) == set([routing.READ_BIND]), url
+
+    def test_writes_use_the_primary(self):
+        with self.capture_engines() as binds:
+            response = self.post_player('colin')
+        assert response.status_code == 201
+        assert binds
+        assert set(binds) == set([None])
+
+    def test_reads_stay_on_the_primary_after_a_write(self):
+        response = self.post_player('colin')
+        assert routing.WROTE_AT_COOKIE in response.headers['Set-Cookie']
+
+        with self.capture_engines() as binds:
+            response = self.client.get('/players')
+        assert [player['name'] for player in
+                json.loads(response.data)] == ['colin']
+        assert set(binds) == set([None])
+
+    def test_reads_return_to_the_read_engine_after_the_window(self):
+        self.post_player('colin')
+        window = self.app.config['READ_YOUR_WRITES_SECONDS']
+        self.client.set_cookie('localhost', routing.WROTE_AT_COOKIE,
+                               '%.3f' % (time.time() - window - 1))
+
+        with self.capture_engines() as binds:
+            self.client.get('/players')
+        assert set(binds) == set([routing.READ_BIND])
+
+    def test_malformed_cookie_is_ignored(self):
+        self.client.set_cookie('localhost', routing.WROTE_AT_COOKIE, 'nope')
+
+        with self.capture_engines() as binds:
+            self.client.get('/players')
+        assert set(binds) == set([routing.READ_BIND])
+
+    def test_failed_write_sets_no_cookie(self):
+        self.post_player('colin')
+        self.client.cookie_jar.clear()
+
+        response = self.post_player('colin')
+        assert response.status_code == 422
+        assert 'Set-Cookie' not in response.headers
+
+
+class TestWithoutReadEngine(BaseResourceTest):
+    def teardown(self):
+        Player.query.delete()
+        db.session.commit()
+
+    def test_write_sets_no_cookie(self):
+        status_code, _ = self.post_player('colin')
+        assert status_code == 201
+
+        response = self.client.get('/players')
+        assert response.status_code == 200
+        assert 'Set-Cookie' not in response.headers
+        assert not list(self.client.cookie_jar)
@@ -0,0 +1,135 @@
+"""Tests that the compiled serializers match the marshmallow schemas."""
+
+from datetime import datetime
+
+import pytest
+from marshmallow import Schema, fields
+
+from app import schemas
+from app.models import Challenge, Game, Player, RatingChange, db
+
+from .test_models import BaseTestWithData
+
+
+class TestCompiledSerializers(BaseTestWithData):
+    def teardown(self):
+        super(TestCompiledSerializers, self).teardown()
+        RatingChange.query.delete()
+
+    def assert_same_as_schema(self, serialize, schema, objs):
+        assert [serialize(obj) for obj in objs] == schema.dump(objs).data
+
+    def test_player(self):
+        self.assert_same_as_schema(
+            schemas.serialize_player,
+            schemas.players_schema,
+            Player.query.all()
+        )
+
+    def test_game(self):
+        # Marshmallow itself can't serialize a game without a time.
+        games = Game.query.filter(Game.time_created != None).all()
+        self.assert_same_as_schema(
+            schemas.serialize_game,
+            schemas.games_schema,
+            games
+        )
+
+    def test_game_without_players(self):
+        # E.g. after its players were deleted, with foreign keys off.
+        game = Game(
+            id=10,
+            winner_id=100,
+            loser_id=self.colin.id,
+            winner_score=11,
+            loser_score=3,
+            time_created=datetime(2015, 12, 1, 10)
+        )
+        orphaned = Game(
+            id=11,
+            winner_score=11,
+            loser_score=3,
+            time_created=datetime(2015, 12, 1, 10)
+        )
+        db.session.add_all([game, orphaned])
+        db.session.flush()
+
+        games = [Game.query.get(10), Game.query.get(11)]
+        assert games[0].winner is None
+        self.assert_same_as_schema(
+            schemas.serialize_game,
+            schemas.games_schema,
+            games
+        )
+        assert 'winner' not in schemas.serialize_game(games[0])
+        assert schemas.serialize_game(games[0])['loser'] == 'colin'
+
+    def test_challenge(self):
+        # Includes open challenges, whose game IDs are None.
+        self.assert_same_as_schema(
+            schemas.serialize_challenge,
+            schemas.challenges_schema,
+            Challenge.query.all()
+        )
+
+    def test_rating_change(self):
+        rating_change = RatingChange(
+            game_id=self.game1.id,
+            player_id=self.kumanan.id,
+            rating_before=1300,
+            rating_after=1310,
+            delta=10,
+            k_value=20,
+            time_created=datetime(2015, 12, 1, 10)
+        )
+        self.assert_same_as_schema(
+            schemas.serialize_rating_change,
+            schemas.rating_changes_schema,
+            [rating_change]
+        )
+
+    def test_byte_string_names(self):
+        player = Player(
+            name='caf\xc3\xa9',
+            rating=1200,
+            num_wins=0,
+            num_losses=0,
+            time_created=datetime(2015, 12, 1, 10)
+        )
+        assert schemas.serialize_player(player) == \
+            schemas.player_schema.dump(player).data
+
+    def test_none_along_dotted_attribute(self):
+        class NestedSchema(Schema):
+            value = fields.Int(attribute='a.b.c')
+            other = fields.Int(attribute='a.d')
+
+        serialize = schemas.compile_serializer(NestedSchema())
+        for obj in (
+            _Object(a=None),
+            _Object(a=_Object(b=None, d=1)),
+            _Object(a=_Object(b=_Object(c=2), d=None)),
+        ):
+            assert serialize(obj) == NestedSchema().dump(obj).data
+
+    def test_unsupported_field(self):
+        class FloatSchema(Schema):
+            value = fields.Float()
+
+        with pytest.raises(TypeError):
+            schemas.compile_serializer(FloatSchema())
+
+    def test_unsupported_attribute(self):
+        class MethodSchema(Schema):
+            value = fields.Int(attribute='__class__()')
+
+        with pytest.raises(TypeError):
+            schemas.compile_serializer(MethodSchema())
+
+
+###############################################################################
+# Helpers
+###############################################################################
+class _Object(object):
+    def __init__(self, **attributes):
+        self.__dict__.update(attributes)
@@ -0,0 +1,42 @@
+"""Tests for the production server's settings."""
+
+import multiprocessing
+
+from app import server
+from app.app import create_app
+
+
+class TestGetOptions(object):
+    def setup(self):
+        self.config = {
+            'PORT': 6789,
+            'SERVER': {
+                'HOST': '0.0.0.0',
+                'WORKERS': 3,
+                'THREADS': 4,
+                'TIMEOUT': 30,
+                'GRACEFUL_TIMEOUT': 20,
+            },
+        }
+
+    def test_options(self):
+        assert server.get_options(self.config) == {
+            'bind': '0.0.0.0:6789',
+            'workers': 3,
+            'threads': 4,
+            'timeout': 30,
+            'graceful_timeout': 20,
+        }
+
+    def test_default_workers(self):
+        self.config['SERVER']['WORKERS'] = None
+        options = server.get_options(self.config)
+        assert options['workers'] == multiprocessing.cpu_count() * 2 + 1
+
+    def test_production_config(self, monkeypatch):
+        monkeypatch.setenv('FLASK_ENV', 'PRODUCTION')
+        config = create_app().config
+
+        options = server.get_options(config)
+        assert options['bind'] == '127.0.0.1:%d' % config['PORT']
+        assert options['threads'] == config['SERVER']['THREADS']
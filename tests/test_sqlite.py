@@ -0,0 +1,144 @@
+"""Tests for the tuning of SQLite databases."""
+
+import os
+import shutil
+import sqlite3
+import tempfile
+
+import simplejson as json
+from sqlalchemy.pool import QueuePool
+
+from app import sqlite
+from app.app import create_app
+from app.models import Player, db
+
+from .test_common import BaseFlaskTest, capture_statements
+
+
+class TestPragmas(BaseFlaskTest):
+    def test_pragmas_are_set(self):
+        assert db.session.execute('PRAGMA busy_timeout').scalar() == 5000
+        assert db.session.execute('PRAGMA cache_size').scalar() == -65536
+        assert db.session.execute('PRAGMA foreign_keys').scalar() == 0
+
+    def test_begin_statement(self):
+        for method, immediate_writes, expected in (
+            ('GET', True, 'BEGIN'),
+            ('HEAD', True, 'BEGIN'),
+            ('POST', True, 'BEGIN IMMEDIATE'),
+            ('PUT', True, 'BEGIN IMMEDIATE'),
+            ('POST', False, 'BEGIN'),
+        ):
+            with self.app.test_request_context(method=method):
+                assert sqlite.get_begin_statement(immediate_writes) == \
+                    expected
+
+        assert sqlite.get_begin_statement(True) == 'BEGIN'
+
+    def test_begin_is_not_counted_as_a_statement(self):
+        db.session.commit()
+        with capture_statements() as statements:
+            Player.query.count()
+        assert len(statements) == 1
+
+
+class TestDatabaseFile(object):
+    @classmethod
+    def setup_class(cls):
+        cls.directory = tempfile.mkdtemp()
+        cls.path = os.path.join(cls.directory, 'ladder.db')
+
+        cls.app = create_app()
+        cls.app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///' + cls.path
+        cls.app.config['SQLITE']['PRAGMAS'].update({
+            'journal_mode': 'wal',
+            'busy_timeout': 100,
+        })
+        cls.app_context = cls.app.app_context()
+        cls.app_context.push()
+        db.create_all()
+
+        cls.client = cls.app.test_client()
+
+    @classmethod
+    def teardown_class(cls):
+        db.session.remove()
+        db.engine.dispose()
+        cls.app_context.pop()
+        shutil.rmtree(cls.directory)
+
+    def teardown(self):
+        Player.query.delete()
+        db.session.commit()
+
+    def lock_for_writing(self):
+        """Return a connection from another "process" that holds the write
+        lock."""
+        connection = sqlite3.connect(self.path, isolation_level=None)
+        connection.execute('BEGIN IMMEDIATE')
+        return connection
+
+    def test_connections_are_pooled_and_tuned(self):
+        assert isinstance(db.engine.pool, QueuePool)
+        assert db.session.execute('PRAGMA journal_mode').scalar() == 'wal'
+
+    def test_reads_while_another_process_writes(self):
+        response = self.client.post('/players', data={'name': 'colin'})
+        assert response.status_code == 201
+
+        connection = self.lock_for_writing()
+        try:
+            response = self.client.get('/players')
+            assert response.status_code == 200
+        finally:
+            connection.rollback()
+            connection.close()
+
+    def post_while_locked(self):
+        """POST a player while another "process" holds the write lock."""
+        connection = self.lock_for_writing()
+        try:
+            return self.client.post('/players', data={'name': 'colin'})
+        finally:
+            connection.rollback()
+            connection.close()
+            db.session.remove()
+
+    def test_writes_wait_for_the_write_lock(self, monkeypatch):
+        # In production, errors aren't propagated, and Flask-RESTful would
+        # turn them into a 500.
+        for propagate in (True, False):
+            monkeypatch.setitem(
+                self.app.config, 'PROPAGATE_EXCEPTIONS', propagate)
+            response = self.post_while_locked()
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+            assert json.loads(response.data) == {
+                'message': sqlite.LOCKED_MESSAGE}
+
+        response = self.client.post('/players', data={'name': 'colin'})
+        assert response.status_code == 201
+
+    def test_deferred_writes_fail_at_the_write_lock(self, monkeypatch):
+        # Without IMMEDIATE_WRITES, the lock is only asked for at the first
+        # write, and its error is wrapped by SQLAlchemy.
+        monkeypatch.setattr(
+            sqlite, 'get_begin_statement', lambda immediate_writes: 'BEGIN')
+        for propagate in (True, False):
+            monkeypatch.setitem(
+                self.app.config, 'PROPAGATE_EXCEPTIONS', propagate)
+            response = self.post_while_locked()
+            assert response.status_code == 503
+            assert response.headers['Retry-After'] == '1'
+        assert Player.query.count() == 0
+
+    def test_other_errors_are_not_retryable(self, monkeypatch):
+        monkeypatch.setattr(
+            sqlite, 'get_begin_statement', lambda immediate_writes: 'BEGIN X')
+        monkeypatch.setitem(self.app.config, 'PROPAGATE_EXCEPTIONS', False)
+        response = self.client.post('/players', data={'name': 'colin'})
+        db.session.remove()
+        # So that teardown can begin transactions.
+        monkeypatch.undo()
+        assert response.status_code == 500
+        assert 'Retry-After' not in response.headers